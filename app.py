@@ -1,17 +1,35 @@
 import sqlite3
-from flask import Flask, g, render_template, request, redirect, url_for, flash, session, jsonify, make_response
+from flask import Flask, g, has_request_context, render_template, request, redirect, url_for, flash, session, jsonify, make_response, Response, stream_with_context, send_file
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.http import is_resource_modified
+from werkzeug.datastructures import FileStorage
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user, UserMixin
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import uuid
+import json
+import hashlib
+import csv
+import gzip
+import io
+import zipfile
+import zlib
 import os
+import time
+import threading
+import atexit
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import re
+from collections import OrderedDict
+from difflib import SequenceMatcher
+from markupsafe import Markup, escape
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'notes.db')
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET', 'dev-secret')
-app.config['DATABASE'] = DB_PATH
+app.config['DATABASE'] = os.environ.get('NOTES_DB') or DB_PATH
 
 # Flask-Login setup
 login_manager = LoginManager()
@@ -26,58 +44,1326 @@ NOTE_TEMPLATES = {
 }
 
 
+# SQLite connection settings. Connections run in WAL mode so autosave writes
+# don't block dashboard readers, and writers wait up to busy_timeout for the
+# lock instead of failing with "database is locked".
+app.config['DB_BUSY_TIMEOUT_MS'] = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+app.config['DB_SYNCHRONOUS'] = os.environ.get('DB_SYNCHRONOUS', 'NORMAL')
+app.config['DB_CACHE_SIZE_KB'] = int(os.environ.get('DB_CACHE_SIZE_KB', 16384))
+app.config['DB_MMAP_SIZE'] = int(os.environ.get('DB_MMAP_SIZE', 64 * 1024 * 1024))
+# a write that takes longer than this to start/commit is counted as a lock wait
+app.config['DB_LOCK_WAIT_MS'] = int(os.environ.get('DB_LOCK_WAIT_MS', 50))
+app.config['STATS_ENABLED'] = os.environ.get('STATS_ENABLED') == '1'
+# request/query profiling (route latency histograms, per-query timings, slow
+# query log, /metrics, Server-Timing header); costs nothing when off
+app.config['PROFILING_ENABLED'] = os.environ.get('PROFILING_ENABLED') == '1'
+app.config['SLOW_QUERY_MS'] = int(os.environ.get('SLOW_QUERY_MS', 100))
+# online backups copy this many pages per step and sleep between steps so
+# writers are only blocked for one short step at a time
+app.config['BACKUP_PAGES'] = int(os.environ.get('BACKUP_PAGES', 256))
+app.config['BACKUP_SLEEP_MS'] = int(os.environ.get('BACKUP_SLEEP_MS', 10))
+
+# per-process counters, see db_stats() and /stats
+_db_counters = {'connections_opened': 0, 'connections_reused': 0, 'commits': 0, 'lock_waits': 0, 'lock_errors': 0}
+_db_counters_lock = threading.Lock()
+# one connection per (thread, database path); reset after fork
+_db_local = threading.local()
+# databases whose schema has been brought up to date by this process
+_migrated_paths = set()
+
+
+def _count(name, n=1):
+    with _db_counters_lock:
+        _db_counters[name] += n
+
+
+class NotesConnection(sqlite3.Connection):
+    """sqlite3 connection that records waits on the database write lock.
+
+    With PROFILING_ENABLED it also times every statement, see record_query().
+    """
+
+    def _timed(self, fn, *args, is_commit=False, many=False):
+        was_idle = not self.in_transaction
+        start = time.perf_counter()
+        try:
+            rv = fn(*args)
+        except sqlite3.OperationalError as e:
+            if 'locked' in str(e) or 'busy' in str(e):
+                _count('lock_errors')
+            raise
+        # only statements that opened a write transaction (or a commit) can
+        # have been held up by another writer
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms > app.config['DB_LOCK_WAIT_MS'] and (is_commit or was_idle and self.in_transaction):
+            _count('lock_waits')
+        if app.config['PROFILING_ENABLED']:
+            record_query(self, 'COMMIT' if is_commit else args[0], args[1:], elapsed_ms, many)
+        return rv
+
+    def execute(self, sql, parameters=()):
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(super().executemany, sql, seq_of_parameters, many=True)
+
+    def commit(self):
+        _count('commits')
+        return self._timed(super().commit, is_commit=True)
+
+
+# Optional transparent compression of long note bodies. With
+# CONTENT_COMPRESSION=1, content of at least CONTENT_COMPRESS_MIN_BYTES (UTF-8)
+# is written as a BLOB holding a magic prefix plus zlib data; the row factory
+# inflates it again, so code reading rows always sees text whether or not a
+# row is compressed. SQL that needs the text itself (FTS fills, LIKE) goes
+# through the note_text() SQL function. scripts/compress_content.py converts
+# existing rows either way.
+app.config['CONTENT_COMPRESSION'] = os.environ.get('CONTENT_COMPRESSION') == '1'
+app.config['CONTENT_COMPRESS_MIN_BYTES'] = int(os.environ.get('CONTENT_COMPRESS_MIN_BYTES', 4096))
+app.config['CONTENT_COMPRESS_LEVEL'] = int(os.environ.get('CONTENT_COMPRESS_LEVEL', 6))
+CONTENT_MAGIC = b'NZ1:'
+
+
+def compress_content(text, min_bytes):
+    """Compressed BLOB for text of at least min_bytes, or text itself when it is shorter or doesn't shrink."""
+    data = text.encode('utf-8')
+    if len(data) < min_bytes:
+        return text
+    packed = CONTENT_MAGIC + zlib.compress(data, app.config['CONTENT_COMPRESS_LEVEL'])
+    return packed if len(packed) < len(data) else text
+
+
+def pack_content(text):
+    """Value to store in notes.content for text."""
+    if not app.config['CONTENT_COMPRESSION'] or text is None:
+        return text
+    return compress_content(text, app.config['CONTENT_COMPRESS_MIN_BYTES'])
+
+
+def unpack_content(value):
+    if type(value) is bytes and value.startswith(CONTENT_MAGIC):
+        return zlib.decompress(value[len(CONTENT_MAGIC):]).decode('utf-8')
+    return value
+
+
+def notes_row(cursor, row):
+    """sqlite3.Row factory that inflates compressed content."""
+    if bytes in map(type, row):
+        row = tuple(unpack_content(v) for v in row)
+    return sqlite3.Row(cursor, row)
+
+
+def register_sql_functions(db):
+    db.create_function('note_text', 1, unpack_content, deterministic=True)
+    db.create_function('fts_owner', 1, fts_owner, deterministic=True)
+    db.create_function('note_bigrams', 2, note_bigrams, deterministic=True)
+
+
+def connect_db(path):
+    db = sqlite3.connect(path, factory=NotesConnection)
+    db.row_factory = notes_row
+    register_sql_functions(db)
+    db.execute(f"PRAGMA busy_timeout = {int(app.config['DB_BUSY_TIMEOUT_MS'])}")
+    db.execute('PRAGMA journal_mode = WAL')
+    db.execute(f"PRAGMA synchronous = {app.config['DB_SYNCHRONOUS']}")
+    db.execute(f"PRAGMA cache_size = {-int(app.config['DB_CACHE_SIZE_KB'])}")
+    db.execute(f"PRAGMA mmap_size = {int(app.config['DB_MMAP_SIZE'])}")
+    _count('connections_opened')
+    return db
+
+
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(app.config['DATABASE'])
-        db.row_factory = sqlite3.Row
+        if getattr(_db_local, 'pid', None) != os.getpid():
+            # never share a connection inherited from a parent process
+            _db_local.pid = os.getpid()
+            _db_local.connections = {}
+        path = app.config['DATABASE']
+        db = _db_local.connections.get(path)
+        if db is None:
+            db = _db_local.connections[path] = connect_db(path)
+            if path not in _migrated_paths:
+                # first connection to this database in this process
+                migrate_db(db)
+                _migrated_paths.add(path)
+        else:
+            _count('connections_reused')
+        g._database = db
     return db
 
 
 @app.teardown_appcontext
 def close_connection(exception):
+    # the connection stays open for the next request on this thread; just
+    # make sure no transaction is left behind
     db = getattr(g, '_database', None)
-    if db is not None:
-        db.close()
+    if db is not None and db.in_transaction:
+        db.rollback()
+
+
+def db_stats():
+    with _db_counters_lock:
+        stats = dict(_db_counters)
+    stats['pid'] = os.getpid()
+    return stats
+
+
+def backup_database(src_path, dest_path, pages=None, sleep_ms=None):
+    """Copy a live database to dest_path with the SQLite online backup API.
+
+    Unlike a file copy this yields a consistent snapshot (including pages
+    still in the WAL) while the app keeps writing. The copy is written to a
+    temporary file and renamed into place once complete. Between steps of
+    `pages` pages it pauses sleep_ms so writers get the lock; sqlite3's own
+    sleep= only applies when a step comes back BUSY or LOCKED.
+    """
+    pages = app.config['BACKUP_PAGES'] if pages is None else pages
+    sleep_ms = app.config['BACKUP_SLEEP_MS'] if sleep_ms is None else sleep_ms
+    tmp_path = dest_path + '.tmp'
+    src = sqlite3.connect(src_path)
+    dst = sqlite3.connect(tmp_path)
+    try:
+        src.execute(f"PRAGMA busy_timeout = {int(app.config['DB_BUSY_TIMEOUT_MS'])}")
+
+        def pause(status, remaining, total):
+            if remaining and sleep_ms > 0:
+                time.sleep(sleep_ms / 1000)
+
+        src.backup(dst, pages=pages, progress=pause, sleep=sleep_ms / 1000)
+        dst.close()
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        dst.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        src.close()
+    return dest_path
+
+
+# Profiling. Everything below is only reached when PROFILING_ENABLED is set;
+# the numbers are per worker process like /stats.
+REQUEST_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+PROFILE_MAX_QUERIES = 500  # distinct statements tracked; the rest share one entry
+_route_latency = {}  # (endpoint, method) -> [bucket counts..., +Inf count, sum_ms]
+_query_stats = {}  # normalized sql -> [count, total_ms, max_ms]
+_profile_lock = threading.Lock()
+_EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+
+def record_query(db, sql, parameters, elapsed_ms, many=False):
+    """Account one statement: per-query totals, the current request, slow log."""
+    key = ' '.join(sql.split())
+    with _profile_lock:
+        entry = _query_stats.get(key)
+        if entry is None:
+            if len(_query_stats) >= PROFILE_MAX_QUERIES:
+                key = '<other>'
+            entry = _query_stats.setdefault(key, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed_ms
+        entry[2] = max(entry[2], elapsed_ms)
+    if has_request_context() and 'profile' in g:
+        g.profile['queries'] += 1
+        g.profile['db_ms'] += elapsed_ms
+    if elapsed_ms >= app.config['SLOW_QUERY_MS']:
+        record = {'event': 'slow_query', 'ms': round(elapsed_ms, 1), 'sql': key}
+        if key.upper().startswith(_EXPLAINABLE):
+            params = parameters[0] if parameters else ()
+            if many:
+                # plan the first row (a generator has been consumed by now)
+                params = params[0] if isinstance(params, (list, tuple)) and params else ()
+            try:
+                plan = sqlite3.Connection.execute(db, 'EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+                record['plan'] = [row[3] for row in plan]
+            except (sqlite3.Error, TypeError):
+                pass
+        if has_request_context():
+            record['endpoint'] = request.endpoint
+        app.logger.warning(json.dumps(record, ensure_ascii=False))
+
+
+@app.before_request
+def profile_start():
+    if app.config['PROFILING_ENABLED']:
+        g.profile = {'start': time.perf_counter(), 'queries': 0, 'db_ms': 0.0}
+
+
+@app.after_request
+def profile_finish(response):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    # streamed responses are measured up to the first byte
+    elapsed_ms = (time.perf_counter() - profile['start']) * 1000
+    key = (request.endpoint or 'not_found', request.method)
+    with _profile_lock:
+        entry = _route_latency.get(key)
+        if entry is None:
+            entry = _route_latency[key] = [0] * (len(REQUEST_BUCKETS_MS) + 1) + [0.0]
+        for i, bound in enumerate(REQUEST_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                entry[i] += 1
+        entry[-2] += 1
+        entry[-1] += elapsed_ms
+    response.headers['Server-Timing'] = (
+        f"app;dur={elapsed_ms:.1f}, db;dur={profile['db_ms']:.1f};desc=\"{profile['queries']} queries\"")
+    return response
+
+
+def _label(value):
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+
+
+def metrics_text():
+    """Render the profiling data in the Prometheus text exposition format."""
+    lines = []
+    for name, value in db_stats().items():
+        if name != 'pid':
+            lines.append(f'# TYPE notes_db_{name}_total counter')
+            lines.append(f'notes_db_{name}_total {value}')
+    with _profile_lock:
+        routes = {k: list(v) for k, v in _route_latency.items()}
+        queries = {k: list(v) for k, v in _query_stats.items()}
+    lines.append('# TYPE notes_request_duration_seconds histogram')
+    for (endpoint, method), entry in sorted(routes.items()):
+        labels = f'endpoint={_label(endpoint)},method={_label(method)}'
+        for bound, count in zip(REQUEST_BUCKETS_MS, entry):
+            lines.append(f'notes_request_duration_seconds_bucket{{{labels},le="{bound / 1000}"}} {count}')
+        lines.append(f'notes_request_duration_seconds_bucket{{{labels},le="+Inf"}} {entry[-2]}')
+        lines.append(f'notes_request_duration_seconds_count{{{labels}}} {entry[-2]}')
+        lines.append(f'notes_request_duration_seconds_sum{{{labels}}} {entry[-1] / 1000:.6f}')
+    lines.append('# TYPE notes_db_query_total counter')
+    lines.append('# TYPE notes_db_query_seconds_total counter')
+    lines.append('# TYPE notes_db_query_max_seconds gauge')
+    for sql, (count, total_ms, max_ms) in sorted(queries.items()):
+        labels = f'sql={_label(sql)}'
+        lines.append(f'notes_db_query_total{{{labels}}} {count}')
+        lines.append(f'notes_db_query_seconds_total{{{labels}}} {total_ms / 1000:.6f}')
+        lines.append(f'notes_db_query_max_seconds{{{labels}}} {max_ms / 1000:.6f}')
+    return '\n'.join(lines) + '\n'
+
+
+# Response compression. HTML, CSV and Markdown bodies are gzipped for
+# clients that accept it: buffered ones of at least COMPRESS_MIN_BYTES in one
+# go, streamed ones (the CSV export) chunk by chunk as they are generated, so
+# the export keeps its constant memory use. Files (static, job downloads) are
+# left alone; nginx serves those. ETags become weak, as the encoded body is a
+# different byte sequence, which still lets If-None-Match revalidation of
+# public pages answer 304.
+app.config['COMPRESS_RESPONSES'] = os.environ.get('COMPRESS_RESPONSES', '1') == '1'
+app.config['COMPRESS_MIN_BYTES'] = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+COMPRESS_MIMETYPES = ('text/html', 'text/csv', 'text/markdown')
+
+
+def _gzip_chunks(chunks, source, level):
+    """gzip a stream of byte chunks, flushing after each so the client gets data as it is produced."""
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 16 + 15: gzip container
+    try:
+        for chunk in chunks:
+            data = z.compress(chunk) + z.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield z.flush()
+    finally:
+        # the response only closes its current iterable: close the original
+        if hasattr(source, 'close'):
+            source.close()
+
+
+@app.after_request
+def compress_response(response):
+    if (not app.config['COMPRESS_RESPONSES'] or response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    if not request.accept_encodings['gzip']:
+        return response
+    if response.is_streamed:
+        source = response.response
+        response.response = _gzip_chunks(response.iter_encoded(), source, app.config['COMPRESS_LEVEL'])
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_BYTES']:
+            return response
+        response.set_data(gzip.compress(data, app.config['COMPRESS_LEVEL'], mtime=0))
+    response.headers['Content-Encoding'] = 'gzip'
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+# Static asset URLs carry a hash of the file (url_for('static', ...) adds
+# ?v=<hash>), so they can be cached for a year: a changed file gets a new URL.
+# Requests without the current hash are served with Flask's default
+# revalidation headers.
+STATIC_MAX_AGE = 365 * 24 * 3600
+_static_hashes = {}  # filename -> (mtime, hash)
+
+
+def static_file_hash(filename):
+    path = os.path.join(app.static_folder, filename)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _static_hashes.get(filename)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as f:
+            cached = _static_hashes[filename] = (mtime, hashlib.sha1(f.read()).hexdigest()[:12])
+    return cached[1]
+
+
+@app.url_defaults
+def static_version(endpoint, values):
+    if endpoint == 'static' and 'v' not in values:
+        version = static_file_hash(values.get('filename', ''))
+        if version:
+            values['v'] = version
+
+
+@app.after_request
+def static_cache_headers(response):
+    if request.endpoint != 'static' or response.status_code not in (200, 304):
+        return response
+    version = request.args.get('v')
+    if version and version == static_file_hash(request.view_args.get('filename', '')):
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
 
 
 def init_db():
-    db = get_db()
-    with app.open_resource('schema.sql', mode='r') as f:
-        db.executescript(f.read())
-    db.commit()
+    """Create or upgrade the database schema. Never drops existing data."""
+    return migrate_db(get_db())
+
+
+def query_db(query, args=(), one=False):
+    cur = get_db().execute(query, args)
+    rv = cur.fetchall()
+    cur.close()
+    return (rv[0] if rv else None) if one else rv
+
+
+# Full-text search (SQLite FTS5).
+# notes_fts (trigram tokenizer) mirrors title/content of every note with
+# rowid = notes.id; notes_bigrams holds the distinct two-character windows of
+# the same text (unicode61 tokenizer), so one- and two-character terms such as
+# 冷戦 are index lookups too. Both tables are shared by all users: every row
+# carries an owner token and each MATCH is ANDed with it, so a search only
+# walks the searching user's postings however many notes other users have.
+# The tables are kept in sync by the note write routes and can be rebuilt
+# with scripts/rebuild_search_index.py.
+FTS_MIN_TERM_LENGTH = 3  # shorter terms go to notes_bigrams
+FTS_OWNER_BASE = 6400  # size of the Unicode private use area U+E000..U+F8FF
+
+
+def fts_owner(user_id):
+    """Owner token for user_id: three private-use characters.
+
+    Three characters are exactly one trigram (and one unicode61 token), so
+    owner : "<token>" reads a posting list holding only that user's notes.
+    """
+    n = int(user_id)
+    return ''.join(chr(0xE000 + n // FTS_OWNER_BASE ** i % FTS_OWNER_BASE) for i in (2, 1, 0))
+
+
+def note_bigrams(title, content):
+    """Space-separated distinct two-character windows of a note's text.
+
+    A character followed by whitespace (or the end) is added on its own, so
+    every character can be found with a prefix query.
+    """
+    text = f"{title or ''}\n{content or ''}"
+    grams = {}
+    for i, ch in enumerate(text):
+        if ch.isspace():
+            continue
+        nxt = text[i + 1:i + 2]
+        grams[ch + nxt if nxt and not nxt.isspace() else ch] = None
+    return ' '.join(grams)
+
+
+def _fts_phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+_CONTROL_CHARS = re.compile(r'[\x00-\x1f\x7f-\x9f]')
+
+
+def search_terms(q):
+    """Whitespace-separated terms of a keyword query.
+
+    Control characters separate terms too: FTS5 can't take a NUL inside a
+    MATCH string, and none of them can occur in a useful search anyway.
+    """
+    return _CONTROL_CHARS.sub(' ', q).split()
+
+
+def split_search_terms(q):
+    """Split a keyword query into an FTS5 MATCH expression and leftover short terms.
+
+    All terms are required. Terms too short for the trigram index cannot be
+    matched by notes_fts and are returned separately (see bigram_match); the
+    MATCH expression is None when no term is long enough.
+    """
+    terms = search_terms(q)
+    long_terms = [t for t in terms if len(t) >= FTS_MIN_TERM_LENGTH]
+    short_terms = [t for t in terms if len(t) < FTS_MIN_TERM_LENGTH]
+    match = ' AND '.join(_fts_phrase(t) for t in long_terms) or None
+    return match, short_terms
+
+
+def owner_match(user_id, match):
+    """Scope a notes_fts MATCH expression to one user's notes."""
+    return f'owner : {_fts_phrase(fts_owner(user_id))} AND ({match})'
+
+
+def bigram_match(user_id, terms):
+    """notes_bigrams MATCH expression requiring all (one- or two-character) terms."""
+    grams = ' AND '.join(_fts_phrase(t) + (' *' if len(t) == 1 else '') for t in terms)
+    return f'owner : {_fts_phrase(fts_owner(user_id))} AND grams : ({grams})'
+
+
+def search_rank(terms):
+    """(ORDER BY clause, params) for keyword matches: notes with more terms in the title first, then the newest.
+
+    bm25() is not used: its statistics count each phrase over the whole
+    (shared) index, which made ranking cost grow with every user's notes.
+    """
+    hits = ' + '.join('(instr(lower(n.title), lower(?)) > 0)' for _ in terms)
+    return f' ORDER BY {hits} DESC, n.updated_at DESC', list(terms)
+
+
+def index_note(db, note_id, user_id, title, content):
+    unindex_note(db, note_id)
+    db.execute('INSERT INTO notes_fts (rowid, title, content, owner) VALUES (?, ?, ?, ?)',
+               (note_id, title or '', content or '', fts_owner(user_id)))
+    db.execute('INSERT INTO notes_bigrams (rowid, owner, grams) VALUES (?, ?, ?)',
+               (note_id, fts_owner(user_id), note_bigrams(title, content)))
+
+
+def unindex_note(db, note_id):
+    db.execute('DELETE FROM notes_fts WHERE rowid = ?', (note_id,))
+    db.execute('DELETE FROM notes_bigrams WHERE rowid = ?', (note_id,))
+
+
+def index_notes_sql(where):
+    """Statements filling both search tables from the notes matching where."""
+    return [f"INSERT INTO notes_fts (rowid, title, content, owner) SELECT id, coalesce(title, ''), coalesce(note_text(content), ''), "
+            f"fts_owner(user_id) FROM notes WHERE {where}",
+            f"INSERT INTO notes_bigrams (rowid, owner, grams) SELECT id, fts_owner(user_id), note_bigrams(title, note_text(content)) "
+            f"FROM notes WHERE {where}"]
+
+
+def _search_index_schema(db):
+    # the index used to be one table with an unindexed user_id column
+    db.execute('DROP TABLE IF EXISTS notes_fts')
+    db.execute("CREATE VIRTUAL TABLE notes_fts USING fts5(title, content, owner, tokenize='trigram')")
+    # only rowids and columns are needed: no positions
+    db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS notes_bigrams USING fts5(owner, grams, tokenize='unicode61', detail='column')")
+    rebuild_search_index(db)
+
+
+def rebuild_search_index(db):
+    """Refill the search tables from the notes table (caller commits). Returns the number of indexed notes."""
+    db.execute('DELETE FROM notes_fts')
+    db.execute('DELETE FROM notes_bigrams')
+    count = 0
+    for stmt in index_notes_sql('1'):
+        count = db.execute(stmt).rowcount
+    return count
+
+
+# Tag index: note_tags holds one row per (note, tag) so tag filters are an
+# index lookup on (user_id, tag) instead of a LIKE scan over notes.tags.
 
 
-def ensure_public_links_columns():
+def parse_tags(tags):
+    """Split a comma-separated tag string into unique, stripped tags (order kept)."""
+    seen = []
+    for t in (tags or '').split(','):
+        t = t.strip()
+        if t and t not in seen:
+            seen.append(t)
+    return seen
+
+
+def sync_note_tags(db, note_id, user_id, tags):
+    db.execute('DELETE FROM note_tags WHERE note_id = ?', (note_id,))
+    db.executemany('INSERT INTO note_tags (note_id, user_id, tag) VALUES (?, ?, ?)',
+                   [(note_id, user_id, t) for t in parse_tags(tags)])
+
+
+def rebuild_note_tags(db):
+    """Refill note_tags from the notes.tags column (caller commits). Returns the number of tag rows."""
+    db.execute('DELETE FROM note_tags')
+    rows = db.execute("SELECT id, user_id, tags FROM notes WHERE tags IS NOT NULL AND tags != ''").fetchall()
+    pairs = [(r[0], r[1], t) for r in rows for t in parse_tags(r[2])]
+    db.executemany('INSERT INTO note_tags (note_id, user_id, tag) VALUES (?, ?, ?)', pairs)
+    return len(pairs)
+
+
+# Facets: per-user note counts by period, region and tag. note_facets holds
+# the counts for all of a user's notes and is kept current by triggers on
+# notes and note_tags (schema migration 10), so every write path, bulk
+# inserts and scripts included, maintains it and reading it costs
+# O(facet values). Counts for a filtered search are computed over the
+# matching notes and cached like the dashboard totals.
+FACETS = ('period', 'region', 'tags')
+NOTE_PERIODS = ('古代', '中世', '近世', '近代', '現代')
+app.config['FACET_LIMIT'] = int(os.environ.get('FACET_LIMIT', 20))
+
+
+def _facet_add(row, facet, column):
+    return (f"INSERT INTO note_facets (user_id, facet, value, count) SELECT {row}.user_id, '{facet}', {row}.{column}, 1 "
+            f"WHERE coalesce({row}.{column}, '') != '' ON CONFLICT (user_id, facet, value) DO UPDATE SET count = count + 1;")
+
+
+def _facet_remove(row, facet, column):
+    where = f"user_id = {row}.user_id AND facet = '{facet}' AND value = {row}.{column}"
+    return f'UPDATE note_facets SET count = count - 1 WHERE {where}; DELETE FROM note_facets WHERE {where} AND count <= 0;'
+
+
+def _note_facets_schema(db):
+    db.execute('CREATE TABLE IF NOT EXISTS note_facets (user_id INTEGER NOT NULL, facet TEXT NOT NULL, value TEXT NOT NULL, '
+               'count INTEGER NOT NULL, PRIMARY KEY (user_id, facet, value)) WITHOUT ROWID')
+    columns = [('period', 'period'), ('region', 'region')]
+    triggers = {
+        'notes_facets_insert': ('AFTER INSERT ON notes', '', [_facet_add('NEW', f, c) for f, c in columns]),
+        'notes_facets_delete': ('AFTER DELETE ON notes', '', [_facet_remove('OLD', f, c) for f, c in columns]),
+        'notes_facets_update': ('AFTER UPDATE OF user_id, period, region ON notes',
+                                'WHEN OLD.user_id IS NOT NEW.user_id OR OLD.period IS NOT NEW.period OR OLD.region IS NOT NEW.region',
+                                [_facet_remove('OLD', f, c) for f, c in columns] + [_facet_add('NEW', f, c) for f, c in columns]),
+        'note_tags_facets_insert': ('AFTER INSERT ON note_tags', '', [_facet_add('NEW', 'tags', 'tag')]),
+        'note_tags_facets_delete': ('AFTER DELETE ON note_tags', '', [_facet_remove('OLD', 'tags', 'tag')]),
+    }
+    for name, (event, when, body) in triggers.items():
+        db.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} FOR EACH ROW {when} BEGIN {' '.join(body)} END")
+    rebuild_note_facets(db)
+
+
+def rebuild_note_facets(db):
+    """Recount note_facets from notes and note_tags (caller commits)."""
+    db.execute('DELETE FROM note_facets')
+    for facet in ('period', 'region'):
+        db.execute(f"INSERT INTO note_facets (user_id, facet, value, count) SELECT user_id, '{facet}', {facet}, COUNT(*) "
+                   f"FROM notes WHERE coalesce({facet}, '') != '' GROUP BY user_id, {facet}")
+    db.execute("INSERT INTO note_facets (user_id, facet, value, count) SELECT user_id, 'tags', tag, COUNT(*) FROM note_tags GROUP BY user_id, tag")
+
+
+def note_facet_counts(user_id, filters=('', '', '', '')):
+    """{facet: [(value, count), ...]} over the notes matching the dashboard filters, most frequent first."""
+    if any(filters):
+        sql, params, _ = note_search_sql(user_id, *filters)
+        rows = _user_cached(user_id, ('facets',) + filters, lambda: [tuple(r) for r in query_db(
+            f"WITH matched AS MATERIALIZED (SELECT id, period, region FROM ({sql})) "
+            "SELECT 'period', period, COUNT(*) FROM matched WHERE coalesce(period, '') != '' GROUP BY period "
+            "UNION ALL SELECT 'region', region, COUNT(*) FROM matched WHERE coalesce(region, '') != '' GROUP BY region "
+            "UNION ALL SELECT 'tags', tag, COUNT(*) FROM note_tags WHERE note_id IN (SELECT id FROM matched) GROUP BY tag",
+            tuple(params))])
+    else:
+        rows = query_db('SELECT facet, value, count FROM note_facets WHERE user_id = ?', (user_id,))
+    facets = {f: [] for f in FACETS}
+    for facet, value, count in sorted(rows, key=lambda r: (-r[2], r[1])):
+        if len(facets[facet]) < app.config['FACET_LIMIT']:
+            facets[facet].append((value, count))
+    return facets
+
+
+# Dashboard totals: COUNT(*) over the filtered listing is cached per
+# user+filters for DASHBOARD_COUNT_TTL seconds and dropped when that user's
+# notes change in this process; other workers pick up the change after the
+# TTL, so the page count shown is approximate by design.
+app.config['DASHBOARD_COUNT_TTL'] = int(os.environ.get('DASHBOARD_COUNT_TTL', 60))
+_NOTE_COUNT_CACHE_MAX = 1024
+_note_count_cache = {}
+_note_count_lock = threading.Lock()
+
+
+def _user_cached(user_id, key, compute):
+    key = (app.config['DATABASE'], user_id, key)
+    now = time.monotonic()
+    with _note_count_lock:
+        hit = _note_count_cache.get(key)
+    if hit and hit[0] > now:
+        return hit[1]
+    value = compute()
+    with _note_count_lock:
+        if len(_note_count_cache) >= _NOTE_COUNT_CACHE_MAX:
+            _note_count_cache.clear()
+        _note_count_cache[key] = (now + app.config['DASHBOARD_COUNT_TTL'], value)
+    return value
+
+
+def cached_note_count(user_id, filters, sql, params):
+    def count():
+        row = query_db('SELECT COUNT(*) AS cnt FROM (' + sql + ')', tuple(params), one=True)
+        return row['cnt'] if row else 0
+    return _user_cached(user_id, filters, count)
+
+
+def invalidate_note_counts(user_id):
+    db_path = app.config['DATABASE']
+    with _note_count_lock:
+        for key in [k for k in _note_count_cache if k[0] == db_path and k[1] == user_id]:
+            del _note_count_cache[key]
+
+
+def encode_cursor(note):
+    return f"{note['updated_at'] or ''}|{note['id']}"
+
+
+def decode_cursor(value):
+    """Parse an 'updated_at|id' keyset cursor; None if missing or malformed."""
+    updated_at, sep, note_id = value.rpartition('|')
+    # ASCII digits only, and short enough to stay within SQLite's INTEGER
+    if not sep or not re.fullmatch(r'[0-9]{1,18}', note_id):
+        return None
+    return updated_at, int(note_id)
+
+
+def note_saved(db, note_id, user_id, title, content, tags):
+    """Bring the derived indexes up to date after a note insert/update (caller commits)."""
+    index_note(db, note_id, user_id, title, content)
+    sync_note_tags(db, note_id, user_id, tags)
+    invalidate_note_counts(user_id)
+    invalidate_share_cache(note_id)
+
+
+def notes_bulk_saved(db, after_id, user_id=None):
+    """Set-based note_saved for notes inserted with ids above after_id (caller commits).
+
+    Limited to one user's notes when user_id is given.
+    """
+    where, params = 'id > ?', [after_id]
+    if user_id is not None:
+        where += ' AND user_id = ?'
+        params.append(user_id)
+    for stmt in index_notes_sql(where):
+        db.execute(stmt, params)
+    rows = db.execute(f"SELECT id, user_id, tags FROM notes WHERE {where} AND tags != ''", params).fetchall()
+    db.executemany('INSERT INTO note_tags (note_id, user_id, tag) VALUES (?, ?, ?)',
+                   [(r[0], r[1], t) for r in rows for t in parse_tags(r[2])])
+    revisions_bulk_saved(db, 'import', where, params)
+    if user_id is not None:
+        invalidate_note_counts(user_id)
+
+
+def note_deleted(db, note_id, user_id):
+    unindex_note(db, note_id)
+    db.execute('DELETE FROM note_tags WHERE note_id = ?', (note_id,))
+    invalidate_note_counts(user_id)
+    invalidate_share_cache(note_id)
+    if db.execute('SELECT 1 FROM public_links WHERE note_id = ?', (note_id,)).fetchone():
+        bump_share_links_epoch(db)
+    db.execute('DELETE FROM note_revisions WHERE note_id = ?', (note_id,))
+
+
+# Revision history. Every save adds a note_revisions row keyed by the note's
+# revision number. A row holds either the full content (snapshot = 1) or a
+# line-based delta against the previous row; a snapshot is forced every
+# REVISION_SNAPSHOT_EVERY rows and whenever the delta would not be much smaller
+# than the text, so rebuilding any version replays a bounded number of deltas.
+# Autosaves within REVISION_AUTOSAVE_WINDOW seconds of the first autosave of a
+# run replace the run's row instead of adding one, so history grows with
+# editing sessions rather than with keystroke pauses. Content and deltas go
+# through pack_content like notes.content.
+app.config['REVISION_SNAPSHOT_EVERY'] = int(os.environ.get('REVISION_SNAPSHOT_EVERY', 20))
+app.config['REVISION_AUTOSAVE_WINDOW'] = int(os.environ.get('REVISION_AUTOSAVE_WINDOW', 300))
+app.config['REVISION_DIFF_MAX_LINES'] = int(os.environ.get('REVISION_DIFF_MAX_LINES', 2000))
+REVISION_LIST_COLUMNS = 'note_id, revision, source, created_at, saved_at, title, tags, period, region, snapshot, size'
+
+
+def _note_revisions_schema(db):
+    db.execute("""CREATE TABLE IF NOT EXISTS note_revisions (
+        note_id INTEGER NOT NULL,
+        revision INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        source TEXT NOT NULL,
+        created_at TEXT,
+        saved_at TEXT,
+        title TEXT,
+        tags TEXT,
+        period TEXT,
+        region TEXT,
+        snapshot INTEGER NOT NULL,
+        depth INTEGER NOT NULL DEFAULT 0,
+        size INTEGER NOT NULL DEFAULT 0,
+        content,
+        PRIMARY KEY (note_id, revision)
+    )""")
+    # existing notes start their history with the current version
+    revisions_bulk_saved(db, 'baseline', 'id > ?', [0])
+
+
+def revisions_bulk_saved(db, source, where, params):
+    """Record the current state of the notes matching where as history snapshots (caller commits)."""
+    db.execute('INSERT OR REPLACE INTO note_revisions (note_id, revision, user_id, source, created_at, saved_at, title, tags, period, region, '
+               "snapshot, depth, size, content) SELECT id, revision, user_id, ?, updated_at, updated_at, title, coalesce(tags, ''), "
+               f"coalesce(period, ''), coalesce(region, ''), 1, 0, length(coalesce(note_text(content), '')), content FROM notes WHERE {where}",
+               [source] + list(params))
+
+
+def text_delta(old, new):
+    """Line-based edit script turning old into new: JSON [[start, end, [lines]], ...] over old's lines.
+
+    Unchanged leading and trailing lines are skipped first, as an edit usually
+    touches one place. The changed middle is diffed with SequenceMatcher, whose
+    autojunk heuristic keeps blank-line-heavy text from going quadratic. When
+    either side of the middle is longer than REVISION_DIFF_MAX_LINES, the
+    middle is stored as one splice instead.
+    """
+    a, b = old.splitlines(keepends=True), new.splitlines(keepends=True)
+    lo, common = 0, min(len(a), len(b))
+    while lo < common and a[lo] == b[lo]:
+        lo += 1
+    end_a, end_b = len(a), len(b)
+    while end_a > lo and end_b > lo and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    mid_a, mid_b = a[lo:end_a], b[lo:end_b]
+    if not mid_a and not mid_b:
+        ops = []
+    elif not mid_a or not mid_b or max(len(mid_a), len(mid_b)) > app.config['REVISION_DIFF_MAX_LINES']:
+        ops = [[lo, end_a, mid_b]]
+    else:
+        ops = [[lo + i1, lo + i2, mid_b[j1:j2]] for tag, i1, i2, j1, j2 in SequenceMatcher(None, mid_a, mid_b).get_opcodes()
+               if tag != 'equal']
+    return json.dumps(ops, ensure_ascii=False, separators=(',', ':'))
+
+
+def apply_delta(old, delta):
+    lines = old.splitlines(keepends=True)
+    # ops are in ascending order; applying from the end keeps earlier offsets valid
+    for start, end, insert in reversed(json.loads(delta)):
+        lines[start:end] = insert
+    return ''.join(lines)
+
+
+def note_revision(db, note_id, revision):
+    """Rebuild one revision of a note as a dict (REVISION_LIST_COLUMNS plus content), or None."""
+    rows = db.execute('SELECT * FROM note_revisions WHERE note_id = ? AND revision <= ? AND revision >= '
+                      '(SELECT MAX(revision) FROM note_revisions WHERE note_id = ? AND revision <= ? AND snapshot = 1) '
+                      'ORDER BY revision', (note_id, revision, note_id, revision)).fetchall()
+    if not rows or rows[-1]['revision'] != revision:
+        return None
+    text = unpack_content(rows[0]['content']) or ''
+    for r in rows[1:]:
+        text = apply_delta(text, unpack_content(r['content']))
+    out = {k: rows[-1][k] for k in rows[-1].keys() if k not in ('content', 'depth', 'user_id')}
+    out['content'] = text
+    return out
+
+
+def prepare_revision(db, state, source):
+    """Work out the history row for a note state before the note is written.
+
+    Call it before the write transaction: rebuilding the previous version and
+    diffing against it must not hold the write lock. source is 'create',
+    'edit', 'autosave' or 'restore'; consecutive autosaves within
+    REVISION_AUTOSAVE_WINDOW share one row.
+    """
+    note_id, content = state['id'], state['content'] or ''
+    last = db.execute('SELECT revision, source, created_at, depth FROM note_revisions WHERE note_id = ? ORDER BY revision DESC LIMIT 1',
+                      (note_id,)).fetchone()
+    prepared = {'source': source, 'last': last['revision'] if last else None, 'replace': None, 'created_at': state['updated_at'],
+                'snapshot': 1, 'depth': 0, 'data': content}
+    base = last
+    cutoff = (datetime.fromisoformat(state['updated_at']) - timedelta(seconds=app.config['REVISION_AUTOSAVE_WINDOW'])).isoformat()
+    if source == 'autosave' and last and last['source'] == 'autosave' and (last['created_at'] or '') >= cutoff:
+        prepared.update(created_at=last['created_at'], replace=last['revision'])
+        base = db.execute('SELECT revision, depth FROM note_revisions WHERE note_id = ? AND revision < ? ORDER BY revision DESC LIMIT 1',
+                          (note_id, last['revision'])).fetchone()
+    if base and base['depth'] + 1 < app.config['REVISION_SNAPSHOT_EVERY']:
+        delta = text_delta(note_revision(db, note_id, base['revision'])['content'], content)
+        if len(delta) < len(content) // 2:
+            prepared.update(snapshot=0, depth=base['depth'] + 1, data=delta)
+    return prepared
+
+
+def record_revision(db, state, prepared):
+    """Add a written note state (dict with the notes columns) to its history (caller commits).
+
+    prepared comes from prepare_revision. If another save added a history row
+    in the meantime, the state is stored as a full snapshot instead.
+    """
+    note_id, content = state['id'], state['content'] or ''
+    last = db.execute('SELECT MAX(revision) FROM note_revisions WHERE note_id = ?', (note_id,)).fetchone()[0]
+    if last is not None and last >= state['revision']:
+        return
+    if last != prepared['last']:
+        prepared = dict(prepared, replace=None, created_at=state['updated_at'], snapshot=1, depth=0, data=content)
+    if prepared['replace'] is not None:
+        db.execute('DELETE FROM note_revisions WHERE note_id = ? AND revision = ?', (note_id, prepared['replace']))
+    db.execute('INSERT OR REPLACE INTO note_revisions (note_id, revision, user_id, source, created_at, saved_at, title, tags, period, region, '
+               'snapshot, depth, size, content) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+               (note_id, state['revision'], state['user_id'], prepared['source'], prepared['created_at'], state['updated_at'], state['title'],
+                state['tags'] or '', state['period'] or '', state['region'] or '', prepared['snapshot'], prepared['depth'], len(content),
+                pack_content(prepared['data'])))
+
+
+# Server-side Markdown for public pages. Supports the same small subset as
+# simpleMarkdown in static/note.js (headings, lists, bold/italic, line
+# breaks). Input is HTML-escaped before any markup is added, so note content
+# can never inject tags. Rendered HTML is cached per (note id, updated_at)
+# in an LRU bounded by MARKDOWN_CACHE_BYTES, so a popular shared note is
+# rendered once per edit rather than once per view.
+app.config['MARKDOWN_CACHE_BYTES'] = int(os.environ.get('MARKDOWN_CACHE_BYTES', 8 * 1024 * 1024))
+_MD_HEADING = re.compile(r'^(#{1,3}) (.*)$')
+_MD_LIST_ITEM = re.compile(r'^[*-] (.*)$')
+_MD_BOLD = re.compile(r'\*\*(.+?)\*\*')
+_MD_ITALIC = re.compile(r'\*(.+?)\*')
+_markdown_cache = OrderedDict()  # key -> (html, size)
+_markdown_cache_lock = threading.Lock()
+_markdown_counters = {'hits': 0, 'misses': 0, 'bytes': 0}
+
+
+def _markdown_inline(text):
+    text = _MD_BOLD.sub(r'<strong>\1</strong>', text)
+    return _MD_ITALIC.sub(r'<em>\1</em>', text)
+
+
+def render_markdown(md):
+    """Render the supported Markdown subset to safe HTML (a Markup string)."""
+    out = []
+    paragraph = []
+    in_list = False
+
+    def close_paragraph():
+        if paragraph:
+            out.append('<p>' + '<br>'.join(paragraph) + '</p>')
+            paragraph.clear()
+
+    for raw in (md or '').replace('\r\n', '\n').split('\n'):
+        line = _markdown_inline(str(escape(raw.rstrip())))
+        heading = _MD_HEADING.match(line)
+        item = _MD_LIST_ITEM.match(line)
+        if item:
+            close_paragraph()
+            if not in_list:
+                out.append('<ul>')
+                in_list = True
+            out.append(f'<li>{item.group(1)}</li>')
+            continue
+        if in_list:
+            out.append('</ul>')
+            in_list = False
+        if heading:
+            close_paragraph()
+            level = len(heading.group(1))
+            out.append(f'<h{level}>{heading.group(2)}</h{level}>')
+        elif line.strip():
+            paragraph.append(line)
+        else:
+            close_paragraph()
+    if in_list:
+        out.append('</ul>')
+    close_paragraph()
+    return Markup('\n'.join(out))
+
+
+def rendered_note_html(note):
+    """Cached render_markdown(note content), keyed on note id + updated_at."""
+    key = (app.config['DATABASE'], note['id'], note['updated_at'])
+    with _markdown_cache_lock:
+        hit = _markdown_cache.get(key)
+        if hit is not None:
+            _markdown_cache.move_to_end(key)
+            _markdown_counters['hits'] += 1
+            return hit[0]
+        _markdown_counters['misses'] += 1
+    html = render_markdown(note['content'])
+    size = len(html)
+    limit = app.config['MARKDOWN_CACHE_BYTES']
+    if size > limit:
+        return html
+    with _markdown_cache_lock:
+        old = _markdown_cache.pop(key, None)
+        if old is not None:
+            _markdown_counters['bytes'] -= old[1]
+        _markdown_cache[key] = (html, size)
+        _markdown_counters['bytes'] += size
+        while _markdown_counters['bytes'] > limit:
+            _, (_, evicted) = _markdown_cache.popitem(last=False)
+            _markdown_counters['bytes'] -= evicted
+    return html
+
+
+def markdown_cache_stats():
+    with _markdown_cache_lock:
+        stats = dict(_markdown_counters)
+        stats['entries'] = len(_markdown_cache)
+    return stats
+
+
+# Share-token cache: token -> link state (note id, parsed expiry, revoked,
+# note updated_at). Entries live for SHARE_CACHE_TTL seconds in an LRU of
+# SHARE_CACHE_SIZE tokens. Tokens that are not shaped like the uuid4 hex the
+# app issues are rejected before any lookup; well-formed unknown tokens are
+# remembered in a separate LRU of SHARE_NEGATIVE_CACHE_SIZE, so token-guessing
+# traffic can never evict the entries of valid links. Link changes
+# (share, revoke, note delete, cleanup script) bump the 'share_links' counter
+# in cache_epochs; entries are keyed on that counter, so every worker drops
+# stale link state after one primary-key read. Note edits only invalidate
+# this process's entry; other workers may serve the previous validators for
+# up to the TTL.
+app.config['SHARE_CACHE_TTL'] = int(os.environ.get('SHARE_CACHE_TTL', 30))
+app.config['SHARE_CACHE_SIZE'] = int(os.environ.get('SHARE_CACHE_SIZE', 10000))
+app.config['SHARE_NEGATIVE_CACHE_SIZE'] = int(os.environ.get('SHARE_NEGATIVE_CACHE_SIZE', 1000))
+SHARE_TOKEN = re.compile(r'[0-9a-f]{32}')  # uuid.uuid4().hex, see note_share
+_share_cache = OrderedDict()  # (db path, epoch, token) -> (deadline, entry)
+_share_negative = OrderedDict()  # (db path, epoch, token) -> deadline
+_share_cache_by_note = {}  # (db path, note id) -> cache key
+_share_cache_lock = threading.Lock()
+_share_counters = {'hits': 0, 'negative_hits': 0, 'misses': 0, 'rejected': 0}
+
+
+def share_links_epoch(db):
+    row = db.execute("SELECT value FROM cache_epochs WHERE name = 'share_links'").fetchone()
+    return row[0] if row else 0
+
+
+def bump_share_links_epoch(db):
+    """Invalidate every process's share-token cache (caller commits)."""
+    db.execute("UPDATE cache_epochs SET value = value + 1 WHERE name = 'share_links'")
+
+
+def lookup_share(token):
+    """Link state for a share token (cached), or None if the token doesn't exist."""
+    if not SHARE_TOKEN.fullmatch(token):
+        with _share_cache_lock:
+            _share_counters['rejected'] += 1
+        return None
+    db_path = app.config['DATABASE']
+    key = (db_path, share_links_epoch(get_db()), token)
+    now = time.monotonic()
+    with _share_cache_lock:
+        hit = _share_cache.get(key)
+        if hit and hit[0] > now:
+            _share_cache.move_to_end(key)
+            _share_counters['hits'] += 1
+            return hit[1]
+        if _share_negative.get(key, 0) > now:
+            _share_counters['negative_hits'] += 1
+            return None
+        _share_counters['misses'] += 1
+    row = query_db('SELECT p.note_id, p.expires_at, p.revoked, n.updated_at FROM public_links p JOIN notes n ON n.id = p.note_id WHERE p.token = ?', (token,), one=True)
+    entry = None
+    if row:
+        expires = None
+        if row['expires_at']:
+            try:
+                expires = datetime.fromisoformat(row['expires_at'])
+            except ValueError:
+                pass
+        entry = {'note_id': row['note_id'], 'expires_at': expires, 'expires_raw': row['expires_at'],
+                 'revoked': bool(row['revoked']), 'updated_at': row['updated_at']}
+    with _share_cache_lock:
+        deadline = now + app.config['SHARE_CACHE_TTL']
+        if entry is None:
+            _share_negative[key] = deadline
+            _share_negative.move_to_end(key)
+            while len(_share_negative) > app.config['SHARE_NEGATIVE_CACHE_SIZE']:
+                _share_negative.popitem(last=False)
+            return None
+        _share_cache[key] = (deadline, entry)
+        _share_cache_by_note[(db_path, entry['note_id'])] = key
+        while len(_share_cache) > app.config['SHARE_CACHE_SIZE']:
+            _, (_, evicted) = _share_cache.popitem(last=False)
+            _share_cache_by_note.pop((db_path, evicted['note_id']), None)
+    return entry
+
+
+def invalidate_share_cache(note_id):
+    with _share_cache_lock:
+        key = _share_cache_by_note.pop((app.config['DATABASE'], note_id), None)
+        if key:
+            _share_cache.pop(key, None)
+
+
+def share_cache_stats():
+    with _share_cache_lock:
+        stats = dict(_share_counters)
+        stats['entries'] = len(_share_cache)
+        stats['negative_entries'] = len(_share_negative)
+    return stats
+
+
+# Autosave write-behind buffer. Autosaves are acknowledged as soon as they are
+# queued; a background thread writes the latest state of every queued note in
+# one transaction every AUTOSAVE_FLUSH_MS, so a burst of saves (many notes,
+# or one note saved repeatedly) costs one commit. Explicit saves, note
+# views/exports and process exit flush first. Set AUTOSAVE_FLUSH_MS=0 to
+# write autosaves synchronously. Keep it well below the client's 4 s
+# debounce: with several workers the next autosave may reach another process,
+# which only sees what has been flushed. A flush keeps its batch in
+# _autosave_inflight until it commits, so acknowledged states stay visible to
+# pending_autosave() while they are being written.
+app.config['AUTOSAVE_FLUSH_MS'] = int(os.environ.get('AUTOSAVE_FLUSH_MS', 1000))
+_autosave_lock = threading.Lock()
+_autosave_flush_lock = threading.Lock()  # one flush at a time per process
+_autosave_pending = {}  # (database path, note id) -> latest note state
+_autosave_inflight = {}  # (database path, note id) -> state being written by the running flush
+_autosave_worker = {'pid': None, 'thread': None}
+_autosave_counters = {'queued': 0, 'coalesced': 0, 'flushes': 0, 'flushed_notes': 0, 'last_batch_size': 0,
+                      'max_batch_size': 0, 'last_flush_ms': 0.0, 'max_flush_ms': 0.0, 'total_flush_ms': 0.0}
+
+
+def _autosave_flusher():
+    while True:
+        time.sleep(max(app.config['AUTOSAVE_FLUSH_MS'], 50) / 1000)
+        try:
+            with app.app_context():
+                flush_autosaves()
+        except Exception:
+            app.logger.exception('autosave flush failed')
+
+
+def queue_autosave(state):
+    """Queue the full new state of a note (dict with the notes columns) for writing."""
+    key = (app.config['DATABASE'], state['id'])
+    with _autosave_lock:
+        if _autosave_worker['pid'] != os.getpid():
+            # the flusher thread and queued saves belong to the parent process
+            _autosave_pending.clear()
+            _autosave_inflight.clear()
+            _autosave_worker['pid'] = os.getpid()
+            _autosave_worker['thread'] = None
+        if key in _autosave_pending:
+            _autosave_counters['coalesced'] += 1
+        _autosave_pending[key] = state
+        _autosave_counters['queued'] += 1
+        if _autosave_worker['thread'] is None:
+            t = threading.Thread(target=_autosave_flusher, name='autosave-flusher', daemon=True)
+            t.start()
+            _autosave_worker['thread'] = t
+
+
+def pending_autosave(note_id):
+    """Latest acknowledged state of a note that isn't committed yet, or None."""
+    key = (app.config['DATABASE'], note_id)
+    with _autosave_lock:
+        return _autosave_pending.get(key) or _autosave_inflight.get(key)
+
+
+def discard_autosave(note_id):
+    with _autosave_lock:
+        _autosave_pending.pop((app.config['DATABASE'], note_id), None)
+
+
+def flush_autosaves(note_id=None):
+    """Write queued autosaves (all, or one note's) in a single transaction.
+
+    Waits for a flush already running in this process, so callers that flush
+    before reading a note also see the states that flush was writing.
+    """
+    with _autosave_flush_lock:
+        return _flush_autosaves(note_id)
+
+
+def _flush_autosaves(note_id):
+    db_path = app.config['DATABASE']
+    with _autosave_lock:
+        keys = [k for k in _autosave_pending if k[0] == db_path and (note_id is None or k[1] == note_id)]
+        for k in keys:
+            _autosave_inflight[k] = _autosave_pending.pop(k)
+        batch = [_autosave_inflight[k] for k in keys]
+    if not batch:
+        return 0
+    start = time.perf_counter()
     db = get_db()
-    cur = db.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='public_links'")
-    if not cur.fetchone():
-        # create table if missing
-        db.execute('''CREATE TABLE public_links (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            note_id INTEGER NOT NULL,
-            token TEXT NOT NULL UNIQUE,
-            created_at TEXT,
-            expires_at TEXT,
-            revoked INTEGER DEFAULT 0,
-            FOREIGN KEY(note_id) REFERENCES notes(id)
-        )''')
+    try:
+        # history deltas are computed before the write transaction starts
+        prepared = [prepare_revision(db, n, 'autosave') for n in batch]
+        for n, revision in zip(batch, prepared):
+            # never let a late flush overwrite a newer explicit save
+            cur = db.execute('UPDATE notes SET title = ?, content = ?, tags = ?, period = ?, region = ?, updated_at = ?, revision = ? '
+                             'WHERE id = ? AND user_id = ? AND revision < ?',
+                             (n['title'], pack_content(n['content']), n['tags'], n['period'], n['region'], n['updated_at'], n['revision'],
+                              n['id'], n['user_id'], n['revision']))
+            if cur.rowcount:
+                note_saved(db, n['id'], n['user_id'], n['title'], n['content'], n['tags'])
+                record_revision(db, n, revision)
         db.commit()
+    except Exception:
+        db.rollback()
+        with _autosave_lock:
+            # newer states queued meanwhile win over the ones that failed
+            for k in keys:
+                _autosave_pending.setdefault(k, _autosave_inflight.pop(k))
+        raise
+    with _autosave_lock:
+        for k in keys:
+            _autosave_inflight.pop(k, None)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    with _autosave_lock:
+        c = _autosave_counters
+        c['flushes'] += 1
+        c['flushed_notes'] += len(batch)
+        c['last_batch_size'] = len(batch)
+        c['max_batch_size'] = max(c['max_batch_size'], len(batch))
+        c['last_flush_ms'] = elapsed_ms
+        c['max_flush_ms'] = max(c['max_flush_ms'], elapsed_ms)
+        c['total_flush_ms'] += elapsed_ms
+    return len(batch)
+
+
+def autosave_stats():
+    with _autosave_lock:
+        stats = dict(_autosave_counters)
+        stats['pending'] = len(_autosave_pending)
+    return stats
+
+
+def save_note_state(db, state):
+    """Persist an autosaved note state, through the write-behind buffer when enabled."""
+    if app.config['AUTOSAVE_FLUSH_MS'] > 0:
+        queue_autosave(state)
+        return
+    revision = prepare_revision(db, state, 'autosave')
+    db.execute('UPDATE notes SET title = ?, content = ?, tags = ?, period = ?, region = ?, updated_at = ?, revision = ? WHERE id = ? AND user_id = ?',
+               (state['title'], pack_content(state['content']), state['tags'], state['period'], state['region'], state['updated_at'], state['revision'],
+                state['id'], state['user_id']))
+    note_saved(db, state['id'], state['user_id'], state['title'], state['content'], state['tags'])
+    record_revision(db, state, revision)
+    db.commit()
+
+
+@atexit.register
+def _flush_autosaves_at_exit():
+    if _autosave_worker['pid'] != os.getpid():
         return
-    cur = db.execute("PRAGMA table_info(public_links)")
-    cols = [r[1] for r in cur.fetchall()]
+    try:
+        with app.app_context():
+            flush_autosaves()
+    except Exception:
+        app.logger.exception('autosave flush at exit failed')
+
+
+# Schema migrations. Each entry is (version, name, steps) where a step is an
+# SQL statement or a callable taking the connection. Migrations are
+# forward-only, must never drop data, and are applied in order inside one
+# transaction each; applied versions are recorded in schema_version.
+def _baseline_schema(db):
+    with app.open_resource('schema.sql', mode='r') as f:
+        for stmt in f.read().split(';'):
+            if stmt.strip():
+                db.execute(stmt)
+
+
+def _public_links_columns(db):
+    # databases created before link expiry/revocation existed
+    cols = [r[1] for r in db.execute('PRAGMA table_info(public_links)').fetchall()]
     if 'expires_at' not in cols:
-        db.execute("ALTER TABLE public_links ADD COLUMN expires_at TEXT")
+        db.execute('ALTER TABLE public_links ADD COLUMN expires_at TEXT')
     if 'revoked' not in cols:
-        db.execute("ALTER TABLE public_links ADD COLUMN revoked INTEGER DEFAULT 0")
-    db.commit()
+        db.execute('ALTER TABLE public_links ADD COLUMN revoked INTEGER DEFAULT 0')
 
 
-def query_db(query, args=(), one=False):
-    cur = get_db().execute(query, args)
-    rv = cur.fetchall()
-    cur.close()
-    return (rv[0] if rv else None) if one else rv
+def _notes_columns(db):
+    # databases created before the world-history metadata existed. This is the
+    # first step of migration 4, the first one to read these columns, so a
+    # database that stopped at version 3 on this error is repaired as well.
+    cols = [r[1] for r in db.execute('PRAGMA table_info(notes)').fetchall()]
+    for col in ('tags', 'period', 'region', 'updated_at'):
+        if col not in cols:
+            db.execute(f'ALTER TABLE notes ADD COLUMN {col} TEXT')
+
+
+MIGRATIONS = [
+    (1, 'baseline schema', [_baseline_schema]),
+    (2, 'public_links expiry and revocation', [_public_links_columns]),
+    (3, 'full-text search index', [
+        # the trigram tokenizer matches Japanese text without word segmentation
+        # replaced (and filled) by migration 12
+        "CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(title, content, user_id UNINDEXED, tokenize='trigram')",
+    ]),
+    (4, 'tag index', [
+        _notes_columns,
+        """CREATE TABLE IF NOT EXISTS note_tags (
+            note_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            tag TEXT NOT NULL,
+            PRIMARY KEY (note_id, tag),
+            FOREIGN KEY(note_id) REFERENCES notes(id)
+        )""",
+        'CREATE INDEX IF NOT EXISTS idx_note_tags_user_tag ON note_tags(user_id, tag, note_id)',
+        rebuild_note_tags,
+    ]),
+    (5, 'secondary indexes', [
+        # keyset pagination needs a non-NULL sort key
+        "UPDATE notes SET updated_at = coalesce(created_at, '') WHERE updated_at IS NULL",
+        'CREATE INDEX IF NOT EXISTS idx_notes_user_updated ON notes(user_id, updated_at, id)',
+        'CREATE INDEX IF NOT EXISTS idx_public_links_note ON public_links(note_id)',
+        'CREATE INDEX IF NOT EXISTS idx_public_links_token_state ON public_links(token, revoked, expires_at)',
+    ]),
+    (6, 'note revision counter', [
+        'ALTER TABLE notes ADD COLUMN revision INTEGER NOT NULL DEFAULT 0',
+    ]),
+    (7, 'cross-process cache invalidation counters', [
+        'CREATE TABLE IF NOT EXISTS cache_epochs (name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)',
+        "INSERT OR IGNORE INTO cache_epochs (name, value) VALUES ('share_links', 0)",
+    ]),
+    (8, 'expiry index for share cleanup', [
+        # scripts/cleanup_expired_shares.py: revoked = 0 AND expires_at < now
+        'CREATE INDEX IF NOT EXISTS idx_public_links_active_expiry ON public_links(expires_at) WHERE revoked = 0',
+    ]),
+    (9, 'background jobs', [
+        # export/import jobs; shared by all workers so any of them can report status
+        'CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, user_id INTEGER NOT NULL, kind TEXT NOT NULL, '
+        'status TEXT NOT NULL, created_at TEXT, started_at TEXT, finished_at TEXT, result TEXT, error TEXT)',
+    ]),
+    (10, 'facet counts', [_note_facets_schema]),
+    (11, 'revision history', [_note_revisions_schema]),
+    (12, 'per-user search index with bigrams', [_search_index_schema]),
+]
+
+
+def schema_version(db):
+    db.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name TEXT, applied_at TEXT)')
+    row = db.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+
+def pending_migrations(db):
+    current = schema_version(db)
+    return [m for m in MIGRATIONS if m[0] > current]
+
+
+def migrate_db(db):
+    """Apply pending migrations. Returns the list of versions applied."""
+    register_sql_functions(db)  # steps may rebuild derived tables from content
+    applied = []
+    for version, name, steps in pending_migrations(db):
+        # BEGIN IMMEDIATE serialises workers starting at the same time; the
+        # version is re-checked once the write lock is held
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if schema_version(db) >= version:
+                db.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(db)
+                else:
+                    db.execute(step)
+            db.execute('INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)',
+                       (version, name, datetime.utcnow().isoformat()))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        applied.append(version)
+    return applied
 
 
 class User(UserMixin):
@@ -86,14 +1372,110 @@ class User(UserMixin):
         self.username = username
 
 
+# Logged-in users are cached per process so that authenticated requests
+# (every autosave, dashboard paging) don't query the users table. Entries
+# live for USER_CACHE_TTL seconds in an LRU of USER_CACHE_SIZE users. Every
+# place that updates a users row calls invalidate_user_cache() (today only
+# the password rehash in login()); other workers, and changes made outside
+# the app, are seen after the TTL.
+app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 300))
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 1000))
+# werkzeug hash method for new passwords, e.g. 'pbkdf2:sha256:100000' to make
+# login bursts cheaper; empty keeps werkzeug's default. Existing hashes made
+# with another method are upgraded on the next successful login.
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', '')
+_user_cache = OrderedDict()  # (db path, user id) -> (deadline, User)
+_user_cache_lock = threading.Lock()
+_user_counters = {'hits': 0, 'misses': 0}
+
+
+def cache_user(user):
+    key = (app.config['DATABASE'], int(user.id))
+    with _user_cache_lock:
+        _user_cache[key] = (time.monotonic() + app.config['USER_CACHE_TTL'], user)
+        _user_cache.move_to_end(key)
+        while len(_user_cache) > app.config['USER_CACHE_SIZE']:
+            _user_cache.popitem(last=False)
+
+
+def invalidate_user_cache(user_id):
+    with _user_cache_lock:
+        _user_cache.pop((app.config['DATABASE'], int(user_id)), None)
+
+
+def user_cache_stats():
+    with _user_cache_lock:
+        stats = dict(_user_counters)
+        stats['entries'] = len(_user_cache)
+    return stats
+
+
+def hash_password(password):
+    method = app.config['PASSWORD_HASH_METHOD']
+    return generate_password_hash(password, method=method) if method else generate_password_hash(password)
+
+
+_hash_prefixes = {}  # configured method -> method werkzeug records, e.g. 'pbkdf2:sha256' -> 'pbkdf2:sha256:260000'
+
+
+def password_hash_prefix(method):
+    """The method prefix werkzeug stores for hashes made with method; ValueError if it is not supported."""
+    if method not in _hash_prefixes:
+        try:
+            _hash_prefixes[method] = generate_password_hash('', method=method).split('$', 1)[0]
+        except ValueError as e:
+            raise ValueError(f'invalid PASSWORD_HASH_METHOD {method!r}: {e}') from None
+    return _hash_prefixes[method]
+
+
+def password_needs_rehash(stored):
+    method = app.config['PASSWORD_HASH_METHOD']
+    return bool(method) and stored.split('$', 1)[0] != password_hash_prefix(method)
+
+
+# fail at startup rather than on every register/login
+if app.config['PASSWORD_HASH_METHOD']:
+    password_hash_prefix(app.config['PASSWORD_HASH_METHOD'])
+
+
 @login_manager.user_loader
 def load_user(user_id):
+    try:
+        key = (app.config['DATABASE'], int(user_id))
+    except ValueError:
+        return None
+    with _user_cache_lock:
+        hit = _user_cache.get(key)
+        if hit and hit[0] > time.monotonic():
+            _user_cache.move_to_end(key)
+            _user_counters['hits'] += 1
+            return hit[1]
+        _user_counters['misses'] += 1
     user = query_db('SELECT * FROM users WHERE id = ?', (user_id,), one=True)
     if user:
-        return User(user['id'], user['username'])
+        user_obj = User(user['id'], user['username'])
+        cache_user(user_obj)
+        return user_obj
     return None
 
 
+@app.route('/stats')
+def stats():
+    # per-worker counters for operators; disabled unless STATS_ENABLED=1
+    if not app.config['STATS_ENABLED']:
+        return 'Not Found', 404
+    return jsonify({'db': db_stats(), 'autosave': autosave_stats(), 'markdown_cache': markdown_cache_stats(),
+                    'share_cache': share_cache_stats(), 'user_cache': user_cache_stats()})
+
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus scrape target; disabled unless PROFILING_ENABLED=1
+    if not app.config['PROFILING_ENABLED']:
+        return 'Not Found', 404
+    return Response(metrics_text(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -110,7 +1492,7 @@ def register():
         db = get_db()
         try:
             db.execute('INSERT INTO users (username, password) VALUES (?, ?)',
-                       (username, generate_password_hash(password)))
+                       (username, hash_password(password)))
             db.commit()
             flash('登録しました。ログインしてください。')
             return redirect(url_for('login'))
@@ -127,7 +1509,13 @@ def login():
         password = request.form.get('password', '')
         user = query_db('SELECT * FROM users WHERE username = ?', (username,), one=True)
         if user and check_password_hash(user['password'], password):
+            if password_needs_rehash(user['password']):
+                db = get_db()
+                db.execute('UPDATE users SET password = ? WHERE id = ?', (hash_password(password), user['id']))
+                db.commit()
+                invalidate_user_cache(user['id'])
             user_obj = User(user['id'], user['username'])
+            cache_user(user_obj)
             login_user(user_obj)
             return redirect(url_for('dashboard'))
         flash('認証に失敗しました')
@@ -143,46 +1531,101 @@ def logout():
 # note: using flask_login.login_required decorator instead of custom one
 
 
-@app.route('/dashboard')
-@login_required
-def dashboard():
-    user_id = int(current_user.get_id())
-    q = request.args.get('q','').strip()
-    period = request.args.get('period','').strip()
-    region = request.args.get('region','').strip()
-    tags = request.args.get('tags','').strip()
-    sql = 'SELECT * FROM notes WHERE user_id = ?'
+def search_filters():
+    """(q, period, region, tags) from the dashboard's query string."""
+    return tuple(request.args.get(name, '').strip() for name in ('q', 'period', 'region', 'tags'))
+
+
+def note_search_sql(user_id, q, period, region, tags):
+    """SQL selecting a user's notes matching the dashboard filters: (sql, params, order_by).
+
+    order_by is the relevance ordering for full-text searches as an
+    (ORDER BY clause, params) pair, None otherwise.
+    """
+    sql = 'SELECT n.* FROM notes n WHERE n.user_id = ?'
     params = [user_id]
+    order_by = None
     if q:
-        sql += ' AND (title LIKE ? OR content LIKE ?)'
-        params.extend([f'%{q}%', f'%{q}%'])
+        match, short_terms = split_search_terms(q)
+        if match:
+            # indexed full-text lookup, best matches first
+            sql = 'SELECT n.* FROM notes n JOIN notes_fts ON notes_fts.rowid = n.id WHERE n.user_id = ? AND notes_fts MATCH ?'
+            params.append(owner_match(user_id, match))
+            order_by = search_rank(search_terms(q))
+        if short_terms:
+            sql += ' AND n.id IN (SELECT rowid FROM notes_bigrams WHERE notes_bigrams MATCH ?)'
+            params.append(bigram_match(user_id, short_terms))
     if period:
-        sql += ' AND period = ?'
+        sql += ' AND n.period = ?'
         params.append(period)
     if region:
-        sql += ' AND region LIKE ?'
+        sql += ' AND n.region LIKE ?'
         params.append(f'%{region}%')
     if tags:
         # support comma-separated tags (OR match any)
         tag_list = [t.strip() for t in tags.split(',') if t.strip()]
         if tag_list:
-            tag_clauses = []
-            for t in tag_list:
-                tag_clauses.append('tags LIKE ?')
-                params.append(f'%{t}%')
-            sql += ' AND (' + ' OR '.join(tag_clauses) + ')'
-    # pagination
-    page = int(request.args.get('page', 1))
+            qmarks = ','.join(['?']*len(tag_list))
+            sql += f' AND n.id IN (SELECT note_id FROM note_tags WHERE user_id = ? AND tag IN ({qmarks}))'
+            params.append(user_id)
+            params.extend(tag_list)
+    return sql, params, order_by
+
+
+@app.route('/dashboard')
+@login_required
+def dashboard():
+    user_id = int(current_user.get_id())
+    q, period, region, tags = filters = search_filters()
+    sql, params, order_by = note_search_sql(user_id, *filters)
+    # pagination: the listing is ordered by (updated_at, id) and pages
+    # forward/backward with a keyset cursor, so deep pages stay as cheap as
+    # the first. Relevance-ranked searches page by offset over the match set.
     per_page = 10
-    # count total
-    count_sql = 'SELECT COUNT(*) as cnt FROM (' + sql + ')'
-    total_row = query_db(count_sql, tuple(params), one=True)
-    total = total_row['cnt'] if total_row else 0
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+    except ValueError:
+        page = 1
+    total = cached_note_count(user_id, filters, sql, params)
+    facets = note_facet_counts(user_id, filters)
+    all_facets = note_facet_counts(user_id) if any(filters) else facets
+    # the usual periods in order, then any others the user has
+    period_counts = dict(all_facets['period'])
+    periods = [(p, period_counts.pop(p, 0)) for p in NOTE_PERIODS] + sorted(period_counts.items())
     total_pages = max(1, (total + per_page - 1) // per_page)
-    offset = (page - 1) * per_page
-    sql += ' LIMIT ? OFFSET ?'
-    params.extend([per_page, offset])
-    notes = query_db(sql, tuple(params))
+    after = decode_cursor(request.args.get('after', ''))
+    before = decode_cursor(request.args.get('before', ''))
+    has_next = has_prev = False
+    if order_by:
+        clause, order_params = order_by
+        sql += clause + ', n.id LIMIT ? OFFSET ?'
+        params.extend(order_params + [per_page + 1, (page - 1) * per_page])
+        notes = query_db(sql, tuple(params))
+        has_next, has_prev = len(notes) > per_page, page > 1
+        notes = notes[:per_page]
+    elif before:
+        sql += ' AND (n.updated_at, n.id) > (?, ?) ORDER BY n.updated_at, n.id LIMIT ?'
+        params.extend([before[0], before[1], per_page + 1])
+        notes = query_db(sql, tuple(params))
+        has_next, has_prev = True, len(notes) > per_page
+        notes = notes[:per_page][::-1]
+    else:
+        if after:
+            sql += ' AND (n.updated_at, n.id) < (?, ?)'
+            params.extend(after)
+        sql += ' ORDER BY n.updated_at DESC, n.id DESC LIMIT ? OFFSET ?'
+        params.extend([per_page + 1, 0 if after else (page - 1) * per_page])
+        notes = query_db(sql, tuple(params))
+        has_next, has_prev = len(notes) > per_page, bool(after) or page > 1
+        notes = notes[:per_page]
+    filter_args = {'q': q, 'period': period, 'region': region, 'tags': tags}
+    next_url = prev_url = None
+    if has_next and notes:
+        cursor = {} if order_by else {'after': encode_cursor(notes[-1])}
+        next_url = url_for('dashboard', page=page + 1, **filter_args, **cursor)
+    if has_prev and notes:
+        cursor = {} if order_by or page <= 2 else {'before': encode_cursor(notes[0])}
+        prev_url = url_for('dashboard', page=max(1, page - 1), **filter_args, **cursor)
     # fetch public link tokens for displayed notes
     note_ids = [n['id'] for n in notes]
     public_map = {}
@@ -191,7 +1634,24 @@ def dashboard():
         rows = query_db(f'SELECT note_id, token FROM public_links WHERE note_id IN ({qmarks})', tuple(note_ids))
         for r in rows:
             public_map[r['note_id']] = r['token']
-    return render_template('dashboard.html', notes=notes, q=q, period=period, region=region, tags=tags, page=page, total_pages=total_pages, public_map=public_map)
+    return render_template('dashboard.html', notes=notes, q=q, period=period, region=region, tags=tags, page=page, total_pages=total_pages, next_url=next_url, prev_url=prev_url, public_map=public_map,
+                           facets=facets, periods=periods)
+
+
+@app.route('/facets')
+@login_required
+def facet_counts():
+    # counts per period/region/tag for the dashboard search given in the query string
+    facets = note_facet_counts(int(current_user.get_id()), search_filters())
+    return jsonify({f: [{'value': v, 'count': c} for v, c in values] for f, values in facets.items()})
+
+
+@app.route('/tags')
+@login_required
+def tag_counts():
+    user_id = int(current_user.get_id())
+    rows = query_db("SELECT value AS tag, count AS cnt FROM note_facets WHERE user_id = ? AND facet = 'tags' ORDER BY cnt DESC, tag", (user_id,))
+    return jsonify({'tags': [{'tag': r['tag'], 'count': r['cnt']} for r in rows]})
 
 
 @app.route('/notes/new', methods=['GET', 'POST'])
@@ -204,21 +1664,47 @@ def note_new():
         period = request.form.get('period','').strip()
         region = request.form.get('region','').strip()
         db = get_db()
+        now = datetime.utcnow().isoformat()
         cur = db.execute('INSERT INTO notes (user_id, title, content, tags, period, region, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-                   (int(current_user.get_id()), title, content, tags, period, region, datetime.utcnow().isoformat(), datetime.utcnow().isoformat()))
-        db.commit()
+                   (int(current_user.get_id()), title, pack_content(content), tags, period, region, now, now))
         note_id = cur.lastrowid
+        note_saved(db, note_id, int(current_user.get_id()), title, content, tags)
+        # a new note has no earlier version to diff against
+        state = {'id': note_id, 'user_id': int(current_user.get_id()), 'title': title, 'content': content, 'tags': tags,
+                 'period': period, 'region': region, 'updated_at': now, 'revision': 0}
+        record_revision(db, state, prepare_revision(db, state, 'create'))
+        db.commit()
         if request.headers.get('X-Auto-Save'):
-            return jsonify({'status':'ok','id': note_id})
+            # note.js switches to these for every later save of this note
+            return jsonify({'status':'ok','id': note_id, 'revision': 0, 'edit_url': url_for('note_edit', note_id=note_id),
+                            'autosave_url': url_for('note_autosave', note_id=note_id)})
         return redirect(url_for('dashboard'))
     # default world-history template for new notes
     default_content = "# 年表\n\n- 年: 主要出来事\n\n# 重要人物\n\n- 名前 — 役割／説明\n\n# 出来事の詳細\n\n説明をここに書いてください。\n\n# 参考文献\n\n- 出典1\n"
     return render_template('note_edit.html', note=None, default_content=default_content, templates=NOTE_TEMPLATES)
 
 
+def save_note(db, state, source):
+    """Write a note state as the next revision, with its indexes and history (caller commits)."""
+    prepared = prepare_revision(db, state, source)
+    rows = db.execute('UPDATE notes SET title = ?, content = ?, tags = ?, period = ?, region = ?, updated_at = ?, revision = revision + 1 '
+                      'WHERE id = ? AND user_id = ? RETURNING revision',
+                      (state['title'], pack_content(state['content']), state['tags'], state['period'], state['region'], state['updated_at'],
+                       state['id'], state['user_id'])).fetchall()
+    if not rows:
+        return None
+    note_saved(db, state['id'], state['user_id'], state['title'], state['content'], state['tags'])
+    record_revision(db, dict(state, revision=rows[0]['revision']), prepared)
+    return rows[0]['revision']
+
+
 @app.route('/notes/<int:note_id>/edit', methods=['GET', 'POST'])
 @login_required
 def note_edit(note_id):
+    autosave = bool(request.headers.get('X-Auto-Save'))
+    if not autosave:
+        # explicit saves and the editor always see queued autosaves
+        flush_autosaves(note_id)
     note = query_db('SELECT * FROM notes WHERE id = ? AND user_id = ?', (note_id, int(current_user.get_id())), one=True)
     if not note:
         flash('ノートが見つかりません')
@@ -230,20 +1716,109 @@ def note_edit(note_id):
         period = request.form.get('period','').strip()
         region = request.form.get('region','').strip()
         db = get_db()
-        db.execute('UPDATE notes SET title = ?, content = ?, tags = ?, period = ?, region = ?, updated_at = ? WHERE id = ? AND user_id = ?',
-                   (title, content, tags, period, region, datetime.utcnow().isoformat(), note_id, int(current_user.get_id())))
+        if autosave:
+            current = pending_autosave(note_id) or note
+            state = {'id': note_id, 'user_id': int(current_user.get_id()), 'title': title, 'content': content, 'tags': tags,
+                     'period': period, 'region': region, 'updated_at': datetime.utcnow().isoformat(), 'revision': current['revision'] + 1}
+            save_note_state(db, state)
+            return jsonify({'status':'ok', 'revision': state['revision']})
+        state = {'id': note_id, 'user_id': int(current_user.get_id()), 'title': title, 'content': content, 'tags': tags,
+                 'period': period, 'region': region, 'updated_at': datetime.utcnow().isoformat()}
+        save_note(db, state, 'edit')
         db.commit()
-        if request.headers.get('X-Auto-Save'):
-            return jsonify({'status':'ok'})
         return redirect(url_for('dashboard'))
     return render_template('note_edit.html', note=note, templates=NOTE_TEMPLATES)
 
 
+AUTOSAVE_FIELDS = ('title', 'tags', 'period', 'region')
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def valid_autosave_body(data):
+    """True if an autosave body has the shape note_autosave expects."""
+    if not isinstance(data, dict) or not _is_int(data.get('base_revision')):
+        return False
+    if 'length' in data and not _is_int(data['length']):
+        return False
+    if not isinstance(data.get('fields', {}), dict):
+        return False
+    patches = data.get('patches', [])
+    if not isinstance(patches, list):
+        return False
+    return all(isinstance(p, dict) and _is_int(p.get('start')) and _is_int(p.get('delete', 0))
+               and isinstance(p.get('insert', ''), str) for p in patches)
+
+
+def apply_text_patches(text, patches):
+    """Apply splice patches {start, delete, insert} to text, in order.
+
+    Offsets count UTF-16 code units, as JavaScript string indices do, so the
+    browser can compute them directly. Raises ValueError for patches that
+    don't fit the text.
+    """
+    buf = text.encode('utf-16-le')
+    for p in patches:
+        start, delete, insert = int(p['start']), int(p.get('delete', 0)), str(p.get('insert', ''))
+        if start < 0 or delete < 0 or (start + delete) * 2 > len(buf):
+            raise ValueError('patch out of range')
+        buf = buf[:start * 2] + insert.encode('utf-16-le') + buf[(start + delete) * 2:]
+    return buf.decode('utf-16-le')
+
+
+@app.route('/notes/<int:note_id>/autosave', methods=['POST'])
+@login_required
+def note_autosave(note_id):
+    """Incremental autosave used by note.js.
+
+    Body: {"base_revision": n, "patches": [{"start", "delete", "insert"}],
+    "length": <UTF-16 length of the resulting content>, "fields": {changed
+    metadata}}. Replies 400 for malformed bodies, 409 with the current
+    revision when the note has moved on since base_revision (or the patched
+    text doesn't match the client's), and skips the write entirely when
+    nothing changed.
+    """
+    user_id = int(current_user.get_id())
+    data = request.get_json(silent=True)
+    if not valid_autosave_body(data):
+        return jsonify({'status': 'error', 'message': 'invalid request'}), 400
+    note = query_db('SELECT * FROM notes WHERE id = ? AND user_id = ?', (note_id, user_id), one=True)
+    if not note:
+        return jsonify({'status': 'error', 'message': 'not found'}), 404
+    note = pending_autosave(note_id) or note
+    if data['base_revision'] != note['revision']:
+        return jsonify({'status': 'conflict', 'revision': note['revision']}), 409
+    # browsers hand textarea values over with \n line endings
+    old_content = (note['content'] or '').replace('\r\n', '\n')
+    try:
+        content = apply_text_patches(old_content, data.get('patches') or [])
+    except ValueError:
+        # patches that don't fit the text: the client's base differs from ours
+        return jsonify({'status': 'conflict', 'revision': note['revision']}), 409
+    if 'length' in data and len(content.encode('utf-16-le')) // 2 != data['length']:
+        return jsonify({'status': 'conflict', 'revision': note['revision']}), 409
+    fields = {k: note[k] or '' for k in AUTOSAVE_FIELDS}
+    for k, v in (data.get('fields') or {}).items():
+        if k in fields:
+            fields[k] = str(v).strip()
+    if content == (note['content'] or '') and all(fields[k] == (note[k] or '') for k in AUTOSAVE_FIELDS):
+        return jsonify({'status': 'ok', 'revision': note['revision'], 'saved': False})
+    state = dict(fields, id=note_id, user_id=user_id, content=content,
+                 updated_at=datetime.utcnow().isoformat(), revision=note['revision'] + 1)
+    save_note_state(get_db(), state)
+    return jsonify({'status': 'ok', 'revision': state['revision'], 'saved': True})
+
+
 @app.route('/notes/<int:note_id>/delete', methods=['POST'])
 @login_required
 def note_delete(note_id):
     db = get_db()
-    db.execute('DELETE FROM notes WHERE id = ? AND user_id = ?', (note_id, int(current_user.get_id())))
+    cur = db.execute('DELETE FROM notes WHERE id = ? AND user_id = ?', (note_id, int(current_user.get_id())))
+    if cur.rowcount:
+        discard_autosave(note_id)
+        note_deleted(db, note_id, int(current_user.get_id()))
     db.commit()
     return redirect(url_for('dashboard'))
 
@@ -251,20 +1826,89 @@ def note_delete(note_id):
 @app.route('/notes/<int:note_id>/export')
 @login_required
 def note_export(note_id):
+    flush_autosaves(note_id)
     note = query_db('SELECT * FROM notes WHERE id = ? AND user_id = ?', (note_id, int(current_user.get_id())), one=True)
     if not note:
         flash('ノートが見つかりません')
         return redirect(url_for('dashboard'))
-    title = note['title'] or f'note-{note_id}'
-    md = f"# {title}\n\n" \
-         + (f"<!-- period:{note['period'] or ''} region:{note['region'] or ''} tags:{note['tags'] or ''} -->\n\n") \
-         + (note['content'] or '')
-    resp = make_response(md)
+    resp = make_response(note_markdown(note))
     resp.headers.set('Content-Type', 'text/markdown; charset=utf-8')
-    resp.headers.set('Content-Disposition', f'attachment; filename={title.replace(" ","_")}-{note_id}.md')
+    resp.headers.set('Content-Disposition', f'attachment; filename={note_markdown_filename(note)}')
     return resp
 
 
+def note_markdown(note):
+    """Markdown export of a note: title heading, metadata comment, content."""
+    title = note['title'] or f"note-{note['id']}"
+    return f"# {title}\n\n" \
+        + (f"<!-- period:{note['period'] or ''} region:{note['region'] or ''} tags:{note['tags'] or ''} -->\n\n") \
+        + (note['content'] or '')
+
+
+_UNSAFE_FILENAME_CHARS = re.compile(r'[/\\\x00-\x1f\x7f]')
+
+
+def note_markdown_filename(note):
+    """A flat file name for a note's Markdown export (also the ZIP member name).
+
+    Path separators and control characters become '_' and leading dots are
+    dropped, so a title like '../x' can't name a path outside the archive.
+    """
+    title = _UNSAFE_FILENAME_CHARS.sub('_', note['title'] or '').replace(' ', '_').lstrip('.') or f"note-{note['id']}"
+    return f"{title}-{note['id']}.md"
+
+
+@app.route('/notes/<int:note_id>/revisions')
+@login_required
+def note_revisions(note_id):
+    flush_autosaves(note_id)
+    note = query_db('SELECT id, title, revision FROM notes WHERE id = ? AND user_id = ?', (note_id, int(current_user.get_id())), one=True)
+    if not note:
+        flash('ノートが見つかりません')
+        return redirect(url_for('dashboard'))
+    revisions = query_db(f'SELECT {REVISION_LIST_COLUMNS} FROM note_revisions WHERE note_id = ? ORDER BY revision DESC', (note_id,))
+    return render_template('revisions.html', note=note, revisions=revisions)
+
+
+@app.route('/notes/<int:note_id>/revisions/<int:revision>')
+@login_required
+def note_revision_view(note_id, revision):
+    """One past version in the note_export Markdown format."""
+    if not query_db('SELECT 1 FROM notes WHERE id = ? AND user_id = ?', (note_id, int(current_user.get_id())), one=True):
+        flash('ノートが見つかりません')
+        return redirect(url_for('dashboard'))
+    rev = note_revision(get_db(), note_id, revision)
+    if rev is None:
+        flash('指定した版が見つかりません')
+        return redirect(url_for('note_revisions', note_id=note_id))
+    rev['id'] = note_id
+    resp = make_response(note_markdown(rev))
+    resp.headers.set('Content-Type', 'text/markdown; charset=utf-8')
+    return resp
+
+
+@app.route('/notes/<int:note_id>/revisions/<int:revision>/restore', methods=['POST'])
+@login_required
+def note_revision_restore(note_id, revision):
+    """Save a past version as the newest revision; later versions stay in the history."""
+    flush_autosaves(note_id)
+    user_id = int(current_user.get_id())
+    if not query_db('SELECT 1 FROM notes WHERE id = ? AND user_id = ?', (note_id, user_id), one=True):
+        flash('ノートが見つかりません')
+        return redirect(url_for('dashboard'))
+    db = get_db()
+    rev = note_revision(db, note_id, revision)
+    if rev is None:
+        flash('指定した版が見つかりません')
+        return redirect(url_for('note_revisions', note_id=note_id))
+    state = {k: rev[k] for k in ('title', 'content', 'tags', 'period', 'region')}
+    state.update(id=note_id, user_id=user_id, updated_at=datetime.utcnow().isoformat())
+    save_note(db, state, 'restore')
+    db.commit()
+    flash(f'版 {revision} を復元しました')
+    return redirect(url_for('note_edit', note_id=note_id))
+
+
 @app.route('/notes/<int:note_id>/share', methods=['POST'])
 @login_required
 def note_share(note_id):
@@ -288,34 +1932,72 @@ def note_share(note_id):
         if expires_at:
             db = get_db()
             db.execute('UPDATE public_links SET expires_at = ?, revoked = 0 WHERE note_id = ?', (expires_at, note_id))
+            bump_share_links_epoch(db)
             db.commit()
     else:
         token = uuid.uuid4().hex
         db = get_db()
         db.execute('INSERT INTO public_links (note_id, token, created_at, expires_at, revoked) VALUES (?, ?, ?, ?, 0)', (note_id, token, datetime.utcnow().isoformat(), expires_at))
+        bump_share_links_epoch(db)
         db.commit()
     link = url_for('public_note_view', token=token, _external=True)
     flash(f'公開リンクを生成しました: {link}')
     return redirect(url_for('dashboard'))
 
 
+# Public share pages are identical for every visitor, so they carry
+# validators (ETag/Last-Modified) derived from the note's updated_at and the
+# link state, and a public max-age that never outlives the link's expiry;
+# nginx and browsers can then cache them and revalidate with 304s.
+app.config['PUBLIC_CACHE_MAX_AGE'] = int(os.environ.get('PUBLIC_CACHE_MAX_AGE', 60))
+
+
+def public_validators(note_id, updated_at, share):
+    """(ETag, Last-Modified) for a public page: note version plus link state."""
+    validator = f"{note_id}:{updated_at}:{share['expires_raw']}:{int(share['revoked'])}"
+    etag = hashlib.sha1(validator.encode('utf-8')).hexdigest()
+    try:
+        last_modified = datetime.fromisoformat(updated_at).replace(tzinfo=timezone.utc, microsecond=0)
+    except (TypeError, ValueError):
+        last_modified = None
+    return etag, last_modified
+
+
+def public_not_found():
+    resp = make_response(render_template('public_not_found.html'), 404)
+    # a revoked link may be re-shared later; don't let caches keep the 404
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+
 @app.route('/s/<token>')
 def public_note_view(token):
-    row = query_db('SELECT n.*, p.expires_at as expires_at, p.revoked as revoked FROM notes n JOIN public_links p ON p.note_id = n.id WHERE p.token = ?', (token,), one=True)
-    if not row:
-        return render_template('public_not_found.html'), 404
+    share = lookup_share(token)
     # check revoked/expired
-    if row['revoked']:
-        return render_template('public_not_found.html'), 404
-    if row['expires_at']:
-        try:
-            exp = datetime.fromisoformat(row['expires_at'])
-            if datetime.utcnow() > exp:
-                return render_template('public_not_found.html'), 404
-        except Exception:
-            pass
-    # render a minimal read-only view
-    return render_template('public_note.html', note=row)
+    if not share or share['revoked']:
+        return public_not_found()
+    max_age = app.config['PUBLIC_CACHE_MAX_AGE']
+    if share['expires_at']:
+        if datetime.utcnow() > share['expires_at']:
+            return public_not_found()
+        max_age = min(max_age, int((share['expires_at'] - datetime.utcnow()).total_seconds()))
+    etag, last_modified = public_validators(share['note_id'], share['updated_at'], share)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        resp = make_response('', 304)
+    else:
+        note = query_db('SELECT * FROM notes WHERE id = ?', (share['note_id'],), one=True)
+        if not note:
+            return public_not_found()
+        if note['updated_at'] != share['updated_at']:
+            # edited through another worker since the link state was cached
+            etag, last_modified = public_validators(note['id'], note['updated_at'], share)
+        # render a minimal read-only view
+        resp = make_response(render_template('public_note.html', note=note, content_html=rendered_note_html(note), public_page=True))
+    resp.set_etag(etag)
+    if last_modified:
+        resp.last_modified = last_modified
+    resp.headers['Cache-Control'] = f'public, max-age={max(max_age, 0)}'
+    return resp
 
 
 @app.route('/shares')
@@ -341,74 +2023,404 @@ def shares_revoke(link_id):
         return redirect(url_for('shares_list'))
     db = get_db()
     db.execute('UPDATE public_links SET revoked = 1 WHERE id = ?', (link_id,))
+    bump_share_links_epoch(db)
     db.commit()
     flash('共有リンクを取り消しました')
     return redirect(url_for('shares_list'))
 
 
+# Bulk exports are generated from the cursor EXPORT_CHUNK_SIZE notes at a
+# time and streamed, so worker memory stays flat however many notes a user has.
+app.config['EXPORT_CHUNK_SIZE'] = int(os.environ.get('EXPORT_CHUNK_SIZE', 200))
+EXPORT_CSV_COLUMNS = ['id','title','tags','period','region','created_at','updated_at','content']
+
+
+def _iter_user_notes(db, user_id):
+    cur = db.execute('SELECT * FROM notes WHERE user_id = ? ORDER BY created_at DESC', (user_id,))
+    try:
+        while True:
+            rows = cur.fetchmany(app.config['EXPORT_CHUNK_SIZE'])
+            if not rows:
+                break
+            yield rows
+    finally:
+        cur.close()
+
+
+def iter_export_csv(db, user_id):
+    """Yield the CSV export of a user's notes in chunks of text."""
+    si = io.StringIO()
+    writer = csv.writer(si)
+    writer.writerow(EXPORT_CSV_COLUMNS)
+    for rows in _iter_user_notes(db, user_id):
+        for n in rows:
+            writer.writerow([n['id'], n['title'] or '', n['tags'] or '', n['period'] or '', n['region'] or '', n['created_at'] or '', n['updated_at'] or '', n['content'] or ''])
+        yield si.getvalue()
+        si.seek(0)
+        si.truncate()
+    if si.tell():
+        yield si.getvalue()
+
+
+class _ZipStream(io.RawIOBase):
+    """Write-only, unseekable sink that hands zipfile output back in pieces."""
+
+    def __init__(self):
+        self.parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.parts.append(bytes(b))
+        return len(b)
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def iter_export_zip(db, user_id):
+    """Yield a ZIP of one Markdown file per note (the note_export format) in byte chunks."""
+    sink = _ZipStream()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for rows in _iter_user_notes(db, user_id):
+            for n in rows:
+                zf.writestr(note_markdown_filename(n), note_markdown(n))
+            yield sink.take()
+    yield sink.take()
+
+
 @app.route('/notes/export_all')
 @login_required
 def export_all_notes():
+    flush_autosaves()
     user_id = int(current_user.get_id())
-    notes = query_db('SELECT * FROM notes WHERE user_id = ? ORDER BY created_at DESC', (user_id,))
-    import csv
-    from io import StringIO
-    si = StringIO()
-    writer = csv.writer(si)
-    writer.writerow(['id','title','tags','period','region','created_at','updated_at','content'])
-    for n in notes:
-        writer.writerow([n['id'], n['title'] or '', n['tags'] or '', n['period'] or '', n['region'] or '', n['created_at'] or '', n['updated_at'] or '', n['content'] or ''])
-    output = si.getvalue()
-    resp = make_response(output)
-    resp.headers.set('Content-Type', 'text/csv; charset=utf-8')
+    db = get_db()
+    resp = Response(stream_with_context(iter_export_csv(db, user_id)), content_type='text/csv; charset=utf-8')
     resp.headers.set('Content-Disposition', f'attachment; filename=notes_all_user_{user_id}.csv')
     return resp
 
 
+@app.route('/notes/export_all.zip')
+@login_required
+def export_all_notes_zip():
+    flush_autosaves()
+    user_id = int(current_user.get_id())
+    db = get_db()
+    resp = Response(stream_with_context(iter_export_zip(db, user_id)), content_type='application/zip')
+    resp.headers.set('Content-Disposition', f'attachment; filename=notes_all_user_{user_id}.zip')
+    return resp
+
+
+# Markdown import. Accepts any number of .md files and/or ZIP archives of
+# them (as written by /notes/export_all.zip); archive members are read one at
+# a time. Files are parsed, decompressed and staged in a TEMP table first,
+# which doesn't lock the database; only the final INSERT ... SELECT into
+# notes and the set-based fill of the derived indexes hold the write lock.
+app.config['IMPORT_MAX_NOTE_BYTES'] = int(os.environ.get('IMPORT_MAX_NOTE_BYTES', 5 * 1024 * 1024))
+IMPORT_EXTENSIONS = ('.md', '.markdown', '.txt')
+_EXPORT_META = re.compile(r'^<!-- period:(.*?) region:(.*?) tags:(.*?) -->$')
+
+
+def parse_markdown_note(text):
+    """Parse an imported Markdown file into note fields.
+
+    Files in the note_export format (title heading, metadata comment, body)
+    round-trip exactly; any other file keeps its full text as content with
+    the first heading as title.
+    """
+    text = text.lstrip('\ufeff')
+    lines = text.split('\n')
+    title = ''
+    if lines and lines[0].startswith('#'):
+        title = lines[0].lstrip('#').strip()
+    if len(lines) >= 4 and lines[1] == '' and lines[3] == '':
+        meta = _EXPORT_META.match(lines[2])
+        if meta:
+            return {'title': title, 'content': '\n'.join(lines[4:]), 'period': meta.group(1),
+                    'region': meta.group(2), 'tags': meta.group(3)}
+    return {'title': title, 'content': text, 'period': '', 'region': '', 'tags': ''}
+
+
+def _iter_import_files(files):
+    """Yield (name, bytes or None, error) for every Markdown file in the upload."""
+    limit = app.config['IMPORT_MAX_NOTE_BYTES']
+    for f in files:
+        name = f.filename or 'upload'
+        if name.lower().endswith('.zip') or zipfile.is_zipfile(f.stream):
+            f.stream.seek(0)
+            try:
+                zf = zipfile.ZipFile(f.stream)
+            except zipfile.BadZipFile:
+                yield name, None, 'ZIPファイルを読み込めません'
+                continue
+            with zf:
+                for info in zf.infolist():
+                    member = f'{name}/{info.filename}'
+                    if info.is_dir():
+                        continue
+                    if not info.filename.lower().endswith(IMPORT_EXTENSIONS):
+                        yield member, None, '対応していない形式です'
+                    elif info.file_size > limit:
+                        yield member, None, 'ファイルが大きすぎます'
+                    else:
+                        try:
+                            with zf.open(info) as fh:
+                                data = fh.read(limit + 1)
+                        except (zipfile.BadZipFile, zlib.error, EOFError, RuntimeError, NotImplementedError):
+                            # corrupt, encrypted or unsupported member: fail this file only
+                            yield member, None, 'ZIPファイルを読み込めません'
+                        else:
+                            if len(data) > limit:
+                                yield member, None, 'ファイルが大きすぎます'
+                            else:
+                                yield member, data, None
+        else:
+            f.stream.seek(0)
+            data = f.stream.read(limit + 1)
+            if len(data) > limit:
+                yield name, None, 'ファイルが大きすぎます'
+            else:
+                yield name, data, None
+
+
+def import_notes(db, user_id, files, results):
+    """Insert every importable file as a note in one transaction.
+
+    Appends (name, error or None) to results per file and returns the number
+    of notes imported.
+    """
+    now = datetime.utcnow().isoformat()
+
+    def rows():
+        for name, data, error in _iter_import_files(files):
+            if data is not None:
+                try:
+                    note = parse_markdown_note(data.decode('utf-8'))
+                except UnicodeDecodeError:
+                    error = 'UTF-8 として読み込めません'
+            results.append((name, error))
+            if error is None:
+                yield (note['title'], pack_content(note['content']), note['tags'], note['period'], note['region'])
+
+    db.execute('CREATE TEMP TABLE IF NOT EXISTS import_staging '
+               '(seq INTEGER PRIMARY KEY, title TEXT, content, tags TEXT, period TEXT, region TEXT)')
+    try:
+        db.executemany('INSERT INTO temp.import_staging (title, content, tags, period, region) VALUES (?, ?, ?, ?, ?)', rows())
+        db.commit()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            # ids are allocated in order while the write lock is held
+            row = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'notes'").fetchone()
+            after_id = row[0] if row else 0
+            cur = db.execute('INSERT INTO notes (user_id, title, content, tags, period, region, created_at, updated_at) '
+                             'SELECT ?, title, content, tags, period, region, ?, ? FROM temp.import_staging ORDER BY seq',
+                             (user_id, now, now))
+            count = cur.rowcount
+            notes_bulk_saved(db, after_id, user_id)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    finally:
+        db.rollback()  # a half-staged upload that failed
+        db.execute('DELETE FROM temp.import_staging')
+        db.commit()
+    return count
+
+
 @app.route('/notes/import', methods=['GET', 'POST'])
 @login_required
 def note_import():
     if request.method == 'POST':
-        f = request.files.get('file')
-        if not f:
+        files = [f for f in request.files.getlist('file') if f and f.filename]
+        if not files:
             flash('ファイルが選択されていません')
             return redirect(url_for('note_import'))
-        data = f.read().decode('utf-8')
-        title = ''
-        lines = data.splitlines()
-        if lines and lines[0].startswith('#'):
-            title = lines[0].lstrip('#').strip()
-        content = data
-        db = get_db()
-        cur = db.execute('INSERT INTO notes (user_id, title, content, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
-                   (int(current_user.get_id()), title, content, datetime.utcnow().isoformat(), datetime.utcnow().isoformat()))
-        db.commit()
-        flash('インポートしました')
-        return redirect(url_for('dashboard'))
+        results = []
+        count = import_notes(get_db(), int(current_user.get_id()), files, results)
+        failed = [r for r in results if r[1]]
+        if not failed and len(results) == 1:
+            flash('インポートしました')
+            return redirect(url_for('dashboard'))
+        flash(f'{count}件のノートをインポートしました' + (f'（{len(failed)}件は失敗）' if failed else ''))
+        return render_template('import.html', results=results)
     return render_template('import.html')
 
 
-if __name__ == '__main__':
-    # Ensure database exists: backup existing and initialize schema
-    if not os.path.exists(app.config['DATABASE']):
-        print('Database not found, initializing...')
-        with app.app_context():
-            init_db()
+# Background jobs. Exports and imports can take long enough to tie up a
+# worker that autosaves need, so they can also run on a per-process thread
+# pool of JOB_WORKERS threads (0 runs them inline, e.g. in tests). Job state
+# lives in the jobs table so any worker can answer GET /jobs/<id>; result and
+# upload files live in JOBS_DIR (default: jobs/ next to the database) and are
+# removed with their job JOB_RETENTION_HOURS after it finishes.
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOBS_DIR'] = os.environ.get('JOBS_DIR', '')
+app.config['JOB_RETENTION_HOURS'] = int(os.environ.get('JOB_RETENTION_HOURS', 24))
+EXPORT_FORMATS = {'csv': 'text/csv; charset=utf-8', 'zip': 'application/zip'}
+_job_executor = {'pid': None, 'pool': None}
+_job_lock = threading.Lock()
+
+
+def job_dir(job_id, db_path=None):
+    base = app.config['JOBS_DIR'] or os.path.join(os.path.dirname(os.path.abspath(db_path or app.config['DATABASE'])), 'jobs')
+    return os.path.join(base, job_id)
+
+
+def _job_pool():
+    with _job_lock:
+        if _job_executor['pid'] != os.getpid():
+            # a pool inherited from the parent process has no threads
+            _job_executor['pid'] = os.getpid()
+            _job_executor['pool'] = ThreadPoolExecutor(max_workers=app.config['JOB_WORKERS'], thread_name_prefix='notes-job')
+        return _job_executor['pool']
+
+
+def purge_jobs(db):
+    """Delete jobs (and their files) that finished more than JOB_RETENTION_HOURS ago (caller commits)."""
+    cutoff = (datetime.utcnow() - timedelta(hours=app.config['JOB_RETENTION_HOURS'])).isoformat()
+    ids = [r[0] for r in db.execute('SELECT id FROM jobs WHERE finished_at < ?', (cutoff,))]
+    for job_id in ids:
+        shutil.rmtree(job_dir(job_id), ignore_errors=True)
+    db.executemany('DELETE FROM jobs WHERE id = ?', [(i,) for i in ids])
+
+
+def create_job(db, user_id, kind):
+    """Record a queued job and create its directory; returns the job id."""
+    job_id = uuid.uuid4().hex
+    purge_jobs(db)
+    db.execute("INSERT INTO jobs (id, user_id, kind, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+               (job_id, user_id, kind, datetime.utcnow().isoformat()))
+    db.commit()
+    os.makedirs(job_dir(job_id), exist_ok=True)
+    return job_id
+
+
+def start_job(job_id, fn, *args):
+    """Run fn(db, directory, *args) for the job in the background.
+
+    fn gets its own connection and the job's directory, and returns a
+    JSON-serializable result.
+    """
+    if app.config['JOB_WORKERS'] > 0:
+        _job_pool().submit(_run_job, app.config['DATABASE'], job_id, fn, args)
+    else:
+        _run_job(app.config['DATABASE'], job_id, fn, args)
+
+
+def _run_job(db_path, job_id, fn, args):
+    db = connect_db(db_path)
+    try:
+        db.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (datetime.utcnow().isoformat(), job_id))
+        db.commit()
+        try:
+            result = fn(db, job_dir(job_id, db_path), *args)
+        except Exception as e:
+            db.rollback()
+            app.logger.exception('job %s failed', job_id)
+            db.execute("UPDATE jobs SET status = 'failed', finished_at = ?, error = ? WHERE id = ?",
+                       (datetime.utcnow().isoformat(), str(e), job_id))
+        else:
+            db.execute("UPDATE jobs SET status = 'done', finished_at = ?, result = ? WHERE id = ?",
+                       (datetime.utcnow().isoformat(), json.dumps(result, ensure_ascii=False), job_id))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _export_job(db, directory, user_id, fmt):
+    name = f'notes_all_user_{user_id}.{fmt}'
+    path = os.path.join(directory, name)
+    if fmt == 'csv':
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.writelines(iter_export_csv(db, user_id))
     else:
-        # create a timestamped backup before re-initializing
+        with open(path, 'wb') as f:
+            f.writelines(iter_export_zip(db, user_id))
+    return {'file': name, 'bytes': os.path.getsize(path)}
+
+
+def _import_job(db, directory, user_id, names):
+    paths = [os.path.join(directory, f'upload-{i}') for i in range(len(names))]
+    files = [FileStorage(open(path, 'rb'), filename=name) for name, path in zip(names, paths)]
+    try:
+        results = []
+        count = import_notes(db, user_id, files, results)
+    finally:
+        for f, path in zip(files, paths):
+            f.close()
+            os.remove(path)
+    return {'imported': count, 'failed': [[name, error] for name, error in results if error]}
+
+
+@app.route('/jobs/export/<fmt>', methods=['POST'])
+@login_required
+def job_export(fmt):
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'status': 'error', 'message': 'unknown format'}), 404
+    flush_autosaves()
+    user_id = int(current_user.get_id())
+    job_id = create_job(get_db(), user_id, f'export_{fmt}')
+    start_job(job_id, _export_job, user_id, fmt)
+    return jsonify({'id': job_id, 'status_url': url_for('job_status', job_id=job_id)}), 202
+
+
+@app.route('/jobs/import', methods=['POST'])
+@login_required
+def job_import():
+    files = [f for f in request.files.getlist('file') if f and f.filename]
+    if not files:
+        return jsonify({'status': 'error', 'message': 'no files'}), 400
+    user_id = int(current_user.get_id())
+    job_id = create_job(get_db(), user_id, 'import')
+    # uploads only live as long as the request: keep them in the job's directory
+    for i, f in enumerate(files):
+        f.save(os.path.join(job_dir(job_id), f'upload-{i}'))
+    start_job(job_id, _import_job, user_id, [f.filename for f in files])
+    return jsonify({'id': job_id, 'status_url': url_for('job_status', job_id=job_id)}), 202
+
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    job = query_db('SELECT * FROM jobs WHERE id = ? AND user_id = ?', (job_id, int(current_user.get_id())), one=True)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'not found'}), 404
+    data = {k: job[k] for k in ('id', 'kind', 'status', 'created_at', 'started_at', 'finished_at', 'error')}
+    data['result'] = json.loads(job['result']) if job['result'] else None
+    if job['status'] == 'done' and job['kind'].startswith('export_'):
+        data['download_url'] = url_for('job_download', job_id=job_id)
+    return jsonify(data)
+
+
+@app.route('/jobs/<job_id>/download')
+@login_required
+def job_download(job_id):
+    job = query_db("SELECT * FROM jobs WHERE id = ? AND user_id = ? AND status = 'done'", (job_id, int(current_user.get_id())), one=True)
+    if not job or not job['kind'].startswith('export_'):
+        return 'Not Found', 404
+    name = json.loads(job['result'])['file']
+    return send_file(os.path.join(job_dir(job_id), name), mimetype=EXPORT_FORMATS[job['kind'][len('export_'):]],
+                     as_attachment=True, download_name=name)
+
+
+if __name__ == '__main__':
+    # Bring the schema up to date (migrations never drop data), backing up
+    # an existing database first when there is something to migrate.
+    existed = os.path.exists(app.config['DATABASE'])
+    conn = sqlite3.connect(app.config['DATABASE'])
+    if existed and pending_migrations(conn):
         ts = datetime.utcnow().strftime('%Y%m%d%H%M%S')
         bak_path = app.config['DATABASE'] + f'.bak.{ts}'
         try:
-            import shutil
-            shutil.copyfile(app.config['DATABASE'], bak_path)
+            backup_database(app.config['DATABASE'], bak_path)
             print(f'Backed up existing database to {bak_path}')
         except Exception as e:
             print('Backup failed:', e)
-        # initialize (will DROP and CREATE according to schema.sql)
-        try:
-            with app.app_context():
-                init_db()
-            print('Database initialized from schema.sql')
-        except Exception as e:
-            print('Database initialization failed:', e)
+    applied = migrate_db(conn)
+    conn.close()
+    if applied:
+        print('Applied schema migrations:', applied)
     app.run(port=5001, debug=True)
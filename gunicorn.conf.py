@@ -0,0 +1,22 @@
+"""gunicorn settings: gunicorn -c gunicorn.conf.py app:app
+
+Threaded (gthread) workers by default, so a slow request only occupies one
+thread and autosaves keep being served by the others. The app keeps one
+SQLite connection per thread and its caches are lock-protected, so any
+thread count is safe; SQLite still allows a single writer at a time, and
+long exports/imports should go through the /jobs endpoints. A gevent worker
+(GUNICORN_WORKER_CLASS=gevent) also works, but SQLite calls block the event
+loop, so gthread is the recommended choice.
+"""
+import multiprocessing
+import os
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '8000')}"
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('GUNICORN_WORKERS', min(4, multiprocessing.cpu_count() + 1)))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 200))  # gevent only
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+# give running background jobs and queued autosaves time to finish on restart
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 60))
+keepalive = 5
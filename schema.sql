@@ -1,14 +1,15 @@
--- users and notes schema
-DROP TABLE IF EXISTS users;
-DROP TABLE IF EXISTS notes;
+-- users and notes schema (baseline, migration 1)
+-- Later changes live in MIGRATIONS in app.py. This file must stay
+-- idempotent and must never drop data. Statements are split on semicolons,
+-- so keep them out of comments.
 
-CREATE TABLE users (
+CREATE TABLE IF NOT EXISTS users (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     username TEXT NOT NULL UNIQUE,
     password TEXT NOT NULL
 );
 
-CREATE TABLE notes (
+CREATE TABLE IF NOT EXISTS notes (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER NOT NULL,
     title TEXT,
@@ -21,7 +22,7 @@ CREATE TABLE notes (
     FOREIGN KEY(user_id) REFERENCES users(id)
 );
 
-CREATE TABLE public_links (
+CREATE TABLE IF NOT EXISTS public_links (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     note_id INTEGER NOT NULL,
     token TEXT NOT NULL UNIQUE,
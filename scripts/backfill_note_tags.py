@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""Rebuild the note_tags index table from notes.tags.
+Usage: python3 scripts/backfill_note_tags.py [path/to/notes.db]
+The schema migrations backfill note_tags once; this script is safe to re-run
+whenever the table needs to be rebuilt from the comma-separated tags column.
+"""
+import sqlite3
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import migrate_db, rebuild_note_tags  # noqa: E402
+
+DB = os.environ.get('NOTES_DB') or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'notes.db')
+if len(sys.argv) > 1:
+    DB = sys.argv[1]
+
+if __name__ == '__main__':
+    conn = sqlite3.connect(DB)
+    migrate_db(conn)
+    count = rebuild_note_tags(conn)
+    conn.commit()
+    conn.close()
+    print(f'Backfilled {count} tag rows')
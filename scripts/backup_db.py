@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Take an online backup of notes.db and prune old backups.
+Usage: python3 scripts/backup_db.py [path/to/notes.db] [--dest backups/] [--gzip]
+                                    [--keep-daily 7] [--keep-weekly 4]
+The copy uses the SQLite backup API in small steps (BACKUP_PAGES pages,
+sleeping BACKUP_SLEEP_MS between steps), so the app keeps serving writes
+while it runs. Backups are named notes-YYYYmmddTHHMMSS.db[.gz]; after a
+successful backup the newest backup of each of the last --keep-daily days and
+of each of the last --keep-weekly ISO weeks is kept, the rest are deleted.
+"""
+import argparse
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import backup_database  # noqa: E402
+
+DB = os.environ.get('NOTES_DB') or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'notes.db')
+
+BACKUP_NAME = re.compile(r'^notes-(\d{8}T\d{6})\.db(\.gz)?$')
+
+
+def backup(db_path, dest_dir, compress=False, now=None):
+    """Write one verified backup into dest_dir; returns its path."""
+    os.makedirs(dest_dir, exist_ok=True)
+    ts = (now or datetime.utcnow()).strftime('%Y%m%dT%H%M%S')
+    path = os.path.join(dest_dir, f'notes-{ts}.db')
+    backup_database(db_path, path)
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute('PRAGMA quick_check').fetchone()[0]
+    finally:
+        conn.close()
+    if result != 'ok':
+        os.remove(path)
+        raise RuntimeError(f'backup failed quick_check: {result}')
+    if compress:
+        with open(path, 'rb') as src, gzip.open(path + '.gz.tmp', 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(path + '.gz.tmp', path + '.gz')
+        os.remove(path)
+        path += '.gz'
+    return path
+
+
+def expired_backups(names, keep_daily, keep_weekly):
+    """Return the backup file names the retention policy no longer keeps."""
+    backups = []
+    for name in names:
+        m = BACKUP_NAME.match(name)
+        if m:
+            backups.append((datetime.strptime(m.group(1), '%Y%m%dT%H%M%S'), name))
+    backups.sort(reverse=True)
+    # the newest backup is always kept, whatever the policy
+    keep, days, weeks = {backups[0][1]} if backups else set(), set(), set()
+    for ts, name in backups:
+        day, week = ts.date(), ts.isocalendar()[:2]
+        if day not in days and len(days) < keep_daily:
+            keep.add(name)
+        days.add(day)
+        if week not in weeks and len(weeks) < keep_weekly:
+            keep.add(name)
+        weeks.add(week)
+    return [name for _, name in backups if name not in keep]
+
+
+def prune(dest_dir, keep_daily, keep_weekly):
+    removed = expired_backups(os.listdir(dest_dir), keep_daily, keep_weekly)
+    for name in removed:
+        os.remove(os.path.join(dest_dir, name))
+    return removed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Online backup of the notes database with retention.')
+    parser.add_argument('db', nargs='?', default=DB)
+    parser.add_argument('--dest', help='backup directory (default: backups/ next to the database)')
+    parser.add_argument('--gzip', action='store_true', help='gzip-compress the backup')
+    parser.add_argument('--keep-daily', type=int, default=7, help='days to keep one backup for')
+    parser.add_argument('--keep-weekly', type=int, default=4, help='ISO weeks to keep one backup for')
+    args = parser.parse_args()
+    dest = args.dest or os.path.join(os.path.dirname(os.path.abspath(args.db)), 'backups')
+    path = backup(args.db, dest, compress=args.gzip)
+    print(f'Backed up {args.db} to {path}')
+    for name in prune(dest, args.keep_daily, args.keep_weekly):
+        print(f'Removed old backup {name}')
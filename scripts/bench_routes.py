@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""Benchmark the core routes against a seeded database.
+Usage: python3 scripts/bench_routes.py [--users 5] [--notes-per-user 1000] [--shares 200]
+                                       [--iterations 200] [--only dashboard_q,public_view]
+                                       [--db bench.db] [--out result.json] [--compare old.json]
+                                       [--gunicorn WORKERS --concurrency N]
+
+Seeds a fresh SQLite database (deterministic for a given --seed) with users,
+world-history notes in Japanese and public share links, then times each
+scenario: the dashboard with every filter, autosave (the X-Auto-Save form
+post on note_edit and the patch endpoint), the public note page, both
+exports and Markdown import. By default requests go through the Flask test
+client in this process, one at a time. With --gunicorn the app is started as
+a multi-worker gunicorn server on the seeded database and --concurrency
+threads (each logged in as a different user) send real HTTP requests.
+
+Results (requests, errors, req/s, mean/p50/p99/max in ms, plus the run
+configuration) are printed as JSON to stdout or written to --out; --compare
+prints the p50/p99 change against an earlier result file on stderr.
+"""
+import argparse
+import http.cookiejar
+import io
+import json
+import os
+import platform
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import app, migrate_db, notes_bulk_saved, note_markdown  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'bench-pass'
+
+PERIODS = ['古代', '中世', '近世', '近代', '現代']
+REGIONS = ['ヨーロッパ', '東アジア', '中東', '南アジア', 'アフリカ', 'アメリカ']
+TOPICS = ['ローマ帝国', '秦の始皇帝', 'フランス革命', '明治維新', '十字軍', 'モンゴル帝国', 'オスマン帝国',
+          '産業革命', '宗教改革', 'ルネサンス', 'アヘン戦争', 'ムガル帝国', '大航海時代', 'ビザンツ帝国',
+          'アメリカ独立戦争', '辛亥革命', '第一次世界大戦', '冷戦', 'アッバース朝', '唐の長安']
+THEMES = ['政治', '経済', '宗教', '戦争', '文化', '交易', '思想', '技術']
+SENTENCES = ['{t}は{r}の歴史に大きな影響を与えた。', '{t}の背景には{m}の変化があった。',
+             '当時の{r}では{m}をめぐる対立が続いていた。', '{t}をきっかけに新しい{m}の秩序が生まれた。',
+             '史料によれば、{t}の評価は時代によって大きく異なる。', '{m}の面から見ると、{t}は転換点だった。']
+
+
+def note_text(rnd, paragraphs):
+    topic = rnd.choice(TOPICS)
+    region = rnd.choice(REGIONS)
+    lines = [f'# {topic}', '', f'**時代:** {rnd.choice(PERIODS)}', '']
+    for i in range(paragraphs):
+        lines.append(f'## ポイント{i + 1}')
+        for _ in range(rnd.randint(2, 5)):
+            lines.append('- ' + rnd.choice(SENTENCES).format(t=topic, r=region, m=rnd.choice(THEMES)))
+        lines.append('')
+    return topic, region, '\n'.join(lines)
+
+
+def seed(path, users, notes_per_user, shares, rnd):
+    """Create a database at path; returns [(username, [note ids])], [share tokens]."""
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    migrate_db(conn)
+    password = generate_password_hash(PASSWORD)
+    conn.executemany('INSERT INTO users (username, password) VALUES (?, ?)',
+                     [(f'bench{i:03d}', password) for i in range(users)])
+    start = datetime(2025, 1, 1)
+    rows = []
+    for user_id in range(1, users + 1):
+        for i in range(notes_per_user):
+            topic, region, content = note_text(rnd, rnd.randint(1, 6))
+            tags = ','.join(sorted({topic} | set(rnd.sample(THEMES, 2))))
+            ts = (start + timedelta(minutes=rnd.randint(0, 500000))).isoformat()
+            rows.append((user_id, f'{topic}のまとめ {i}', content, tags, rnd.choice(PERIODS), region, ts, ts))
+    conn.executemany('INSERT INTO notes (user_id, title, content, tags, period, region, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    notes_bulk_saved(conn, 0)
+    total = users * notes_per_user
+    shared = rnd.sample(range(1, total + 1), min(shares, total))
+    tokens = [uuid.UUID(int=rnd.getrandbits(128)).hex for _ in shared]
+    now = datetime.utcnow().isoformat()
+    conn.executemany('INSERT INTO public_links (note_id, token, created_at, expires_at, revoked) VALUES (?, ?, ?, NULL, 0)',
+                     [(n, t, now) for n, t in zip(shared, tokens)])
+    conn.commit()
+    accounts = [(f'bench{u - 1:03d}', [r[0] for r in conn.execute('SELECT id FROM notes WHERE user_id = ? ORDER BY id', (u,))])
+                for u in range(1, users + 1)]
+    conn.close()
+    return accounts, tokens
+
+
+class TestClientSession:
+    """Requests through the Flask test client, in process."""
+
+    def __init__(self):
+        self.client = app.test_client()
+
+    def request(self, method, path, form=None, json_body=None, files=None, headers=None):
+        data = dict(form or {})
+        for field, name, body in files or []:
+            data[field] = (io.BytesIO(body), name)
+        resp = self.client.open(path, method=method, data=data or None, json=json_body, headers=headers)
+        body = resp.get_data()  # drains streamed responses
+        return resp.status_code, body
+
+
+class HttpSession:
+    """Requests over HTTP with a cookie jar, for the gunicorn mode."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+                                                  _NoRedirect())
+
+    def request(self, method, path, form=None, json_body=None, files=None, headers=None):
+        headers = dict(headers or {})
+        data = None
+        if files:
+            boundary = uuid.uuid4().hex
+            parts = []
+            for k, v in (form or {}).items():
+                parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode())
+            for field, name, body in files:
+                parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{name}"\r\n'
+                             'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8') + body + b'\r\n')
+            data = b''.join(parts) + f'--{boundary}--\r\n'.encode()
+            headers['Content-Type'] = f'multipart/form-data; boundary={boundary}'
+        elif json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            data = urllib.parse.urlencode(form).encode()
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(req) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # report 302s as-is, like the test client does
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def scenarios(accounts, tokens, rnd):
+    """name -> (share of --iterations, factory(session, user index) -> step()).
+
+    A step returns (status, body) and is expected to answer below 400.
+    """
+    def dashboard(query):
+        return lambda session, user: lambda: session.request('GET', '/dashboard?' + urllib.parse.urlencode(query))
+
+    def autosave_form(session, user):
+        ids = accounts[user][1]
+
+        def step():
+            note_id = rnd.choice(ids)
+            _, region, content = note_text(rnd, 3)
+            return session.request('POST', f'/notes/{note_id}/edit', headers={'X-Auto-Save': '1'},
+                                   form={'title': f'自動保存 {note_id}', 'content': content, 'tags': '政治',
+                                         'period': '近代', 'region': region})
+        return step
+
+    def autosave_patch(session, user):
+        ids = accounts[user][1]
+        revisions = {}
+
+        def step():
+            note_id = rnd.choice(ids)
+            if note_id not in revisions:
+                status, body = session.request('POST', f'/notes/{note_id}/autosave', json_body={'base_revision': -1})
+                revisions[note_id] = json.loads(body)['revision']
+            insert = rnd.choice(SENTENCES).format(t=rnd.choice(TOPICS), r=rnd.choice(REGIONS), m=rnd.choice(THEMES))
+            status, body = session.request('POST', f'/notes/{note_id}/autosave', json_body={
+                'base_revision': revisions[note_id], 'patches': [{'start': 0, 'delete': 0, 'insert': insert + '\n'}]})
+            if status < 400:
+                revisions[note_id] = json.loads(body)['revision']
+            else:
+                revisions.pop(note_id, None)
+            return status, body
+        return step
+
+    def public_view(session, user):
+        return lambda: session.request('GET', '/s/' + rnd.choice(tokens))
+
+    def export(path):
+        return lambda session, user: lambda: session.request('GET', path)
+
+    def import_md(session, user):
+        def step():
+            topic, region, content = note_text(rnd, 4)
+            md = note_markdown({'title': f'{topic}（インポート）', 'content': content, 'tags': topic,
+                                'period': rnd.choice(PERIODS), 'region': region, 'updated_at': ''})
+            return session.request('POST', '/notes/import', files=[('file', 'note.md', md.encode('utf-8'))])
+        return step
+
+    return {
+        'dashboard': (1.0, dashboard({})),
+        'dashboard_q': (1.0, dashboard({'q': 'フランス革命'})),
+        'dashboard_q_short': (1.0, dashboard({'q': '冷戦'})),
+        'dashboard_period': (1.0, dashboard({'period': '近代'})),
+        'dashboard_region': (1.0, dashboard({'region': '東アジア'})),
+        'dashboard_tags': (1.0, dashboard({'tags': '宗教'})),
+        'dashboard_combined': (1.0, dashboard({'q': '帝国', 'period': '中世', 'region': 'ヨーロッパ', 'tags': '戦争'})),
+        'autosave_form': (1.0, autosave_form),
+        'autosave_patch': (1.0, autosave_patch),
+        'public_view': (1.0, public_view),
+        'export_csv': (0.1, export('/notes/export_all')),
+        'export_zip': (0.1, export('/notes/export_all.zip')),
+        'import': (0.25, import_md),
+    }
+
+
+def summarize(latencies, errors, wall):
+    latencies.sort()
+    n = len(latencies)
+
+    def pct(p):
+        return round(latencies[min(n - 1, int(p / 100 * n))] * 1000, 2) if n else None
+    return {'requests': n, 'errors': errors, 'rps': round(n / wall, 1) if wall else None,
+            'mean_ms': round(sum(latencies) / n * 1000, 2) if n else None,
+            'p50_ms': pct(50), 'p99_ms': pct(99), 'max_ms': pct(100)}
+
+
+def run_scenario(make_sessions, factory, iterations, concurrency):
+    """Run iterations steps spread over concurrency sessions; returns the summary."""
+    steps = [factory(session, user) for user, session in make_sessions(concurrency)]
+    for step in steps:
+        step()  # warm up caches and connections
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    per_worker = [iterations // concurrency + (i < iterations % concurrency) for i in range(concurrency)]
+
+    def worker(step, count):
+        for _ in range(count):
+            t0 = time.perf_counter()
+            status, _ = step()
+            elapsed = time.perf_counter() - t0
+            with lock:
+                latencies.append(elapsed)
+                if status >= 400:
+                    errors[0] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(s, c)) for s, c in zip(steps, per_worker)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, errors[0], time.perf_counter() - start)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(db_path, workers):
+    port = _free_port()
+    env = dict(os.environ, NOTES_DB=db_path)
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-w', str(workers), '-b', f'127.0.0.1:{port}', 'app:app'],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(base_url + '/', timeout=1).close()
+            return proc, base_url
+        except OSError:
+            if proc.poll() is not None:
+                raise SystemExit('gunicorn exited; is it installed? (pip install gunicorn)')
+            time.sleep(0.1)
+    proc.terminate()
+    raise SystemExit('gunicorn did not start')
+
+
+def compare(result, baseline, out=sys.stderr):
+    for name, now in result['results'].items():
+        old = baseline.get('results', {}).get(name)
+        if not old or not old.get('p50_ms') or not now.get('p50_ms'):
+            continue
+        print(f"{name:20} p50 {old['p50_ms']:8.2f} -> {now['p50_ms']:8.2f} ms ({now['p50_ms'] / old['p50_ms'] - 1:+.0%})"
+              f"  p99 {old['p99_ms']:8.2f} -> {now['p99_ms']:8.2f} ms ({now['p99_ms'] / old['p99_ms'] - 1:+.0%})", file=out)
+
+
+def run(users=5, notes_per_user=1000, shares=200, iterations=200, only=None, db_path=None, seed_value=1,
+        gunicorn_workers=0, concurrency=1):
+    """Seed a database and run the selected scenarios; returns the result dict."""
+    rnd = random.Random(seed_value)
+    db_path = db_path or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    if os.path.exists(db_path):
+        raise SystemExit(f'{db_path} already exists; the benchmark needs a fresh database')
+    t0 = time.perf_counter()
+    accounts, tokens = seed(db_path, users, notes_per_user, shares, rnd)
+    seed_seconds = time.perf_counter() - t0
+
+    proc = None
+    if gunicorn_workers:
+        proc, base_url = start_gunicorn(db_path, gunicorn_workers)
+        new_session = lambda: HttpSession(base_url)  # noqa: E731
+    else:
+        app.config['DATABASE'] = db_path
+        concurrency = 1  # the test client runs in this thread
+        new_session = TestClientSession
+
+    def make_sessions(count):
+        sessions = []
+        for i in range(count):
+            user = i % len(accounts)
+            session = new_session()
+            session.request('POST', '/login', form={'username': accounts[user][0], 'password': PASSWORD})
+            sessions.append((user, session))
+        return sessions
+
+    results = {}
+    try:
+        for name, (share, factory) in scenarios(accounts, tokens, rnd).items():
+            if only and name not in only:
+                continue
+            results[name] = run_scenario(make_sessions, factory, max(1, int(iterations * share)), concurrency)
+            print(f"{name:20} {results[name]['rps']:8} req/s  p50 {results[name]['p50_ms']:8} ms  "
+                  f"p99 {results[name]['p99_ms']:8} ms  errors {results[name]['errors']}", file=sys.stderr)
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+    return {
+        'config': {'users': users, 'notes_per_user': notes_per_user, 'shares': shares, 'iterations': iterations,
+                   'seed': seed_value, 'mode': f'gunicorn x{gunicorn_workers}' if gunicorn_workers else 'test_client',
+                   'concurrency': concurrency, 'autosave_flush_ms': app.config['AUTOSAVE_FLUSH_MS']},
+        'environment': {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                        'platform': platform.platform(), 'started_at': datetime.utcnow().isoformat()},
+        'seed_seconds': round(seed_seconds, 2),
+        'db_bytes': os.path.getsize(db_path),
+        'results': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the core routes on a seeded database.')
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--notes-per-user', type=int, default=1000)
+    parser.add_argument('--shares', type=int, default=200)
+    parser.add_argument('--iterations', type=int, default=200, help='requests per scenario (fewer for exports/import)')
+    parser.add_argument('--only', help='comma-separated scenario names')
+    parser.add_argument('--db', help='where to create the seeded database (default: a temp file)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--gunicorn', type=int, default=0, metavar='WORKERS', help='serve with gunicorn and use HTTP')
+    parser.add_argument('--concurrency', type=int, default=4, help='client threads in gunicorn mode')
+    parser.add_argument('--out', help='write the JSON result here instead of stdout')
+    parser.add_argument('--compare', help='earlier JSON result to compare against')
+    args = parser.parse_args()
+    result = run(args.users, args.notes_per_user, args.shares, args.iterations,
+                 set(args.only.split(',')) if args.only else None, args.db, args.seed,
+                 args.gunicorn, args.concurrency)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(result, json.load(f))
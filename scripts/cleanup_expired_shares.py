@@ -1,42 +1,50 @@
 #!/usr/bin/env python3
-"""Disable (revoke) public_links whose expires_at < now or already expired.
-Usage: python3 scripts/cleanup_expired_shares.py [--db path/to/notes.db]
+"""Disable (revoke) public_links whose expires_at < now.
+Usage: python3 scripts/cleanup_expired_shares.py [path/to/notes.db] [--dry-run]
+A single UPDATE over the partial index on active links' expires_at (schema
+migration 8); --dry-run only reports how many links would be revoked.
+expires_at values are ISO 8601 UTC strings, which compare correctly as text.
 """
+import argparse
 import sqlite3
-import sys
 import os
 from datetime import datetime
 
 DB = os.environ.get('NOTES_DB') or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'notes.db')
-if len(sys.argv) > 1:
-    DB = sys.argv[1]
 
-def cleanup(db_path):
+EXPIRED = 'revoked = 0 AND expires_at IS NOT NULL AND expires_at < ?'
+
+
+def cleanup(db_path, dry_run=False):
+    """Revoke expired links; returns how many were (or, with dry_run, would be) revoked."""
     conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
+    conn.execute('PRAGMA busy_timeout = 5000')
     now = datetime.utcnow().isoformat()
-    # find expired and not yet revoked
-    cur.execute("SELECT id, token, expires_at FROM public_links WHERE revoked = 0 AND expires_at IS NOT NULL")
-    rows = cur.fetchall()
-    to_revoke = []
-    for r in rows:
-        try:
-            if r['expires_at'] and datetime.fromisoformat(r['expires_at']) < datetime.utcnow():
-                to_revoke.append(r['id'])
-        except Exception:
-            continue
-    if to_revoke:
-        cur.execute('BEGIN')
-        for lid in to_revoke:
-            cur.execute('UPDATE public_links SET revoked = 1 WHERE id = ?', (lid,))
+    try:
+        if dry_run:
+            return conn.execute(f'SELECT COUNT(*) FROM public_links WHERE {EXPIRED}', (now,)).fetchone()[0]
+        count = conn.execute(f'UPDATE public_links SET revoked = 1 WHERE {EXPIRED}', (now,)).rowcount
+        if count:
+            # make running app workers drop their cached share-token state
+            try:
+                conn.execute("UPDATE cache_epochs SET value = value + 1 WHERE name = 'share_links'")
+            except sqlite3.OperationalError:
+                pass  # schema not migrated yet: no app caches to invalidate
         conn.commit()
-    conn.close()
-    return to_revoke
+        return count
+    finally:
+        conn.close()
+
 
 if __name__ == '__main__':
-    revoked = cleanup(DB)
-    if revoked:
-        print('Revoked links:', revoked)
+    parser = argparse.ArgumentParser(description='Revoke expired public share links.')
+    parser.add_argument('db', nargs='?', default=DB)
+    parser.add_argument('--dry-run', action='store_true', help='only count expired links')
+    args = parser.parse_args()
+    count = cleanup(args.db, dry_run=args.dry_run)
+    if args.dry_run:
+        print(f'{count} expired links would be revoked')
+    elif count:
+        print(f'Revoked {count} expired links')
     else:
         print('No expired links found')
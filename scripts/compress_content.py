@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Compress (or with --decompress, inflate) the stored content of existing notes.
+Usage: python3 scripts/compress_content.py [path/to/notes.db] [--min-bytes 4096] [--decompress]
+                                           [--dry-run] [--vacuum] [--batch 500] [--sample 200]
+Rows are rewritten in batches of --batch notes, one short transaction each, so
+the app can keep running. Only the storage format changes: revision, updated_at
+and the search index are left alone. Set CONTENT_COMPRESSION=1 so the app keeps
+compressing new writes. The report compares the stored content bytes and the
+median read latency (SELECT by id plus inflating) of --sample random notes
+before and after; the file itself only shrinks with --vacuum.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import app, compress_content, migrate_db, unpack_content  # noqa: E402
+
+DB = os.environ.get('NOTES_DB') or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'notes.db')
+
+
+def stored_bytes(value):
+    if value is None:
+        return 0
+    return len(value) if isinstance(value, bytes) else len(value.encode('utf-8'))
+
+
+def read_latency_us(conn, ids):
+    """Median microseconds to read (and inflate) the content of one note."""
+    times = []
+    for note_id in ids:
+        start = time.perf_counter()
+        unpack_content(conn.execute('SELECT content FROM notes WHERE id = ?', (note_id,)).fetchone()[0])
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return round(times[len(times) // 2] * 1e6, 1) if times else 0.0
+
+
+def convert(conn, min_bytes, decompress=False, dry_run=False, batch=500):
+    """Rewrite content in its target format; returns (rows, converted, bytes_before, bytes_after).
+
+    Compression runs outside the write lock; each UPDATE only applies while the
+    row still holds the value that was read, so a save made meanwhile wins and
+    the row is left for the app to store (it is counted as unchanged).
+    """
+    rows = converted = before = after = 0
+    last_id = 0
+    while True:
+        chunk = conn.execute('SELECT id, content FROM notes WHERE id > ? ORDER BY id LIMIT ?',
+                             (last_id, batch)).fetchall()
+        if not chunk:
+            break
+        last_id = chunk[-1][0]
+        updates = []
+        for note_id, content in chunk:
+            text = unpack_content(content)
+            new = text if decompress or text is None else compress_content(text, min_bytes)
+            rows += 1
+            before += stored_bytes(content)
+            after += stored_bytes(new)
+            if type(new) is not type(content):
+                updates.append((new, note_id, content))
+        if dry_run:
+            converted += len(updates)
+            continue
+        with conn:
+            for new, note_id, content in updates:
+                if conn.execute('UPDATE notes SET content = ? WHERE id = ? AND content IS ?', (new, note_id, content)).rowcount:
+                    converted += 1
+                else:
+                    after += stored_bytes(content) - stored_bytes(new)
+    return rows, converted, before, after
+
+
+def run(db_path, min_bytes, decompress=False, dry_run=False, vacuum=False, batch=500, sample=200):
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute('PRAGMA busy_timeout = 5000')
+        migrate_db(conn)
+        ids = [r[0] for r in conn.execute('SELECT id FROM notes ORDER BY random() LIMIT ?', (sample,))]
+        report = {'file_bytes_before': os.path.getsize(db_path), 'read_us_before': read_latency_us(conn, ids)}
+        rows, converted, before, after = convert(conn, min_bytes, decompress, dry_run, batch)
+        report.update(rows=rows, converted=converted, content_bytes_before=before, content_bytes_after=after,
+                      ratio=round(after / before, 3) if before else 1.0)
+        if not dry_run:
+            report['read_us_after'] = read_latency_us(conn, ids)
+            if vacuum:
+                conn.execute('VACUUM')
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            report['file_bytes_after'] = os.path.getsize(db_path)
+    finally:
+        conn.close()
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compress or inflate stored note content.')
+    parser.add_argument('db', nargs='?', default=DB)
+    parser.add_argument('--min-bytes', type=int, default=app.config['CONTENT_COMPRESS_MIN_BYTES'],
+                        help='compress content of at least this many UTF-8 bytes')
+    parser.add_argument('--decompress', action='store_true', help='store every note as plain text again')
+    parser.add_argument('--dry-run', action='store_true', help='only report what would change')
+    parser.add_argument('--vacuum', action='store_true', help='VACUUM afterwards so the file shrinks')
+    parser.add_argument('--batch', type=int, default=500, help='notes per transaction')
+    parser.add_argument('--sample', type=int, default=200, help='notes to time reads for')
+    args = parser.parse_args()
+    report = run(args.db, args.min_bytes, args.decompress, args.dry_run, args.vacuum, args.batch, args.sample)
+    for key, value in report.items():
+        print(f'{key}: {value}')
@@ -1,60 +1,84 @@
 #!/usr/bin/env python3
-"""Simple migration script: copy users and notes from a backup sqlite file into current DB.
-Usage: python3 scripts/migrate_from_backup.py /path/to/backup.db /path/to/target.db
-This will copy users and notes, mapping old notes fields to new schema (tags/period/region left empty).
+"""Copy users and notes from a backup sqlite file into the current DB.
+Usage: python3 scripts/migrate_from_backup.py /path/to/backup.db /path/to/target.db [--map old=new ...] [--dry-run]
+
+The backup is ATTACHed and copied with two INSERT ... SELECT statements in
+one transaction: users missing from the target (by username, after applying
+--map renames) are created, then every note is attached to the target user
+with the same (mapped) username. tags/period/region/updated_at are copied
+when the backup has them. The target's search and tag indexes are filled for
+the new notes. --dry-run reports the counts and rolls back.
 """
+import argparse
 import sqlite3
 import sys
-import shutil
+import os
 from datetime import datetime
 
-def migrate(src, dst):
-    # ensure dst exists
-    conn_src = sqlite3.connect(src)
-    conn_dst = sqlite3.connect(dst)
-    conn_src.row_factory = sqlite3.Row
-    cur_src = conn_src.cursor()
-    cur_dst = conn_dst.cursor()
-
-    # copy users (avoid duplicates by username)
-    cur_src.execute('SELECT * FROM users')
-    users = cur_src.fetchall()
-    for u in users:
-        cur_dst.execute('SELECT id FROM users WHERE username = ?', (u['username'],))
-        if cur_dst.fetchone():
-            continue
-        cur_dst.execute('INSERT INTO users (username, password) VALUES (?, ?)', (u['username'], u['password']))
-    conn_dst.commit()
-
-    # build mapping old_user_id -> new_user_id
-    cur_dst.execute('SELECT id, username FROM users')
-    mapping = {r['username']: r['id'] for r in cur_dst.fetchall()}
-
-    # copy notes
-    cur_src.execute('SELECT * FROM notes')
-    notes = cur_src.fetchall()
-    for n in notes:
-        # try finding username by joining users table in src
-        user_id = n['user_id']
-        cur_src.execute('SELECT username FROM users WHERE id = ?', (user_id,))
-        user_row = cur_src.fetchone()
-        if not user_row:
-            continue
-        username = user_row['username']
-        new_user_id = mapping.get(username)
-        if not new_user_id:
-            continue
-        created = n['created_at'] or datetime.utcnow().isoformat()
-        updated = n.get('updated_at') or created
-        cur_dst.execute('INSERT INTO notes (user_id, title, content, tags, period, region, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-                        (new_user_id, n['title'], n['content'], '', '', '', created, updated))
-    conn_dst.commit()
-    conn_src.close()
-    conn_dst.close()
-    print('Migration complete.')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import migrate_db, notes_bulk_saved  # noqa: E402
+
+# src username -> target username (identity unless --map says otherwise)
+MAPPED_USERNAME = 'coalesce((SELECT dst FROM temp.user_map WHERE src = su.username), su.username)'
+
+
+def migrate(src, dst, user_map=None, dry_run=False):
+    """Returns (users inserted, notes inserted, notes skipped)."""
+    conn = sqlite3.connect(dst)
+    conn.execute('PRAGMA busy_timeout = 5000')
+    migrate_db(conn)
+    conn.execute('ATTACH DATABASE ? AS src', (src,))
+    cols = {r[1] for r in conn.execute('PRAGMA src.table_info(notes)')}
+    now = datetime.utcnow().isoformat()
+    optional = {c: (f'coalesce(sn.{c}, \'\')' if c in cols else "''") for c in ('tags', 'period', 'region')}
+    updated = 'coalesce(sn.updated_at, sn.created_at, :now)' if 'updated_at' in cols else 'coalesce(sn.created_at, :now)'
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('CREATE TEMP TABLE user_map (src TEXT PRIMARY KEY, dst TEXT NOT NULL)')
+        conn.executemany('INSERT INTO temp.user_map (src, dst) VALUES (?, ?)', list((user_map or {}).items()))
+        users = conn.execute(f'''
+            INSERT INTO main.users (username, password)
+            SELECT {MAPPED_USERNAME}, su.password FROM src.users su
+            WHERE NOT EXISTS (SELECT 1 FROM main.users u WHERE u.username = {MAPPED_USERNAME})
+            GROUP BY {MAPPED_USERNAME}''').rowcount
+        row = conn.execute("SELECT seq FROM main.sqlite_sequence WHERE name = 'notes'").fetchone()
+        after_id = row[0] if row else 0
+        notes = conn.execute(f'''
+            INSERT INTO main.notes (user_id, title, content, tags, period, region, created_at, updated_at)
+            SELECT du.id, sn.title, sn.content, {optional['tags']}, {optional['period']}, {optional['region']},
+                   coalesce(sn.created_at, :now), {updated}
+            FROM src.notes sn
+            JOIN src.users su ON su.id = sn.user_id
+            JOIN main.users du ON du.username = {MAPPED_USERNAME}''', {'now': now}).rowcount
+        total = conn.execute('SELECT COUNT(*) FROM src.notes').fetchone()[0]
+        notes_bulk_saved(conn, after_id)
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute('DROP TABLE IF EXISTS temp.user_map')
+        conn.execute('DETACH DATABASE src')
+        conn.close()
+    return users, notes, total - notes
+
 
 if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print('Usage: migrate_from_backup.py /path/to/backup.db /path/to/target.db')
-        sys.exit(1)
-    migrate(sys.argv[1], sys.argv[2])
+    parser = argparse.ArgumentParser(description='Copy users and notes from a backup database.')
+    parser.add_argument('src', help='backup database to copy from')
+    parser.add_argument('dst', help='target database')
+    parser.add_argument('--map', action='append', default=[], metavar='OLD=NEW', help='rename a backup username in the target')
+    parser.add_argument('--dry-run', action='store_true', help='report counts without writing')
+    args = parser.parse_args()
+    try:
+        user_map = dict(m.split('=', 1) for m in args.map)
+    except ValueError:
+        parser.error('--map expects OLD=NEW')
+    users, notes, skipped = migrate(args.src, args.dst, user_map, args.dry_run)
+    prefix = '(dry run) ' if args.dry_run else ''
+    print(f'{prefix}users inserted: {users}, notes inserted: {notes}, notes skipped (no owner): {skipped}')
+    print('Migration complete.' if not args.dry_run else 'Nothing was written.')
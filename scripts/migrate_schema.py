@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""Apply pending schema migrations to a notes database.
+Usage: python3 scripts/migrate_schema.py [path/to/notes.db] [--status]
+The app also applies pending migrations on its first connection, so this is
+only needed to migrate ahead of a deploy or to inspect the current version.
+"""
+import sqlite3
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import migrate_db, pending_migrations, schema_version  # noqa: E402
+
+DB = os.environ.get('NOTES_DB') or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'notes.db')
+args = [a for a in sys.argv[1:] if not a.startswith('--')]
+if args:
+    DB = args[0]
+
+if __name__ == '__main__':
+    conn = sqlite3.connect(DB)
+    if '--status' in sys.argv:
+        print('Schema version:', schema_version(conn))
+        for version, name, _ in pending_migrations(conn):
+            print(f'  pending {version}: {name}')
+    else:
+        applied = migrate_db(conn)
+        print('Applied migrations:', applied if applied else 'none (up to date)')
+    conn.close()
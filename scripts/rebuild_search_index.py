@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""Rebuild the full-text search index (notes_fts, notes_bigrams) from the notes table.
+Usage: python3 scripts/rebuild_search_index.py [path/to/notes.db]
+The index is created by the schema migrations; use this if it ever drifts
+from the notes table (e.g. after editing notes.db by hand).
+"""
+import sqlite3
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import migrate_db, rebuild_search_index  # noqa: E402
+
+DB = os.environ.get('NOTES_DB') or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'notes.db')
+if len(sys.argv) > 1:
+    DB = sys.argv[1]
+
+if __name__ == '__main__':
+    conn = sqlite3.connect(DB)
+    migrate_db(conn)
+    count = rebuild_search_index(conn)
+    conn.commit()
+    conn.close()
+    print(f'Indexed {count} notes')
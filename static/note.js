@@ -1,11 +1,29 @@
 (function(){
-  // Simple autosave + lightweight markdown preview
+  // Autosave pipeline + lightweight markdown preview
   const textarea = document.getElementById('note-content');
   if(!textarea) return;
   const preview = document.getElementById('preview-content');
   const form = textarea.closest('form');
-  let lastSaved = '';
+  const status = document.getElementById('autosave-status');
+  // existing notes save incremental patches against a known revision; a new
+  // note is created by its first autosave and is patched from then on
+  let autosaveUrl = form ? form.dataset.autosaveUrl : null;
+  let revision = form ? parseInt(form.dataset.revision || '0', 10) : 0;
+  let storageKey = form ? form.dataset.storageKey : null;
+  const META_FIELDS = ['title', 'tags', 'period', 'region'];
+  const DEBOUNCE_MS = 4000;
+  const MAX_RETRY_MS = 60000;
+  let lastSaved = textarea.value;
+  let lastFields = currentFields();
+  let savedHash = stateHash(lastSaved, lastFields);
+  let conflicted = false;
+  let submitting = false;
   let timeout = null;
+  // at most one save in flight; edits made meanwhile are sent right after it
+  let inFlight = false;
+  let again = false;
+  let retryDelay = 0;
+  let retryTimer = null;
 
   function simpleMarkdown(md){
     // very small subset: headings, bold, italics, line breaks, lists
@@ -26,33 +44,203 @@
     preview.innerHTML = simpleMarkdown(textarea.value || '');
   }
 
-  function autosave(){
-    if(!form) return;
-    const formData = new FormData(form);
-    const headers = {'X-Auto-Save':'1'};
-    fetch(form.action || window.location.pathname, {method:'POST', body: formData, headers: headers, credentials: 'same-origin'})
-      .then(resp => {
-        if(!resp.ok) throw new Error('save failed');
-        return resp.json().catch(()=>({status:'ok'}));
-      })
+  function setStatus(text){
+    if(status) status.textContent = text;
+  }
+
+  function currentFields(){
+    const out = {};
+    if(!form) return out;
+    META_FIELDS.forEach(name => {
+      const el = form.elements[name];
+      if(el) out[name] = el.value;
+    });
+    return out;
+  }
+
+  function setFields(fields){
+    META_FIELDS.forEach(name => {
+      const el = form.elements[name];
+      if(el && name in fields) el.value = fields[name];
+    });
+  }
+
+  function stateHash(content, fields){
+    // 32-bit FNV-1a over content and metadata: cheap enough to run per save
+    const s = content + '\u0000' + META_FIELDS.map(name => fields[name] || '').join('\u0000');
+    let h = 0x811c9dc5;
+    for(let i = 0; i < s.length; i++){
+      h ^= s.charCodeAt(i);
+      h = Math.imul(h, 0x01000193) >>> 0;
+    }
+    return h.toString(16);
+  }
+
+  function textPatch(before, after){
+    // one splice replacing the changed middle; offsets are UTF-16 code units
+    let start = 0;
+    const max = Math.min(before.length, after.length);
+    while(start < max && before.charCodeAt(start) === after.charCodeAt(start)) start++;
+    let endBefore = before.length, endAfter = after.length;
+    while(endBefore > start && endAfter > start && before.charCodeAt(endBefore - 1) === after.charCodeAt(endAfter - 1)){
+      endBefore--; endAfter--;
+    }
+    return {start: start, delete: endBefore - start, insert: after.slice(start, endAfter)};
+  }
+
+  // Unsent state is kept in localStorage (per user and note) until the server
+  // has it, so edits survive going offline or closing the tab.
+  function storeQueued(snap){
+    if(!storageKey) return;
+    try {
+      localStorage.setItem(storageKey, JSON.stringify({content: snap.content, fields: snap.fields, revision: revision, hash: snap.hash}));
+    } catch(e){ /* storage full or disabled */ }
+  }
+
+  function clearQueued(){
+    if(!storageKey) return;
+    try { localStorage.removeItem(storageKey); } catch(e){}
+  }
+
+  function loadQueued(){
+    if(!storageKey) return null;
+    try { return JSON.parse(localStorage.getItem(storageKey) || 'null'); } catch(e){ return null; }
+  }
+
+  function SaveError(message, retry){
+    this.message = message;
+    this.retry = retry;
+  }
+
+  function checkResponse(resp){
+    if(resp.status === 409){
+      conflicted = true;
+      setStatus('他の画面でこのノートが更新されました。再読み込みするか、保存ボタンで上書きしてください。');
+      throw new SaveError('revision conflict', false);
+    }
+    // a redirect to the login page also comes back as HTML
+    const json = (resp.headers.get('Content-Type') || '').indexOf('application/json') === 0;
+    if(resp.ok && json) return resp.json();
+    if(resp.ok || resp.status === 401 || resp.status === 403){
+      setStatus('ログインし直してください（変更はこのブラウザに保存されています）');
+      throw new SaveError('not logged in', false);
+    }
+    throw new SaveError('save failed: ' + resp.status, resp.status >= 500 || resp.status === 429);
+  }
+
+  function patchSave(snap){
+    const changed = {};
+    META_FIELDS.forEach(name => { if(snap.fields[name] !== lastFields[name]) changed[name] = snap.fields[name]; });
+    const patches = snap.content === lastSaved ? [] : [textPatch(lastSaved, snap.content)];
+    const body = {base_revision: revision, patches: patches, length: snap.content.length, fields: changed};
+    return fetch(autosaveUrl, {method:'POST', body: JSON.stringify(body), headers: {'Content-Type':'application/json'}, credentials: 'same-origin'})
+      .then(checkResponse)
+      .then(data => { revision = data.revision; });
+  }
+
+  function createSave(snap){
+    const formData = new FormData();
+    formData.append('content', snap.content);
+    META_FIELDS.forEach(name => formData.append(name, snap.fields[name] || ''));
+    return fetch(form.action || window.location.pathname, {method:'POST', body: formData, headers: {'X-Auto-Save':'1'}, credentials: 'same-origin'})
+      .then(checkResponse)
       .then(data => {
-        lastSaved = textarea.value;
-        console.log('autosave ok', data);
-      }).catch(err => {
+        // from now on this page edits the created note
+        clearQueued();
+        autosaveUrl = data.autosave_url;
+        revision = data.revision;
+        form.action = data.edit_url;
+        if(storageKey) storageKey = storageKey.replace(/:new$/, ':' + data.id);
+        if(window.history && history.replaceState) history.replaceState(null, '', data.edit_url);
+      });
+  }
+
+  function snapshot(){
+    const snap = {content: textarea.value, fields: currentFields()};
+    snap.hash = stateHash(snap.content, snap.fields);
+    return snap;
+  }
+
+  function runSave(retry){
+    if(!form || conflicted) return;
+    if(inFlight){ again = true; return; }
+    const snap = snapshot();
+    if(snap.hash === savedHash){ clearQueued(); return; }
+    storeQueued(snap);
+    if(retryTimer){
+      // while backing off, edits only update the queued state
+      if(retry !== true) return;
+      clearTimeout(retryTimer);
+      retryTimer = null;
+    }
+    if(navigator.onLine === false){
+      setStatus('オフラインです。接続が戻ったら保存します');
+      return;
+    }
+    inFlight = true;
+    setStatus('保存中…');
+    (autosaveUrl ? patchSave(snap) : createSave(snap))
+      .then(() => {
+        lastSaved = snap.content;
+        lastFields = snap.fields;
+        savedHash = snap.hash;
+        retryDelay = 0;
+        if(stateHash(textarea.value, currentFields()) === savedHash) clearQueued();
+        setStatus('自動保存しました');
+      })
+      .catch(err => {
         console.log('autosave err', err);
+        if(err instanceof SaveError && !err.retry) return;
+        // network errors and server errors: exponential backoff with jitter
+        retryDelay = Math.min(Math.max(retryDelay * 2, 1000), MAX_RETRY_MS);
+        setStatus('保存に失敗しました。' + Math.round(retryDelay / 1000) + '秒後に再試行します');
+        retryTimer = setTimeout(() => runSave(true), retryDelay + Math.random() * 500);
+      })
+      .then(() => {
+        inFlight = false;
+        if(again){ again = false; runSave(); }
       });
   }
 
-  textarea.addEventListener('input', ()=>{
-    renderPreview();
-    if(timeout) clearTimeout(timeout);
-    timeout = setTimeout(()=>{
-      if(textarea.value !== lastSaved){
-        autosave();
-      }
-    }, 4000);
-  });
+  function restoreQueued(){
+    const queued = loadQueued();
+    if(!queued) return;
+    if(stateHash(queued.content, queued.fields) === stateHash(textarea.value, currentFields())){
+      clearQueued();
+      return;
+    }
+    textarea.value = queued.content;
+    setFields(queued.fields);
+    if(autosaveUrl && queued.revision !== revision){
+      // the note changed on the server since these edits were made
+      conflicted = true;
+      setStatus('未送信の変更を復元しましたが、ノートは他の画面で更新されています。確認して保存ボタンで上書きしてください。');
+      return;
+    }
+    setStatus('未送信の変更を復元しました');
+    runSave();
+  }
+
+  textarea.addEventListener('input', renderPreview);
+  if(form){
+    form.addEventListener('input', ()=>{
+      if(timeout) clearTimeout(timeout);
+      timeout = setTimeout(runSave, DEBOUNCE_MS);
+    });
+    // an explicit save sends everything itself
+    form.addEventListener('submit', ()=>{
+      submitting = true;
+      clearQueued();
+    });
+    window.addEventListener('online', () => runSave(true));
+    window.addEventListener('pagehide', ()=>{
+      if(conflicted || submitting) return;
+      const snap = snapshot();
+      if(snap.hash !== savedHash) storeQueued(snap);
+    });
+  }
 
+  if(form) restoreQueued();
   // initial render
   renderPreview();
 })();
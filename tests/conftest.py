@@ -0,0 +1,27 @@
+import pytest
+from app import app
+import tempfile
+import os
+
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    # autosaves are written synchronously unless a test enables the buffer
+    app.config['AUTOSAVE_FLUSH_MS'] = 0
+    # use a temporary file DB so connections share the same file
+    tmpdir = tempfile.mkdtemp()
+    db_path = os.path.join(tmpdir, 'test_notes.db')
+    app.config['DATABASE'] = db_path
+    with app.app_context():
+        from app import init_db
+        init_db()
+    with app.test_client() as client:
+        yield client
+
+
+@pytest.fixture
+def auth_client(client):
+    client.post('/register', data={'username': 'testuser', 'password': 'pass'})
+    client.post('/login', data={'username': 'testuser', 'password': 'pass'})
+    return client
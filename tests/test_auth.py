@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+
+from app import app, get_db, invalidate_user_cache, user_cache_stats
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+
+def test_logged_in_user_served_from_cache(auth_client):
+    before = user_cache_stats()
+    assert 'ようこそ testuser' in auth_client.get('/dashboard').get_data(as_text=True)
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE users SET username = 'renamed' WHERE username = 'testuser'")
+        db.commit()
+    # no users query until the entry is invalidated (or expires)
+    assert 'ようこそ testuser' in auth_client.get('/dashboard').get_data(as_text=True)
+    assert user_cache_stats()['hits'] >= before['hits'] + 2
+    invalidate_user_cache(1)
+    assert 'ようこそ renamed' in auth_client.get('/dashboard').get_data(as_text=True)
+
+
+def test_password_rehashed_with_configured_method(client, monkeypatch):
+    import app as app_module
+    client.post('/register', data={'username': 'u', 'password': 'pw'})
+    invalidated = []
+    monkeypatch.setattr(app_module, 'invalidate_user_cache', invalidated.append)
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+    try:
+        resp = client.post('/login', data={'username': 'u', 'password': 'pw'})
+        assert resp.status_code == 302 and resp.headers['Location'].endswith('/dashboard')
+        # the users row changed
+        assert invalidated == [1]
+        with app.app_context():
+            stored = get_db().execute("SELECT password FROM users WHERE username = 'u'").fetchone()[0]
+        assert stored.startswith('pbkdf2:sha256:1000$')
+        client.get('/logout')
+        assert client.post('/login', data={'username': 'u', 'password': 'pw'}).status_code == 302
+    finally:
+        app.config['PASSWORD_HASH_METHOD'] = ''
+
+
+def test_method_without_iterations_does_not_rehash_every_login(client):
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256'
+    try:
+        client.post('/register', data={'username': 'u', 'password': 'pw'})
+        with app.app_context():
+            stored = get_db().execute("SELECT password FROM users WHERE username = 'u'").fetchone()[0]
+        assert client.post('/login', data={'username': 'u', 'password': 'pw'}).status_code == 302
+        with app.app_context():
+            assert get_db().execute("SELECT password FROM users WHERE username = 'u'").fetchone()[0] == stored
+    finally:
+        app.config['PASSWORD_HASH_METHOD'] = ''
+
+
+def test_invalid_hash_method_rejected_at_startup():
+    env = dict(os.environ, PASSWORD_HASH_METHOD='pbkdf2')
+    proc = subprocess.run([sys.executable, '-c', 'import app'], cwd=ROOT, env=env, capture_output=True, text=True)
+    assert proc.returncode != 0 and "invalid PASSWORD_HASH_METHOD 'pbkdf2'" in proc.stderr
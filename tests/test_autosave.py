@@ -0,0 +1,178 @@
+import threading
+
+from app import app, query_db, apply_text_patches
+
+
+def _note(auth_client, content='年表\r\n- 800年: カール戴冠'):
+    auth_client.post('/notes/new', data={'title': 'フランク', 'content': content})
+    with app.app_context():
+        return query_db('SELECT * FROM notes', one=True)
+
+
+def test_apply_text_patches_uses_utf16_offsets():
+    # the emoji is two UTF-16 code units in the browser
+    assert apply_text_patches('a😀b', [{'start': 3, 'delete': 1, 'insert': 'c'}]) == 'a😀c'
+
+
+def test_autosave_patch_applies_and_bumps_revision(auth_client):
+    note = _note(auth_client)
+    assert note['revision'] == 0
+    base = '年表\n- 800年: カール戴冠'
+    new = base + '\n- 843年: ヴェルダン条約'
+    rv = auth_client.post(f"/notes/{note['id']}/autosave", json={
+        'base_revision': 0, 'length': len(new),
+        'patches': [{'start': len(base), 'delete': 0, 'insert': '\n- 843年: ヴェルダン条約'}],
+        'fields': {'tags': 'フランク王国'}})
+    assert rv.get_json() == {'status': 'ok', 'revision': 1, 'saved': True}
+    with app.app_context():
+        row = query_db('SELECT * FROM notes WHERE id = ?', (note['id'],), one=True)
+    assert row['content'] == new and row['tags'] == 'フランク王国' and row['revision'] == 1
+    assert 'フランク' in auth_client.get('/dashboard?tags=フランク王国').get_data(as_text=True)
+
+    # nothing changed: no write, same revision
+    updated_at = row['updated_at']
+    rv = auth_client.post(f"/notes/{note['id']}/autosave", json={'base_revision': 1, 'patches': [], 'fields': {}})
+    assert rv.get_json() == {'status': 'ok', 'revision': 1, 'saved': False}
+    with app.app_context():
+        assert query_db('SELECT updated_at FROM notes WHERE id = ?', (note['id'],), one=True)['updated_at'] == updated_at
+
+
+def test_autosave_conflicts_return_409(auth_client):
+    note = _note(auth_client, 'abc')
+    # a full save from another tab moves the revision on
+    auth_client.post(f"/notes/{note['id']}/edit", data={'title': 'x', 'content': 'abcd'})
+    rv = auth_client.post(f"/notes/{note['id']}/autosave", json={
+        'base_revision': 0, 'patches': [{'start': 3, 'delete': 0, 'insert': 'e'}]})
+    assert rv.status_code == 409 and rv.get_json()['revision'] == 1
+
+    # patched text doesn't match what the client has
+    rv = auth_client.post(f"/notes/{note['id']}/autosave", json={
+        'base_revision': 1, 'length': 99, 'patches': [{'start': 4, 'delete': 0, 'insert': 'e'}]})
+    assert rv.status_code == 409
+    rv = auth_client.post(f"/notes/{note['id']}/autosave", json={
+        'base_revision': 1, 'patches': [{'start': 10, 'delete': 0, 'insert': 'e'}]})
+    assert rv.status_code == 409
+    with app.app_context():
+        assert query_db('SELECT content FROM notes', one=True)['content'] == 'abcd'
+
+
+def test_autosave_rejects_malformed_bodies_with_400(auth_client):
+    note = _note(auth_client, 'abc')
+    for body in ({'base_revision': 0, 'fields': ['a']}, {'base_revision': 0, 'patches': 'zz'},
+                 {'base_revision': 0, 'patches': [1]}, {'base_revision': 0, 'patches': [{'start': 'a'}]},
+                 {'base_revision': 0, 'patches': [{'start': 0, 'insert': 5}]}, {'base_revision': '0'},
+                 {'base_revision': 0, 'length': 'x'}):
+        rv = auth_client.post(f"/notes/{note['id']}/autosave", json=body)
+        assert rv.status_code == 400, body
+    with app.app_context():
+        assert query_db('SELECT revision FROM notes', one=True)['revision'] == 0
+
+
+def test_autosave_buffer_coalesces_and_flushes_on_explicit_save(auth_client):
+    from app import autosave_stats, flush_autosaves
+    note = _note(auth_client, 'a')
+    nid = note['id']
+    # long window: the background flusher stays out of the way
+    app.config['AUTOSAVE_FLUSH_MS'] = 60000
+    try:
+        before = autosave_stats()
+        for i, ch in enumerate('bcd'):
+            rv = auth_client.post(f'/notes/{nid}/autosave', json={
+                'base_revision': i, 'patches': [{'start': i + 1, 'delete': 0, 'insert': ch}]})
+            assert rv.get_json()['revision'] == i + 1
+        with app.app_context():
+            # acknowledged but not yet written
+            assert query_db('SELECT content FROM notes WHERE id = ?', (nid,), one=True)['content'] == 'a'
+        # the form autosave builds on the queued revision
+        rv = auth_client.post(f'/notes/{nid}/edit', data={'title': 'フランク', 'content': 'abcde'}, headers={'X-Auto-Save': '1'})
+        assert rv.get_json()['revision'] == 4
+        stats = autosave_stats()
+        assert stats['coalesced'] - before['coalesced'] == 3 and stats['pending'] == 1
+
+        with app.app_context():
+            assert flush_autosaves() == 1
+            row = query_db('SELECT content, revision FROM notes WHERE id = ?', (nid,), one=True)
+        assert (row['content'], row['revision']) == ('abcde', 4)
+        assert autosave_stats()['last_batch_size'] == 1
+
+        # an explicit save flushes queued autosaves before writing
+        auth_client.post(f'/notes/{nid}/autosave', json={'base_revision': 4, 'patches': [{'start': 5, 'delete': 0, 'insert': 'f'}]})
+        auth_client.post(f'/notes/{nid}/edit', data={'title': 'フランク', 'content': 'final'})
+        with app.app_context():
+            row = query_db('SELECT content, revision FROM notes WHERE id = ?', (nid,), one=True)
+        assert (row['content'], row['revision']) == ('final', 6)
+        assert autosave_stats()['pending'] == 0
+    finally:
+        app.config['AUTOSAVE_FLUSH_MS'] = 0
+
+
+def test_autosave_states_stay_visible_while_flushing(auth_client, monkeypatch):
+    import app as app_module
+    from app import flush_autosaves, pending_autosave
+    note = _note(auth_client, 'a')
+    nid = note['id']
+    app.config['AUTOSAVE_FLUSH_MS'] = 60000
+    prepare = app_module.prepare_revision
+    replies = []
+    # another worker thread of the same process, with its own session
+    other = app.test_client()
+    other.post('/login', data={'username': 'testuser', 'password': 'pass'})
+
+    def save_during_flush(db, state, source):
+        # the batch has left the queue but isn't committed yet
+        assert pending_autosave(nid)['revision'] == 1
+
+        def other_request():
+            replies.append(other.post(f'/notes/{nid}/autosave', json={
+                'base_revision': 1, 'patches': [{'start': 2, 'delete': 0, 'insert': 'c'}]}))
+            replies.append(other.post(f'/notes/{nid}/edit', data={'title': 'フランク', 'content': 'abcd'},
+                                      headers={'X-Auto-Save': '1'}))
+
+        t = threading.Thread(target=other_request)
+        t.start()
+        t.join()
+        return prepare(db, state, source)
+
+    try:
+        auth_client.post(f'/notes/{nid}/autosave', json={'base_revision': 0, 'patches': [{'start': 1, 'delete': 0, 'insert': 'b'}]})
+        monkeypatch.setattr(app_module, 'prepare_revision', save_during_flush)
+        with app.app_context():
+            assert flush_autosaves() == 1
+        monkeypatch.setattr(app_module, 'prepare_revision', prepare)
+        assert [(rv.status_code, rv.get_json()['revision']) for rv in replies] == [(200, 2), (200, 3)]
+        with app.app_context():
+            assert flush_autosaves() == 1
+            row = query_db('SELECT content, revision FROM notes WHERE id = ?', (nid,), one=True)
+        assert (row['content'], row['revision']) == ('abcd', 3)
+
+        # a failed flush puts its states back in the queue
+        auth_client.post(f'/notes/{nid}/autosave', json={'base_revision': 3, 'patches': [{'start': 4, 'delete': 0, 'insert': 'e'}]})
+
+        def fail(db, state, source):
+            raise RuntimeError('disk full')
+
+        monkeypatch.setattr(app_module, 'prepare_revision', fail)
+        with app.app_context():
+            try:
+                flush_autosaves()
+            except RuntimeError:
+                pass
+            assert pending_autosave(nid)['content'] == 'abcde'
+        monkeypatch.setattr(app_module, 'prepare_revision', prepare)
+        with app.app_context():
+            assert flush_autosaves() == 1
+            assert query_db('SELECT content FROM notes WHERE id = ?', (nid,), one=True)['content'] == 'abcde'
+    finally:
+        app.config['AUTOSAVE_FLUSH_MS'] = 0
+
+
+def test_new_note_autosave_returns_urls_for_later_saves(auth_client):
+    rv = auth_client.post('/notes/new', data={'title': '唐', 'content': '長安'}, headers={'X-Auto-Save': '1'})
+    data = rv.get_json()
+    assert data['revision'] == 0
+    assert data['edit_url'] == f"/notes/{data['id']}/edit" and data['autosave_url'] == f"/notes/{data['id']}/autosave"
+    rv = auth_client.post(data['autosave_url'], json={'base_revision': 0, 'patches': [{'start': 2, 'delete': 0, 'insert': 'の都'}]})
+    assert rv.get_json()['revision'] == 1
+    with app.app_context():
+        assert [tuple(r) for r in query_db('SELECT title, content FROM notes')] == [('唐', '長安の都')]
+    assert 'data-storage-key="note-autosave:1:new"' in auth_client.get('/notes/new').get_data(as_text=True)
@@ -0,0 +1,68 @@
+import gzip
+import re
+
+from app import app, query_db
+
+GZIP = {'Accept-Encoding': 'gzip, deflate'}
+
+
+def test_html_and_markdown_gzipped_when_accepted(auth_client):
+    auth_client.post('/notes/new', data={'title': 'ルネサンス', 'content': 'フィレンツェとメディチ家。\n' * 200})
+    with app.app_context():
+        nid = query_db('SELECT id FROM notes', one=True)['id']
+
+    auth_client.get('/dashboard')  # consume the flashed messages
+    plain = auth_client.get('/dashboard')
+    assert 'Content-Encoding' not in plain.headers and 'Accept-Encoding' in plain.headers['Vary']
+    rv = auth_client.get('/dashboard', headers=GZIP)
+    assert rv.headers['Content-Encoding'] == 'gzip' and int(rv.headers['Content-Length']) < len(plain.get_data())
+    assert gzip.decompress(rv.get_data()) == plain.get_data()
+
+    rv = auth_client.get(f'/notes/{nid}/export', headers=GZIP)
+    assert rv.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(rv.get_data()).decode('utf-8').startswith('# ルネサンス')
+
+    # the streamed CSV export is compressed chunk by chunk
+    plain = auth_client.get('/notes/export_all').get_data()
+    rv = auth_client.get('/notes/export_all', headers=GZIP)
+    assert rv.headers['Content-Encoding'] == 'gzip' and 'Content-Length' not in rv.headers
+    assert gzip.decompress(rv.get_data()) == plain and 'フィレンツェ' in plain.decode('utf-8')
+
+    # small or non-text responses are sent as they are
+    assert 'Content-Encoding' not in auth_client.get('/notes/export_all.zip', headers=GZIP).headers
+    assert 'Content-Encoding' not in auth_client.get('/tags', headers=GZIP).headers
+    app.config['COMPRESS_MIN_BYTES'] = 10 ** 6
+    try:
+        assert 'Content-Encoding' not in auth_client.get('/dashboard', headers=GZIP).headers
+    finally:
+        app.config['COMPRESS_MIN_BYTES'] = 1024
+
+
+def test_gzipped_public_page_revalidates(auth_client):
+    auth_client.post('/notes/new', data={'title': '公開', 'content': '大航海時代\n' * 300})
+    with app.app_context():
+        nid = query_db('SELECT id FROM notes', one=True)['id']
+    auth_client.post(f'/notes/{nid}/share')
+    with app.app_context():
+        token = query_db('SELECT token FROM public_links', one=True)['token']
+    rv = auth_client.get(f'/s/{token}', headers=GZIP)
+    assert rv.headers['Content-Encoding'] == 'gzip' and rv.headers['ETag'].startswith('W/"')
+    rv = auth_client.get(f'/s/{token}', headers=dict(GZIP, **{'If-None-Match': rv.headers['ETag']}))
+    assert rv.status_code == 304
+
+
+def test_static_urls_fingerprinted_and_cached_long(auth_client):
+    page = auth_client.get('/notes/new').get_data(as_text=True)
+    urls = re.findall(r'(?:href|src)="(/static/[^"]+)"', page)
+    assert {u.split('?')[0] for u in urls} == {'/static/style.css', '/static/note.js'}
+    assert all(re.search(r'\?v=[0-9a-f]{12}$', u) for u in urls)
+
+    rv = auth_client.get(urls[0])
+    assert rv.status_code == 200
+    assert 'max-age=31536000' in rv.headers['Cache-Control'] and 'immutable' in rv.headers['Cache-Control']
+    rv.close()
+    # unversioned or stale URLs keep revalidating
+    for url in (urls[0].split('?')[0], urls[0].split('?')[0] + '?v=000000000000'):
+        rv = auth_client.get(url)
+        assert 'max-age=31536000' not in rv.headers.get('Cache-Control', '')
+        rv.close()
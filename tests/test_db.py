@@ -0,0 +1,101 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+
+from app import app, get_db, db_stats, connect_db
+
+
+def test_connection_reused_and_configured(client):
+    with app.app_context():
+        first = get_db()
+        assert first.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert first.execute('PRAGMA busy_timeout').fetchone()[0] == app.config['DB_BUSY_TIMEOUT_MS']
+        assert first.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+    before = db_stats()['connections_reused']
+    with app.app_context():
+        assert get_db() is first
+    assert db_stats()['connections_reused'] == before + 1
+
+    # another thread gets its own connection
+    other = []
+    def worker():
+        with app.app_context():
+            other.append(get_db())
+    t = threading.Thread(target=worker)
+    t.start()
+    t.join()
+    assert other[0] is not first
+
+
+def test_lock_errors_counted(client):
+    app.config['DB_BUSY_TIMEOUT_MS'] = 0
+    try:
+        path = os.path.join(tempfile.mkdtemp(), 'lock.db')
+        db = connect_db(path)
+        db.execute('CREATE TABLE t (x)')
+        blocker = sqlite3.connect(path, isolation_level=None)
+        blocker.execute('BEGIN IMMEDIATE')
+        before = db_stats()['lock_errors']
+        try:
+            db.execute('INSERT INTO t VALUES (1)')
+        except sqlite3.OperationalError:
+            pass
+        assert db_stats()['lock_errors'] == before + 1
+        blocker.rollback()
+    finally:
+        app.config['DB_BUSY_TIMEOUT_MS'] = 5000
+
+
+def test_stats_endpoint_disabled_by_default(client):
+    assert client.get('/stats').status_code == 404
+    app.config['STATS_ENABLED'] = True
+    try:
+        assert 'connections_opened' in client.get('/stats').get_json()['db']
+    finally:
+        app.config['STATS_ENABLED'] = False
+
+
+def test_profiling_metrics_and_server_timing(auth_client, caplog):
+    assert auth_client.get('/metrics').status_code == 404
+    assert 'Server-Timing' not in auth_client.get('/dashboard').headers
+    app.config['PROFILING_ENABLED'] = True
+    app.config['SLOW_QUERY_MS'] = 0
+    try:
+        with caplog.at_level('WARNING', logger=app.logger.name):
+            resp = auth_client.get('/dashboard?q=ローマ帝国')
+        assert resp.headers['Server-Timing'].startswith('app;dur=')
+        assert 'queries"' in resp.headers['Server-Timing']
+        slow = [json.loads(r.getMessage()) for r in caplog.records if '"slow_query"' in r.getMessage()]
+        assert any(s['endpoint'] == 'dashboard' and s.get('plan') for s in slow)
+
+        text = auth_client.get('/metrics').get_data(as_text=True)
+        assert 'notes_request_duration_seconds_count{endpoint="dashboard",method="GET"} 1' in text
+        assert 'notes_request_duration_seconds_bucket{endpoint="dashboard",method="GET",le="+Inf"} 1' in text
+        assert 'notes_db_query_total{sql="SELECT ' in text
+        assert 'notes_db_commits_total' in text
+    finally:
+        app.config['PROFILING_ENABLED'] = False
+        app.config['SLOW_QUERY_MS'] = 100
+
+
+def test_compressed_content_round_trip(auth_client):
+    body = 'ローマ帝国の分裂と西ローマ帝国の滅亡。\n' * 400
+    app.config['CONTENT_COMPRESSION'] = True
+    try:
+        auth_client.post('/notes/new', data={'title': '長い', 'content': body})
+        auth_client.post('/notes/new', data={'title': '短い', 'content': '長安の都'})
+    finally:
+        app.config['CONTENT_COMPRESSION'] = False
+    with app.app_context():
+        raw = dict(sqlite3.connect(app.config['DATABASE']).execute('SELECT title, content FROM notes').fetchall())
+        nid = get_db().execute("SELECT id FROM notes WHERE title = '長い'").fetchone()['id']
+    assert isinstance(raw['長い'], bytes) and len(raw['長い']) < len(body.encode('utf-8')) // 10
+    assert raw['短い'] == '長安の都'
+
+    assert body in auth_client.get(f'/notes/{nid}/export').get_data(as_text=True)
+    assert '西ローマ帝国の滅亡' in auth_client.get('/notes/export_all').get_data(as_text=True)
+    assert '<strong>長い</strong>' in auth_client.get('/dashboard?q=西ローマ 滅亡').get_data(as_text=True)
+    # substring fallback for short terms reads the stored value through note_text()
+    assert '<strong>長い</strong>' in auth_client.get('/dashboard?q=分裂').get_data(as_text=True)
@@ -0,0 +1,41 @@
+import csv
+import io
+import zipfile
+
+from app import app
+
+
+def test_export_all_streams_csv_and_zip(auth_client):
+    app.config['EXPORT_CHUNK_SIZE'] = 2
+    try:
+        for i in range(5):
+            auth_client.post('/notes/new', data={'title': f'条約 {i}', 'content': f'本文,"{i}"\n二行目', 'tags': 'ヨーロッパ', 'period': '近世'})
+
+        rv = auth_client.get('/notes/export_all')
+        assert rv.is_streamed
+        assert rv.headers['Content-Type'] == 'text/csv; charset=utf-8'
+        rows = list(csv.reader(io.StringIO(rv.get_data(as_text=True))))
+        assert rows[0] == ['id', 'title', 'tags', 'period', 'region', 'created_at', 'updated_at', 'content']
+        assert len(rows) == 6
+        assert {r[7] for r in rows[1:]} == {f'本文,"{i}"\n二行目' for i in range(5)}
+
+        rv = auth_client.get('/notes/export_all.zip')
+        assert rv.is_streamed
+        zf = zipfile.ZipFile(io.BytesIO(rv.get_data()))
+        assert zf.testzip() is None
+        names = zf.namelist()
+        assert len(names) == 5 and all(n.startswith('条約_') and n.endswith('.md') for n in names)
+        # same format as the single-note export
+        single = auth_client.get(f"/notes/{names[0].rsplit('-', 1)[1][:-3]}/export").get_data(as_text=True)
+        assert zf.read(names[0]).decode('utf-8') == single
+        assert '<!-- period:近世 region: tags:ヨーロッパ -->' in single
+    finally:
+        app.config['EXPORT_CHUNK_SIZE'] = 200
+
+
+def test_export_zip_member_names_stay_flat(auth_client):
+    for title in ('../../etc/passwd', 'a/b\\c', '.hidden'):
+        auth_client.post('/notes/new', data={'title': title, 'content': 'x'})
+    with zipfile.ZipFile(io.BytesIO(auth_client.get('/notes/export_all.zip').get_data())) as zf:
+        names = sorted(zf.namelist())
+    assert names == ['_.._etc_passwd-1.md', 'a_b_c-2.md', 'hidden-3.md']
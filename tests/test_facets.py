@@ -0,0 +1,41 @@
+import io
+
+from app import app, get_db, rebuild_note_facets
+
+
+def _facet_rows():
+    with app.app_context():
+        db = get_db()
+        live = sorted(tuple(r) for r in db.execute('SELECT * FROM note_facets'))
+        rebuild_note_facets(db)
+        recount = sorted(tuple(r) for r in db.execute('SELECT * FROM note_facets'))
+        db.rollback()
+    return live, recount
+
+
+def test_facet_counts_follow_every_write(auth_client):
+    notes = [('ローマ', '古代', 'イタリア', '帝国,地中海'), ('カール大帝', '中世', 'フランス', '帝国'),
+             ('ナポレオン', '近代', 'フランス', '帝国,革命'), ('明治維新', '近代', '日本', '革命')]
+    for title, period, region, tags in notes:
+        auth_client.post('/notes/new', data={'title': title, 'content': title, 'period': period, 'region': region, 'tags': tags})
+    auth_client.post('/notes/3/edit', data={'title': 'ナポレオン', 'content': '皇帝', 'period': '近世', 'region': 'フランス', 'tags': '帝国'})
+    auth_client.post('/notes/2/autosave', json={'base_revision': 0, 'fields': {'region': 'ドイツ', 'tags': '帝国,王国'}})
+    auth_client.post('/notes/4/delete')
+    md = '# 唐\n\n<!-- period:中世 region:中国 tags:帝国 -->\n\n長安'
+    auth_client.post('/notes/import', data={'file': (io.BytesIO(md.encode('utf-8')), 'tang.md')}, content_type='multipart/form-data')
+
+    live, recount = _facet_rows()
+    assert live == recount
+    data = auth_client.get('/facets').get_json()
+    assert data['period'] == [{'value': '中世', 'count': 2}, {'value': '古代', 'count': 1}, {'value': '近世', 'count': 1}]
+    assert data['tags'][0] == {'value': '帝国', 'count': 4}
+    assert {'value': '革命', 'count': 1} not in data['tags']  # only the deleted note had it
+
+    # counts for the current search only
+    data = auth_client.get('/facets?period=中世').get_json()
+    assert data['region'] == [{'value': 'ドイツ', 'count': 1}, {'value': '中国', 'count': 1}]
+    assert auth_client.get('/facets?q=長安').get_json()['period'] == [{'value': '中世', 'count': 1}]
+
+    html = auth_client.get('/dashboard?period=中世').get_data(as_text=True)
+    assert '<option value="近世" >近世（1）</option>' in html
+    assert '帝国（2）' in html
@@ -0,0 +1,90 @@
+import io
+import zipfile
+
+from app import app, query_db, parse_markdown_note
+
+
+def test_parse_markdown_note_round_trips_export_format():
+    text = '# ウェストファリア条約\n\n<!-- period:近世 region:ヨーロッパ tags:条約, 三十年戦争 -->\n\n1648年\n主権国家体制'
+    assert parse_markdown_note(text) == {'title': 'ウェストファリア条約', 'content': '1648年\n主権国家体制',
+                                         'period': '近世', 'region': 'ヨーロッパ', 'tags': '条約, 三十年戦争'}
+    plain = '# メモ\n本文'
+    assert parse_markdown_note(plain) == {'title': 'メモ', 'content': plain, 'period': '', 'region': '', 'tags': ''}
+
+
+def test_bulk_import_files_and_zip_in_one_go(auth_client):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('a.md', '# 唐\n\n<!-- period:中世 region:中国 tags:王朝 -->\n\n長安')
+        zf.writestr('sub/b.md', '# 宋\n\n<!-- period:中世 region:中国 tags:王朝,科挙 -->\n\n開封')
+        zf.writestr('image.png', b'\x89PNG')
+    archive.seek(0)
+    rv = auth_client.post('/notes/import', data={'file': [
+        (io.BytesIO('# 元\n大都'.encode('utf-8')), 'yuan.md'),
+        (io.BytesIO(b'\xff\xfe'), 'broken.md'),
+        (archive, 'notes.zip'),
+    ]}, content_type='multipart/form-data')
+    text = rv.get_data(as_text=True)
+    assert '3件のノートをインポートしました（2件は失敗）' in text
+    assert 'notes.zip/image.png' in text and 'broken.md' in text
+
+    with app.app_context():
+        notes = {n['title']: n for n in query_db('SELECT * FROM notes')}
+    assert set(notes) == {'唐', '宋', '元'}
+    assert notes['宋']['content'] == '開封' and notes['宋']['period'] == '中世'
+    # derived indexes were filled for the batch
+    assert '宋' in auth_client.get('/dashboard?tags=科挙').get_data(as_text=True)
+    assert auth_client.get('/tags').get_json()['tags'][0] == {'tag': '王朝', 'count': 2}
+    assert '>元<' in auth_client.get('/dashboard?q=大都').get_data(as_text=True)
+
+
+def test_export_zip_reimports_identically(auth_client):
+    auth_client.post('/notes/new', data={'title': 'ナポレオン', 'content': '1804年 皇帝\n', 'tags': '人物', 'period': '近代', 'region': 'フランス'})
+    exported = auth_client.get('/notes/export_all.zip').get_data()
+    rv = auth_client.post('/notes/import', data={'file': (io.BytesIO(exported), 'all.zip')}, content_type='multipart/form-data', follow_redirects=True)
+    assert rv.status_code == 200
+    with app.app_context():
+        a, b = query_db('SELECT title, content, tags, period, region FROM notes ORDER BY id')
+    assert tuple(a) == tuple(b)
+
+
+def test_import_reports_corrupt_zip_members_per_file(auth_client):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('ok.md', '# 明\n北京')
+        zf.writestr('bad.md', '# 清\n' + '乾隆' * 50)
+    data = archive.getvalue()
+    corrupt = data.replace('乾隆'.encode('utf-8'), '乾坤'.encode('utf-8'), 1)  # CRC no longer matches
+    rv = auth_client.post('/notes/import', data={'file': (io.BytesIO(corrupt), 'notes.zip')}, content_type='multipart/form-data')
+    text = rv.get_data(as_text=True)
+    assert rv.status_code == 200
+    assert '1件のノートをインポートしました（1件は失敗）' in text and 'notes.zip/bad.md' in text
+    with app.app_context():
+        assert [n['title'] for n in query_db('SELECT title FROM notes')] == ['明']
+
+
+def test_import_parses_uploads_before_taking_the_write_lock(auth_client, monkeypatch):
+    import sqlite3
+    import app as app_module
+    parse = app_module.parse_markdown_note
+    writes = []
+
+    def parse_and_write(text):
+        # another worker saving while the upload is being read
+        other = sqlite3.connect(app.config['DATABASE'], timeout=0)
+        try:
+            other.execute("UPDATE users SET username = username")
+            other.commit()
+            writes.append(True)
+        finally:
+            other.close()
+        return parse(text)
+
+    monkeypatch.setattr(app_module, 'parse_markdown_note', parse_and_write)
+    rv = auth_client.post('/notes/import', data={'file': [
+        (io.BytesIO('# 隋\n大興城'.encode('utf-8')), 'sui.md'),
+        (io.BytesIO('# 唐\n長安'.encode('utf-8')), 'tang.md'),
+    ]}, content_type='multipart/form-data')
+    assert rv.status_code == 200 and writes == [True, True]
+    with app.app_context():
+        assert [n['title'] for n in query_db('SELECT title FROM notes ORDER BY id')] == ['隋', '唐']
@@ -0,0 +1,51 @@
+import io
+import time
+import zipfile
+
+from app import app
+
+
+def _wait(client, status_url):
+    for _ in range(200):
+        job = client.get(status_url).get_json()
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError('job did not finish')
+
+
+def test_background_export_and_import(auth_client):
+    auth_client.post('/notes/new', data={'title': 'ローマ帝国', 'content': '五賢帝', 'tags': '古代'})
+    resp = auth_client.post('/jobs/export/zip')
+    assert resp.status_code == 202
+    job = _wait(auth_client, resp.get_json()['status_url'])
+    assert job['status'] == 'done' and job['kind'] == 'export_zip'
+    data = auth_client.get(job['download_url']).data
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        (name,) = zf.namelist()
+        md = zf.read(name)
+
+    resp = auth_client.post('/jobs/import', data={'file': [(io.BytesIO(md), 'a.md'), (io.BytesIO(b'x'), 'b.zip')]},
+                            content_type='multipart/form-data')
+    job = _wait(auth_client, resp.get_json()['status_url'])
+    assert job['status'] == 'done'
+    assert job['result'] == {'imported': 1, 'failed': [['b.zip', 'ZIPファイルを読み込めません']]}
+    csv_job = _wait(auth_client, auth_client.post('/jobs/export/csv').get_json()['status_url'])
+    assert auth_client.get(csv_job['download_url']).get_data(as_text=True).count('ローマ帝国') == 2
+
+
+def test_jobs_are_private_and_run_inline_without_workers(client):
+    app.config['JOB_WORKERS'] = 0
+    try:
+        client.post('/register', data={'username': 'a', 'password': 'pw'})
+        client.post('/register', data={'username': 'b', 'password': 'pw'})
+        client.post('/login', data={'username': 'a', 'password': 'pw'})
+        job = client.get(client.post('/jobs/export/csv').get_json()['status_url']).get_json()
+        assert job['status'] == 'done' and job['result']['bytes'] > 0
+        client.get('/logout')
+        client.post('/login', data={'username': 'b', 'password': 'pw'})
+        assert client.get(f"/jobs/{job['id']}").status_code == 404
+        assert client.get(f"/jobs/{job['id']}/download").status_code == 404
+        assert client.post('/jobs/export/pdf').status_code == 404
+    finally:
+        app.config['JOB_WORKERS'] = 2
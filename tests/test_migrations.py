@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import tempfile
+
+from app import MIGRATIONS, migrate_db, schema_version
+
+
+def test_migrations_upgrade_legacy_database_without_data_loss():
+    path = os.path.join(tempfile.mkdtemp(), 'legacy.db')
+    conn = sqlite3.connect(path)
+    # pre-migration layout: no public_links expiry columns, no indexes
+    conn.executescript('''
+        CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT NOT NULL UNIQUE, password TEXT NOT NULL);
+        CREATE TABLE notes (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, title TEXT, content TEXT,
+                            tags TEXT, period TEXT, region TEXT, created_at TEXT, updated_at TEXT);
+        CREATE TABLE public_links (id INTEGER PRIMARY KEY AUTOINCREMENT, note_id INTEGER NOT NULL, token TEXT NOT NULL UNIQUE, created_at TEXT);
+        INSERT INTO users (username, password) VALUES ('u', 'x');
+        INSERT INTO notes (user_id, title, content, tags, created_at) VALUES (1, 'ローマ帝国', '本文', '古代,ローマ', '2026-01-01T00:00:00');
+    ''')
+    conn.commit()
+
+    assert migrate_db(conn) == [m[0] for m in MIGRATIONS]
+    assert schema_version(conn) == MIGRATIONS[-1][0]
+    assert conn.execute('SELECT title, updated_at FROM notes').fetchone() == ('ローマ帝国', '2026-01-01T00:00:00')
+    cols = [r[1] for r in conn.execute('PRAGMA table_info(public_links)')]
+    assert 'expires_at' in cols and 'revoked' in cols
+    assert conn.execute('SELECT COUNT(*) FROM note_tags').fetchone()[0] == 2
+    assert conn.execute("SELECT rowid FROM notes_fts WHERE notes_fts MATCH '\"ローマ\"'").fetchall() == [(1,)]
+    indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {'idx_notes_user_updated', 'idx_public_links_note', 'idx_public_links_token_state'} <= indexes
+    # history starts from the current version
+    assert conn.execute('SELECT revision, source, snapshot, size, content FROM note_revisions').fetchall() == [(0, 'baseline', 1, 2, '本文')]
+
+    # re-running is a no-op
+    assert migrate_db(conn) == []
+    assert conn.execute('SELECT COUNT(*) FROM notes').fetchone()[0] == 1
+
+
+def test_migrations_add_missing_note_columns_to_pre_tags_database():
+    path = os.path.join(tempfile.mkdtemp(), 'legacy.db')
+    conn = sqlite3.connect(path)
+    # the layout of notes.db.bak.20260110123116: no tags/period/region/updated_at
+    conn.executescript('''
+        CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT NOT NULL UNIQUE, password TEXT NOT NULL);
+        CREATE TABLE notes (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, title TEXT, content TEXT, created_at TEXT,
+                            FOREIGN KEY(user_id) REFERENCES users(id));
+        INSERT INTO users (username, password) VALUES ('u', 'x');
+        INSERT INTO notes (user_id, title, content, created_at) VALUES (1, '授業ノート', '冷戦の始まり', '2026-01-10T11:48:16');
+    ''')
+    conn.commit()
+
+    assert migrate_db(conn) == [m[0] for m in MIGRATIONS]
+    cols = [r[1] for r in conn.execute('PRAGMA table_info(notes)')]
+    assert {'tags', 'period', 'region', 'updated_at', 'revision'} <= set(cols)
+    assert conn.execute('SELECT title, updated_at FROM notes').fetchone() == ('授業ノート', '2026-01-10T11:48:16')
+    assert conn.execute("SELECT rowid FROM notes_bigrams WHERE notes_bigrams MATCH 'grams : \"冷戦\"'").fetchall() == [(1,)]
+
+
+def test_migrations_resume_database_stuck_at_version_3():
+    path = os.path.join(tempfile.mkdtemp(), 'stuck.db')
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT NOT NULL UNIQUE, password TEXT NOT NULL);
+        CREATE TABLE notes (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, title TEXT, content TEXT, created_at TEXT);
+        INSERT INTO notes (user_id, title, content) VALUES (1, 'ローマ', '本文');
+    ''')
+    for version, name, steps in MIGRATIONS[:3]:
+        for step in steps:
+            if callable(step):
+                step(conn)
+            else:
+                conn.execute(step)
+        conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name TEXT, applied_at TEXT)')
+        conn.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+    conn.commit()
+
+    assert migrate_db(conn) == [m[0] for m in MIGRATIONS[3:]]
+    assert conn.execute('SELECT title, tags FROM notes').fetchone() == ('ローマ', None)
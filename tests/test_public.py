@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta
+
+from app import app, get_db, query_db, render_markdown, markdown_cache_stats, share_cache_stats, bump_share_links_epoch
+
+
+def _share(auth_client, content):
+    auth_client.post('/notes/new', data={'title': '公開', 'content': content})
+    with app.app_context():
+        nid = query_db('SELECT id FROM notes ORDER BY id DESC', one=True)['id']
+    auth_client.post(f'/notes/{nid}/share')
+    with app.app_context():
+        token = query_db('SELECT token FROM public_links WHERE note_id = ?', (nid,), one=True)['token']
+    return nid, token
+
+
+def test_render_markdown_subset_and_escaping():
+    html = render_markdown('# 年表\n\n- **476年** 西ローマ滅亡\n- *1453年*\n\n本文<script>alert(1)</script>\n次の行')
+    assert '<h1>年表</h1>' in html
+    assert '<ul>\n<li><strong>476年</strong> 西ローマ滅亡</li>\n<li><em>1453年</em></li>\n</ul>' in html
+    assert '<script>' not in html and '&lt;script&gt;' in html
+    assert '<p>本文&lt;script&gt;alert(1)&lt;/script&gt;<br>次の行</p>' in html
+
+
+def test_public_page_rendered_on_server_and_cached(auth_client):
+    nid, token = _share(auth_client, '## 十字軍\n<img src=x onerror=alert(1)>')
+    before = markdown_cache_stats()
+    text = auth_client.get(f'/s/{token}').get_data(as_text=True)
+    assert '<h2>十字軍</h2>' in text and '<img' not in text
+    assert 'note.js' not in text
+    auth_client.get(f'/s/{token}')
+    stats = markdown_cache_stats()
+    assert stats['misses'] - before['misses'] == 1 and stats['hits'] - before['hits'] == 1
+
+    # an edit changes updated_at, so the next view renders the new content
+    auth_client.post(f'/notes/{nid}/edit', data={'title': '公開', 'content': '## 百年戦争'})
+    assert '<h2>百年戦争</h2>' in auth_client.get(f'/s/{token}').get_data(as_text=True)
+
+
+def test_public_page_conditional_requests(auth_client):
+    nid, token = _share(auth_client, '本文')
+    rv = auth_client.get(f'/s/{token}')
+    etag, last_modified = rv.headers['ETag'], rv.headers['Last-Modified']
+    assert rv.headers['Cache-Control'] == 'public, max-age=60'
+    # nothing user-specific in a cacheable page
+    assert 'testuser' not in rv.get_data(as_text=True)
+
+    rv = auth_client.get(f'/s/{token}', headers={'If-None-Match': etag})
+    assert rv.status_code == 304 and rv.headers['ETag'] == etag and rv.get_data() == b''
+    rv = auth_client.get(f'/s/{token}', headers={'If-Modified-Since': last_modified})
+    assert rv.status_code == 304
+
+    # a short expiry caps max-age and changes the validator
+    with app.app_context():
+        db = get_db()
+        db.execute('UPDATE public_links SET expires_at = ? WHERE note_id = ?',
+                   ((datetime.utcnow() + timedelta(seconds=30)).isoformat(), nid))
+        bump_share_links_epoch(db)
+        db.commit()
+    rv = auth_client.get(f'/s/{token}', headers={'If-None-Match': etag})
+    assert rv.status_code == 200
+    assert int(rv.headers['Cache-Control'].split('=')[1]) <= 30
+
+    with app.app_context():
+        link_id = query_db('SELECT id FROM public_links WHERE note_id = ?', (nid,), one=True)['id']
+    auth_client.post(f'/shares/{link_id}/revoke')
+    rv = auth_client.get(f'/s/{token}', headers={'If-None-Match': etag})
+    assert rv.status_code == 404 and rv.headers['Cache-Control'] == 'no-store'
+
+
+def test_share_token_cache(auth_client):
+    nid, token = _share(auth_client, '本文')
+    auth_client.get(f'/s/{token}')
+    before = share_cache_stats()
+    etag = auth_client.get(f'/s/{token}').headers['ETag']
+    assert auth_client.get(f'/s/{token}', headers={'If-None-Match': etag}).status_code == 304
+    after = share_cache_stats()
+    assert after['hits'] - before['hits'] == 2 and after['misses'] == before['misses']
+
+    # malformed tokens never reach the database; unknown ones are cached apart
+    assert auth_client.get('/s/nope').status_code == 404
+    assert share_cache_stats()['rejected'] - after['rejected'] == 1
+    app.config['SHARE_NEGATIVE_CACHE_SIZE'] = 2
+    try:
+        for guess in ('0' * 32, '1' * 32, '2' * 32, '2' * 32):
+            assert auth_client.get(f'/s/{guess}').status_code == 404
+        stats = share_cache_stats()
+        assert stats['negative_hits'] - after['negative_hits'] == 1 and stats['negative_entries'] == 2
+        # guesses don't push valid links out of the cache
+        assert auth_client.get(f'/s/{token}').status_code == 200
+        assert share_cache_stats()['hits'] - stats['hits'] == 1
+    finally:
+        app.config['SHARE_NEGATIVE_CACHE_SIZE'] = 1000
+    after = share_cache_stats()
+
+    # the cleanup script (another process) invalidates through the epoch counter
+    import importlib.util, os
+    spec = importlib.util.spec_from_file_location('cleanup', os.path.join(os.path.dirname(__file__), '..', 'scripts', 'cleanup_expired_shares.py'))
+    cleanup = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(cleanup)
+    with app.app_context():
+        db = get_db()
+        db.execute('UPDATE public_links SET expires_at = ? WHERE note_id = ?', ((datetime.utcnow() - timedelta(days=1)).isoformat(), nid))
+        db.commit()
+    assert auth_client.get(f'/s/{token}').status_code == 200  # still cached
+    assert cleanup.cleanup(app.config['DATABASE'])
+    assert auth_client.get(f'/s/{token}').status_code == 404
+
+    # re-sharing with a TTL is visible immediately
+    auth_client.post(f'/notes/{nid}/share', data={'ttl_days': '7'})
+    assert auth_client.get(f'/s/{token}').status_code == 200
+    auth_client.post(f'/notes/{nid}/delete')
+    assert auth_client.get(f'/s/{token}').status_code == 404
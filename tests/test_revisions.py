@@ -0,0 +1,97 @@
+import time
+
+from app import app, get_db, query_db, text_delta, apply_delta, note_revision, prepare_revision, record_revision
+
+
+def _history(note_id):
+    with app.app_context():
+        return [tuple(r) for r in query_db('SELECT revision, source, snapshot FROM note_revisions WHERE note_id = ? ORDER BY revision', (note_id,))]
+
+
+def test_line_delta_round_trip():
+    old = '年表\n- 476年: 西ローマ帝国滅亡\n- 800年: カール戴冠\n'
+    for new in [old, '', old + '- 843年: ヴェルダン条約', '前書き\n' + old.replace('カール', 'シャルルマーニュ'), 'a\r\nb']:
+        assert apply_delta(old, text_delta(old, new)) == new
+    assert len(text_delta(old * 50, old * 50 + 'x')) < 40
+
+
+def test_line_delta_stays_fast_on_repetitive_text():
+    old = ''.join('\n' if i % 2 else f'- 項目{i % 50}\n' for i in range(6000))
+    lines = old.splitlines(keepends=True)
+    for changed in ([3000], [10, 2500, 5990]):
+        new = lines[:]
+        for i in changed:
+            new[i] = '変更\n'
+        new = ''.join(new)
+        start = time.perf_counter()
+        delta = text_delta(old, new)
+        assert time.perf_counter() - start < 0.2
+        assert apply_delta(old, delta) == new
+
+
+def test_edits_autosave_collapse_and_restore(auth_client):
+    base = ''.join(f'- {year}年: 出来事{year}\n' for year in range(1000, 1100))
+    auth_client.post('/notes/new', data={'title': '中世', 'content': base})
+    with app.app_context():
+        nid = query_db('SELECT id FROM notes', one=True)['id']
+    auth_client.post(f'/notes/{nid}/edit', data={'title': '中世', 'content': base + '- 1096年: 第1回十字軍\n'})
+    # autosaves within the window collapse into the row of the first one
+    for i in range(3):
+        auth_client.post(f'/notes/{nid}/edit', data={'title': '中世', 'content': base + f'草稿{i}\n'}, headers={'X-Auto-Save': '1'})
+    assert _history(nid) == [(0, 'create', 1), (1, 'edit', 0), (4, 'autosave', 0)]
+
+    with app.app_context():
+        db = get_db()
+        assert note_revision(db, nid, 1)['content'] == base + '- 1096年: 第1回十字軍\n'
+        assert note_revision(db, nid, 4)['content'] == base + '草稿2\n'
+        assert note_revision(db, nid, 2) is None
+
+    text = auth_client.get(f'/notes/{nid}/revisions').get_data(as_text=True)
+    assert '自動保存' in text and f'/notes/{nid}/revisions/1/restore' in text
+    md = auth_client.get(f'/notes/{nid}/revisions/1').get_data(as_text=True)
+    assert md.startswith('# 中世') and '第1回十字軍' in md
+
+    auth_client.post(f'/notes/{nid}/revisions/1/restore')
+    with app.app_context():
+        note = query_db('SELECT content, revision FROM notes WHERE id = ?', (nid,), one=True)
+    assert note['content'] == base + '- 1096年: 第1回十字軍\n' and note['revision'] == 5
+    assert _history(nid)[-1] == (5, 'restore', 0)
+
+    auth_client.post(f'/notes/{nid}/delete')
+    assert _history(nid) == []
+
+
+def test_snapshots_bound_delta_chains(auth_client):
+    app.config['REVISION_SNAPSHOT_EVERY'] = 3
+    try:
+        content = ''.join(f'行{i}\n' for i in range(50))
+        auth_client.post('/notes/new', data={'title': '年表', 'content': content})
+        with app.app_context():
+            nid = query_db('SELECT id FROM notes', one=True)['id']
+        versions = [content]
+        for i in range(6):
+            versions.append(versions[-1] + f'追記{i}\n')
+            auth_client.post(f'/notes/{nid}/edit', data={'title': '年表', 'content': versions[-1]})
+    finally:
+        app.config['REVISION_SNAPSHOT_EVERY'] = 20
+    assert [s for _, _, s in _history(nid)] == [1, 0, 0, 1, 0, 0, 1]
+    with app.app_context():
+        db = get_db()
+        assert [note_revision(db, nid, r)['content'] for r in range(7)] == versions
+
+
+def test_history_row_prepared_before_a_concurrent_save_becomes_snapshot(auth_client):
+    auth_client.post('/notes/new', data={'title': '冷戦', 'content': '1947年 トルーマン・ドクトリン\n' * 20})
+    with app.app_context():
+        db = get_db()
+        note = dict(query_db('SELECT * FROM notes', one=True))
+        state = dict(note, content=note['content'] + '1949年 NATO\n', updated_at='2026-10-17T10:00:00', revision=2)
+        prepared = prepare_revision(db, state, 'edit')
+        assert prepared['snapshot'] == 0
+        # another worker records revision 1 before this save is written
+        record_revision(db, dict(note, content='別の本文', updated_at='2026-10-17T09:59:00', revision=1),
+                        prepare_revision(db, dict(note, content='別の本文', updated_at='2026-10-17T09:59:00'), 'edit'))
+        record_revision(db, state, prepared)
+        db.commit()
+        assert note_revision(db, note['id'], 2)['content'] == state['content']
+        assert query_db('SELECT snapshot FROM note_revisions WHERE note_id = ? AND revision = 2', (note['id'],), one=True)[0] == 1
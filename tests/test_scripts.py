@@ -0,0 +1,171 @@
+import gzip
+import importlib.util
+import json
+import os
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+
+import app as app_module
+from app import migrate_db
+
+SCRIPTS = os.path.join(os.path.dirname(__file__), '..', 'scripts')
+
+
+def _load(name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPTS, f'{name}.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_cleanup_expired_shares_single_update_and_dry_run():
+    cleanup = _load('cleanup_expired_shares')
+    path = os.path.join(tempfile.mkdtemp(), 'notes.db')
+    conn = sqlite3.connect(path)
+    migrate_db(conn)
+    past = (datetime.utcnow() - timedelta(days=1)).isoformat()
+    future = (datetime.utcnow() + timedelta(days=1)).isoformat()
+    conn.executemany('INSERT INTO public_links (note_id, token, expires_at, revoked) VALUES (?, ?, ?, ?)',
+                     [(1, 'a', past, 0), (2, 'b', past, 0), (3, 'c', future, 0), (4, 'd', None, 0), (5, 'e', past, 1)])
+    conn.commit()
+    plan = conn.execute('EXPLAIN QUERY PLAN UPDATE public_links SET revoked = 1 WHERE ' + cleanup.EXPIRED, (past,)).fetchall()
+    assert 'idx_public_links_active_expiry' in str(plan)
+
+    assert cleanup.cleanup(path, dry_run=True) == 2
+    assert conn.execute('SELECT COUNT(*) FROM public_links WHERE revoked = 1').fetchone()[0] == 1
+    assert cleanup.cleanup(path) == 2
+    assert [r[0] for r in conn.execute('SELECT token FROM public_links WHERE revoked = 1 ORDER BY token')] == ['a', 'b', 'e']
+    assert conn.execute("SELECT value FROM cache_epochs WHERE name = 'share_links'").fetchone()[0] == 1
+    assert cleanup.cleanup(path) == 0
+
+
+def test_migrate_from_backup_bulk_copy_with_username_map():
+    migrate = _load('migrate_from_backup')
+    tmp = tempfile.mkdtemp()
+    src, dst = os.path.join(tmp, 'backup.db'), os.path.join(tmp, 'notes.db')
+    conn = sqlite3.connect(src)
+    # old layout without tags/period/region/updated_at
+    conn.executescript('''
+        CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT, password TEXT);
+        CREATE TABLE notes (id INTEGER PRIMARY KEY, user_id INTEGER, title TEXT, content TEXT, created_at TEXT);
+        INSERT INTO users VALUES (1, 'taro', 'h1'), (2, 'hanako', 'h2');
+        INSERT INTO notes VALUES (1, 1, 'ローマ', '共和政', '2026-01-01T00:00:00'), (2, 2, '唐', '長安', NULL), (3, 9, '孤児', '', NULL);
+    ''')
+    conn.commit()
+    target = sqlite3.connect(dst)
+    migrate_db(target)
+    target.execute("INSERT INTO users (username, password) VALUES ('hanako2', 'existing')")
+    target.commit()
+
+    assert migrate.migrate(src, dst, {'hanako': 'hanako2'}, dry_run=True) == (1, 2, 1)
+    assert target.execute('SELECT COUNT(*) FROM notes').fetchone()[0] == 0
+    assert migrate.migrate(src, dst, {'hanako': 'hanako2'}) == (1, 2, 1)
+    rows = target.execute('SELECT u.username, n.title, n.created_at = n.updated_at FROM notes n JOIN users u ON u.id = n.user_id ORDER BY n.id').fetchall()
+    assert rows == [('taro', 'ローマ', 1), ('hanako2', '唐', 1)]
+    assert target.execute("SELECT password FROM users WHERE username = 'hanako2'").fetchone()[0] == 'existing'
+    assert target.execute("SELECT COUNT(*) FROM notes_fts WHERE notes_fts MATCH '\"共和政\"'").fetchone()[0] == 1
+
+
+def test_backup_db_online_copy_gzip_and_retention():
+    backup_db = _load('backup_db')
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, 'notes.db')
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    migrate_db(conn)
+    conn.execute("INSERT INTO users (username, password) VALUES ('u', 'x')")
+    conn.commit()  # left in the WAL: a plain file copy would miss it
+
+    dest = os.path.join(tmp, 'backups')
+    plain = backup_db.backup(path, dest, now=datetime(2026, 1, 10, 3, 0, 0))
+    assert sqlite3.connect(plain).execute('SELECT username FROM users').fetchall() == [('u',)]
+    packed = backup_db.backup(path, dest, compress=True, now=datetime(2026, 1, 11, 3, 0, 0))
+    assert packed.endswith('.gz') and not os.path.exists(packed[:-3])
+    with gzip.open(packed) as f:
+        assert f.read(16) == b'SQLite format 3\x00'
+
+    names = [f'notes-202601{d:02d}T{h:02d}0000.db' for d in range(1, 21) for h in (3, 15)] + ['other.db']
+    expired = backup_db.expired_backups(names, keep_daily=3, keep_weekly=3)
+    kept = sorted(set(names) - set(expired) - {'other.db'})
+    # newest of Jan 18-20 (Sunday the 18th also closes its ISO week) plus Jan 11
+    assert kept == ['notes-20260111T150000.db', 'notes-20260118T150000.db',
+                    'notes-20260119T150000.db', 'notes-20260120T150000.db']
+    assert 'other.db' not in expired
+    assert backup_db.expired_backups(names, 0, 0) == sorted(set(names) - {'other.db', 'notes-20260120T150000.db'}, reverse=True)
+
+
+def test_backup_database_pauses_between_steps(monkeypatch):
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, 'notes.db')
+    conn = sqlite3.connect(path)
+    migrate_db(conn)
+    conn.close()
+    pages = sqlite3.connect(path).execute('PRAGMA page_count').fetchone()[0]
+    sleeps = []
+    monkeypatch.setattr(app_module.time, 'sleep', sleeps.append)
+    app_module.backup_database(path, os.path.join(tmp, 'copy.db'), pages=1, sleep_ms=20)
+    # one pause after every step but the last
+    assert sleeps == [0.02] * (pages - 1)
+    sleeps.clear()
+    app_module.backup_database(path, os.path.join(tmp, 'copy.db'), pages=1, sleep_ms=0)
+    assert sleeps == []
+
+
+def test_bench_routes_smoke():
+    bench = _load('bench_routes')
+    result = bench.run(users=2, notes_per_user=20, shares=5, iterations=4)
+    assert set(result['results']) == set(bench.scenarios([], [], None))
+    for name, summary in result['results'].items():
+        assert summary['errors'] == 0, name
+        assert summary['requests'] >= 1 and summary['p99_ms'] >= summary['p50_ms']
+    assert json.loads(json.dumps(result))['config']['mode'] == 'test_client'
+
+
+def test_compress_content_converts_both_ways():
+    compress = _load('compress_content')
+    path = os.path.join(tempfile.mkdtemp(), 'notes.db')
+    conn = sqlite3.connect(path)
+    migrate_db(conn)
+    long_text = '産業革命とイギリスの綿工業。' * 500
+    conn.executemany('INSERT INTO notes (user_id, title, content) VALUES (1, ?, ?)',
+                     [('長い', long_text), ('短い', '蒸気機関'), ('空', None)])
+    conn.commit()
+
+    report = compress.run(path, 1024, dry_run=True)
+    assert report['converted'] == 1 and 'read_us_after' not in report
+    assert conn.execute("SELECT typeof(content) FROM notes WHERE title = '長い'").fetchone()[0] == 'text'
+
+    report = compress.run(path, 1024, vacuum=True)
+    assert (report['rows'], report['converted']) == (3, 1)
+    assert report['content_bytes_after'] < report['content_bytes_before'] and report['ratio'] < 0.1
+    assert report['file_bytes_after'] <= report['file_bytes_before']
+    stored = conn.execute("SELECT content FROM notes WHERE title = '長い'").fetchone()[0]
+    assert isinstance(stored, bytes) and compress.unpack_content(stored) == long_text
+    assert compress.run(path, 1024)['converted'] == 0
+
+    assert compress.run(path, 1024, decompress=True)['converted'] == 1
+    assert conn.execute("SELECT content FROM notes WHERE title = '長い'").fetchone()[0] == long_text
+
+
+def test_compress_content_keeps_concurrent_saves():
+    compress = _load('compress_content')
+    path = os.path.join(tempfile.mkdtemp(), 'notes.db')
+    conn = sqlite3.connect(path)
+    migrate_db(conn)
+    conn.execute('INSERT INTO notes (user_id, title, content) VALUES (1, ?, ?)', ('長い', '冷戦と東西対立。' * 500))
+    conn.commit()
+    compress_text = compress.compress_content
+
+    def save_meanwhile(text, min_bytes):
+        # the app saves the note between the script's read and its write
+        other = sqlite3.connect(path)
+        other.execute("UPDATE notes SET content = '新しい本文'")
+        other.commit()
+        other.close()
+        return compress_text(text, min_bytes)
+
+    compress.compress_content = save_meanwhile
+    report = compress.run(path, 1024)
+    assert report['converted'] == 0 and report['content_bytes_after'] == report['content_bytes_before']
+    assert conn.execute('SELECT content FROM notes').fetchone()[0] == '新しい本文'
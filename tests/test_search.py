@@ -0,0 +1,106 @@
+from app import app, query_db, rebuild_search_index, get_db, note_search_sql
+
+
+def test_keyword_search_uses_fulltext_index(auth_client):
+    auth_client.post('/notes/new', data={'title': '神聖ローマ帝国', 'content': 'オットー1世の戴冠'})
+    auth_client.post('/notes/new', data={'title': 'フランク王国', 'content': 'カール大帝とローマ教皇'})
+    auth_client.post('/notes/new', data={'title': '唐', 'content': '長安の都'})
+
+    text = auth_client.get('/dashboard?q=ローマ').get_data(as_text=True)
+    assert '神聖ローマ帝国' in text and 'フランク王国' in text
+    assert '長安' not in text and '>唐<' not in text
+    # title hits rank above body hits
+    assert text.index('神聖ローマ帝国') < text.index('フランク王国')
+
+    # multiple terms must all match
+    text = auth_client.get('/dashboard?q=ローマ 戴冠').get_data(as_text=True)
+    assert '神聖ローマ帝国' in text and 'フランク王国' not in text
+
+    # terms shorter than a trigram are looked up in the bigram index
+    text = auth_client.get('/dashboard?q=長安').get_data(as_text=True)
+    assert '<strong>唐</strong>' in text
+
+
+def test_search_index_follows_edit_delete_and_rebuild(auth_client):
+    auth_client.post('/notes/new', data={'title': '十字軍', 'content': 'エルサレム'})
+    with app.app_context():
+        nid = query_db('SELECT id FROM notes', one=True)['id']
+    auth_client.post(f'/notes/{nid}/edit', data={'title': '十字軍', 'content': 'コンスタンティノープル'})
+    assert '十字軍' not in auth_client.get('/dashboard?q=エルサレム').get_data(as_text=True)
+    assert '十字軍' in auth_client.get('/dashboard?q=コンスタンティノープル').get_data(as_text=True)
+
+    with app.app_context():
+        db = get_db()
+        db.execute('DELETE FROM notes_fts')
+        db.commit()
+        assert rebuild_search_index(db) == 1
+        db.commit()
+    assert '十字軍' in auth_client.get('/dashboard?q=コンスタンティノープル').get_data(as_text=True)
+
+    auth_client.post(f'/notes/{nid}/delete')
+    with app.app_context():
+        assert query_db('SELECT COUNT(*) AS cnt FROM notes_fts', one=True)['cnt'] == 0
+
+
+def test_dashboard_keyset_pagination(auth_client):
+    for i in range(25):
+        auth_client.post('/notes/new', data={'title': f'ノート{i:02d}', 'content': ''})
+    text = auth_client.get('/dashboard').get_data(as_text=True)
+    # newest first
+    assert 'ノート24' in text and 'ノート15' in text and 'ノート14' not in text
+
+    seen = []
+    url = '/dashboard'
+    while url:
+        rv = auth_client.get(url)
+        text = rv.get_data(as_text=True)
+        seen.extend(sorted((i for i in range(25) if f'ノート{i:02d}<' in text), key=lambda i: text.index(f'ノート{i:02d}<')))
+        nxt = text.split('">次へ</a>')[0].rsplit('href="', 1)[-1] if '次へ' in text else None
+        url = nxt.replace('&amp;', '&') if nxt else None
+    assert seen == list(range(24, -1, -1))
+
+    # walking back from the last page with a "before" cursor
+    assert 'before=' in text
+    prev = text.split('">前へ</a>')[0].rsplit('href="', 1)[-1].replace('&amp;', '&')
+    text = auth_client.get(prev).get_data(as_text=True)
+    assert 'ノート14<' in text and 'ノート05<' in text and 'ノート04<' not in text
+
+    # malformed cursors just start from the top
+    for cursor in ('2026|99999999999999999999999', '2026|²', 'nope'):
+        rv = auth_client.get(f'/dashboard?after={cursor}')
+        assert rv.status_code == 200 and 'ノート24<' in rv.get_data(as_text=True)
+
+
+def test_short_terms_use_bigram_index_and_search_is_per_user(auth_client):
+    auth_client.post('/notes/new', data={'title': '20世紀', 'content': '冷戦と東西対立'})
+    auth_client.post('/notes/new', data={'title': 'フランス', 'content': '1789年の革命 Rome'})
+    with app.app_context():
+        sql, params, _ = note_search_sql(1, '冷戦 東', '', '', '')
+        assert 'LIKE' not in sql and 'notes_bigrams' in sql
+
+    assert '20世紀' in auth_client.get('/dashboard?q=冷戦').get_data(as_text=True)
+    text = auth_client.get('/dashboard?q=革命').get_data(as_text=True)
+    assert 'フランス' in text and '20世紀' not in text
+    # single characters and ASCII pairs, case-insensitively
+    assert '20世紀' in auth_client.get('/dashboard?q=戦').get_data(as_text=True)
+    assert 'フランス' in auth_client.get('/dashboard?q=ro').get_data(as_text=True)
+    assert 'フランス' not in auth_client.get('/dashboard?q=冷戦 革命').get_data(as_text=True)
+    # control characters separate terms instead of breaking the MATCH syntax
+    for q in ('%00', '革%00命', '冷戦%00', "冷戦'%00東西", '%01ro'):
+        rv = auth_client.get(f'/dashboard?q={q}')
+        assert rv.status_code == 200, q
+    assert 'フランス' in auth_client.get('/dashboard?q=革%00命').get_data(as_text=True)
+    text = auth_client.get("/dashboard?q=冷戦%00東西'").get_data(as_text=True)
+    assert '20世紀' not in text
+
+    # another user's notes on the same topic never match
+    auth_client.get('/logout')
+    auth_client.post('/register', data={'username': 'other', 'password': 'pass'})
+    auth_client.post('/login', data={'username': 'other', 'password': 'pass'})
+    auth_client.post('/notes/new', data={'title': '別の人', 'content': '冷戦とフランス革命'})
+    for q in ('冷戦', 'フランス革命', '革命'):
+        text = auth_client.get(f'/dashboard?q={q}').get_data(as_text=True)
+        assert '別の人' in text and '20世紀' not in text and '>フランス<' not in text
+    with app.app_context():
+        owners = query_db('SELECT DISTINCT owner FROM notes_fts')
+        assert len(owners) == 2 and all(len(r['owner']) == 3 for r in owners)
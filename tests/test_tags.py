@@ -0,0 +1,33 @@
+from app import app, query_db, get_db, rebuild_note_tags
+
+
+def test_tag_filter_matches_whole_tags(auth_client):
+    auth_client.post('/notes/new', data={'title': '共和政', 'content': '', 'tags': 'ローマ, 古代'})
+    auth_client.post('/notes/new', data={'title': 'オットー1世', 'content': '', 'tags': '神聖ローマ'})
+
+    text = auth_client.get('/dashboard?tags=ローマ').get_data(as_text=True)
+    assert '共和政' in text and 'オットー1世' not in text
+
+    text = auth_client.get('/dashboard?tags=古代,神聖ローマ').get_data(as_text=True)
+    assert '共和政' in text and 'オットー1世' in text
+
+
+def test_tag_counts_follow_edits_and_backfill(auth_client):
+    auth_client.post('/notes/new', data={'title': 'a', 'content': '', 'tags': '中国,唐'})
+    auth_client.post('/notes/new', data={'title': 'b', 'content': '', 'tags': '中国'})
+    assert auth_client.get('/tags').get_json() == {'tags': [{'tag': '中国', 'count': 2}, {'tag': '唐', 'count': 1}]}
+
+    with app.app_context():
+        nid = query_db("SELECT id FROM notes WHERE title = 'a'", one=True)['id']
+    auth_client.post(f'/notes/{nid}/edit', data={'title': 'a', 'content': '', 'tags': '宋'})
+    auth_client.post('/notes/new', data={'title': 'c', 'content': ''})
+    counts = {t['tag']: t['count'] for t in auth_client.get('/tags').get_json()['tags']}
+    assert counts == {'中国': 1, '宋': 1}
+
+    with app.app_context():
+        db = get_db()
+        db.execute('DELETE FROM note_tags')
+        assert rebuild_note_tags(db) == 2
+        db.commit()
+    counts = {t['tag']: t['count'] for t in auth_client.get('/tags').get_json()['tags']}
+    assert counts == {'中国': 1, '宋': 1}